@@ -35,7 +35,7 @@ from sdsstools.logger import StreamFormatter
 from clu import AMQPClient, CommandStatus
 from clu.model import Model
 
-from basecam import BaseCamera, CameraSystem, Exposure
+from basecam import BaseCamera, CameraError, CameraSystem, Exposure
 #from basecam.actor import CameraActor
 from basecam.events import CameraEvent
 from basecam.mixins import CoolerMixIn, ExposureTypeMixIn, ImageAreaMixIn, ShutterMixIn
@@ -55,7 +55,14 @@ from cluplus.proxy import Proxy, ProxyPartialInvokeException, invoke, unpack
 from astropy.coordinates import SkyCoord, Angle
 import astropy.units as u
 
-from skymakercam.starimage import find_guide_stars, make_synthetic_image
+from skymakercam.catalog import calc_mag_limit, get_cat_using_footprint_async, get_cat_using_healpix2_async
+from skymakercam.framecache import FrameCache, IncrementalRenderer
+from skymakercam.noise import NoiseEngine, NoisePool
+from skymakercam.readout import binned_shape, readout_frame
+from skymakercam.render import RENDER_BACKENDS, RenderContext
+from skymakercam.starimage import find_guide_stars, make_guide_stamps, make_synthetic_cube, make_synthetic_image
+from skymakercam.tilestore import catalog_store
+from skymakercam.video import VideoStream
 
 __all__ = ['SkymakerCameraSystem', 'SkymakerCamera']
 
@@ -153,6 +160,26 @@ class SkymakerCamera(BaseCamera, ExposureTypeMixIn, ImageAreaMixIn, CoolerMixIn,
         self.tcs_pa = 0.0
 
         self.guide_stars = None
+        # gaia queries the Gaia archive, healpix reads the local tiles in catalog_path,
+        # footprint only those of them under the chip, for sky angles within
+        # footprint_rotation_margin (deg) and pointings within footprint_margin_arcmin
+        self.catalog = self.camera_params.get('catalog', 'gaia')
+        self.footprint_rotation_margin = self.camera_params.get('footprint_rotation_margin', 10.0)
+        self.footprint_margin_arcmin = self.camera_params.get('footprint_margin_arcmin', 2.0)
+        self._footprint = None
+        # tiles of catalog_path opened by this camera, on first use
+        self._catalog_store = None
+        # faintest G magnitude of the guide stars, None for mag_lim_lower of instpar,
+        # a single exposure can ask for another depth with mag_limit
+        self.mag_limit = self.camera_params.get('mag_limit', None)
+        self._catalog_depth = None
+        # stars below a signal to noise of faint_sn in an exposure (see calc_mag_limit) are
+        # render: rendered all the same, skip: left out of the catalog query and the image,
+        # background: read, but only their flux is added to the sky background
+        self.faint_stars = self.camera_params.get('faint_stars', 'skip')
+        self.faint_sn = self.camera_params.get('faint_sn', 1.0)
+        if self.faint_stars not in ("render", "skip", "background"):
+            raise CameraError(f"unknown faint_stars mode {self.faint_stars!r}")
         
         self.sky_flux = self.camera_params.get('sky_flux', 15)
         self.seeing_arcsec = self.camera_params.get('seeing_arcsec', 3.5)
@@ -198,13 +225,49 @@ class SkymakerCamera(BaseCamera, ExposureTypeMixIn, ImageAreaMixIn, CoolerMixIn,
         self.log(f"{self.detector_size}")
 
         self.binning = self.camera_params.get('binning', [1, 1])
-
-        self.region_bounds = Size(self.detector_size.wd / self.binning[0], self.detector_size.ht / self.binning[1])
+        self.render_binned = self.camera_params.get('render_binned', True)
+        self.render_backend = self.camera_params.get('render_backend', 'auto')
+        if self.render_backend != 'auto' and self.render_backend not in RENDER_BACKENDS:
+            raise CameraError(f"unknown render backend {self.render_backend}, known are auto, {', '.join(RENDER_BACKENDS)}")
+        self.render_context = self._make_render_context()
+        self._render_state = None
+        # the field rotation is kept while it turns the stars by less than scene_tolerance detector
+        # pixels, it drifts between exposures but the cached frames stay valid. pointing and kmirror
+        # are always rendered as commanded
+        self.scene_tolerance = self.camera_params.get('scene_tolerance', 0.25)
+        self._field_angle = None
+
+        self.region_bounds = Size(self.detector_size.wd // self.binning[0], self.detector_size.ht // self.binning[1])
         self.image_area = Rect(0, 0, self.region_bounds.wd, self.region_bounds.ht)
 
         self.data = None
 
 
+    def _make_render_context(self):
+        """ Render buffers, noise engine and frame caches as configured in camera_params."""
+        params = self.camera_params
+
+        render_threads = params.get('render_threads', 1)
+        noise = NoiseEngine(seed=params.get('seed', None),
+                            threads=params.get('noise_threads', render_threads),
+                            gaussian_lambda=params.get('noise_gaussian_lambda', 1000.0))
+
+        noise_pool_depth = params.get('noise_pool_depth', 0)
+        frame_cache_size = params.get('frame_cache_size', 1)
+
+        incremental = None
+        if params.get('shift_reuse', False):
+            incremental = IncrementalRenderer(max_shift=params.get('shift_max_pixels', 4.0),
+                                              max_rotation=params.get('shift_max_rotation', 0.2),
+                                              method=params.get('shift_method', 'bilinear'))
+
+        return RenderContext(noise=noise,
+                             noise_pool=NoisePool(noise, depth=noise_pool_depth) if noise_pool_depth else None,
+                             threads=render_threads,
+                             tiles=params.get('render_tiles', None),
+                             frame_cache=FrameCache(frame_cache_size) if frame_cache_size else None,
+                             incremental=incremental)
+
     async def _connect_internal(self, **connection_params):
         self.logger.debug(f"connecting ...")
 
@@ -216,7 +279,31 @@ class SkymakerCamera(BaseCamera, ExposureTypeMixIn, ImageAreaMixIn, CoolerMixIn,
         """
         self.logger.debug("disconnect")
 
-    async def create_synthetic_image(self, exposure, ra_h=0.0, dec_d=90.0, pa_d=0.0, km_d=0.0, foc_dt=0.0, **kwargs):
+        # stop the render, noise and tile reader threads, a fresh render context
+        # starts its threads on first use after a reconnect
+        context = self.render_context
+        context.close()
+        if context.noise_pool:
+            context.noise_pool.close()
+        context.noise.close()
+        self.render_context = self._make_render_context()
+        self._render_state = None
+        self._field_angle = None
+
+        if self._catalog_store is not None:
+            self._catalog_store.close()
+            self._catalog_store = None
+            self._footprint = None
+
+    async def _update_scene(self, ra_h=0.0, dec_d=90.0, pa_d=0.0, km_d=0.0, foc_dt=0.0, mag_limit=None, mag_cutoff=None, **kwargs):
+        """ Guide stars and defocus for the telescope state, returns the defocus.
+
+        Stars fainter than ``mag_limit``, by default the depth of the camera,
+        are left out, a catalog read for a brighter depth is read again.
+        In faint_stars mode skip so are stars fainter than the ``mag_cutoff``
+        of the exposure, down to the depth of the catalog already read,
+        the renderer leaves out the stars between the cutoff and that depth.
+        """
 
         self.log(f"focus um {foc_dt}")
         defocus = 1.0 + math.fabs(foc_dt-self._focus_offset)**2.8
@@ -231,16 +318,88 @@ class SkymakerCamera(BaseCamera, ExposureTypeMixIn, ImageAreaMixIn, CoolerMixIn,
         mathar_angle_d = math.degrees(self.sid.fieldAngle(self.site, Target(tcs_coord_current), None))
         self.log(f"mathar angle (deg): {mathar_angle_d}")
 
+        mathar_angle_d = self._settle_field_angle(mathar_angle_d)
         sky_angle = km_d * 2 - mathar_angle_d
         self.log(f"sky angle (deg): {sky_angle:04.4} {pa_d}")
 
+        depth = mag_limit or self.mag_limit or self.inst_params.mag_lim_lower
+        if mag_cutoff is not None and self.faint_stars == "skip":
+            depth = min(depth, max(mag_cutoff, self._loaded_depth()))
+        self.log(f"depth (mag) {depth}")
+
         separation = self.tcs_coord.separation(tcs_coord_current)
         self.log(f"separation {separation.arcminute }")
-        if separation.arcminute > 18 or not self.guide_stars:
+        if self.catalog == "footprint":
+            cat = await self._footprint_catalog(tcs_coord_current, sky_angle, depth)
+            self.tcs_coord = tcs_coord_current
+            self.guide_stars = find_guide_stars(tcs_coord_current, sky_angle, self.inst_params, recycled_cat=cat, mag_limit=depth)
+        elif separation.arcminute > 18 or not self.guide_stars or depth > self._catalog_depth:
             self.tcs_coord = tcs_coord_current
-            self.guide_stars = find_guide_stars(self.tcs_coord, sky_angle, self.inst_params, remote_catalog=True)
+            self._catalog_depth = depth
+            if self.catalog == "healpix":
+                # local tiles, read in parallel without blocking the event loop
+                cat = await get_cat_using_healpix2_async(self.tcs_coord, self.inst_params, store=self._tile_store(), mag_limit=depth)
+                self.guide_stars = find_guide_stars(self.tcs_coord, sky_angle, self.inst_params, recycled_cat=cat, mag_limit=depth)
+            else:
+                self.guide_stars = find_guide_stars(self.tcs_coord, sky_angle, self.inst_params, remote_catalog=True, mag_limit=depth)
         else:
-            self.guide_stars = find_guide_stars(tcs_coord_current, sky_angle, self.inst_params, remote_catalog=False, cull_cat=False)
+            self.guide_stars = find_guide_stars(tcs_coord_current, sky_angle, self.inst_params, remote_catalog=False, cull_cat=False, mag_limit=depth)
+
+        # pointing, pa, depth, focus or seeing changed, the cached noiseless frames are stale
+        render_state = (ra_h, dec_d, sky_angle, depth, defocus, self.seeing_arcsec)
+        frame_cache = self.render_context.frame_cache
+        if frame_cache is not None:
+            if render_state != self._render_state:
+                frame_cache.invalidate()
+            self.log(f"frame cache hits {frame_cache.hits} misses {frame_cache.misses}")
+        self._render_state = render_state
+
+        return defocus
+
+    def _loaded_depth(self):
+        # depth of the catalog read for the last exposure, -inf before the first one
+        if self.catalog == "footprint":
+            return self._footprint[2] if self._footprint is not None else -math.inf
+        return self._catalog_depth if self.guide_stars else -math.inf
+
+    def _settle_field_angle(self, field_angle):
+        """ Field angle of the last exposure, as long as the drift of the field rotation since
+        turned the stars on the field edge r_outer by at most scene_tolerance pixels."""
+        pixel_mm = self.inst_params.chip_size_mm[0] / self.inst_params.chip_size_pix[0]
+        if self._field_angle is not None:
+            turned = abs((field_angle - self._field_angle + 180.0) % 360.0 - 180.0)
+            if math.radians(turned) * self.inst_params.r_outer <= self.scene_tolerance * pixel_mm:
+                return self._field_angle
+        self._field_angle = field_angle
+        return self._field_angle
+
+    async def _footprint_catalog(self, coord, sky_angle, depth):
+        """ Stars of the tiles under the chip, read again when coord or sky_angle leave the covered area
+        or depth is fainter than the one read."""
+        if self._footprint is not None:
+            center, angle, read_depth, cat = self._footprint
+            turned = abs((sky_angle - angle + 180.0) % 360.0 - 180.0)
+            if center.separation(coord).arcminute <= self.footprint_margin_arcmin and \
+               turned <= self.footprint_rotation_margin and depth <= read_depth:
+                return cat
+
+        margin_mm = self.footprint_margin_arcmin * 60.0 * self.inst_params.image_scale / 1e3
+        cat = await get_cat_using_footprint_async(coord, sky_angle, self.inst_params,
+                                                  rotation_margin=self.footprint_rotation_margin,
+                                                  margin_mm=margin_mm, store=self._tile_store(), mag_limit=depth)
+        self.log(f"footprint catalog {len(cat)} stars")
+        self._footprint = (coord, sky_angle, depth, cat)
+        return cat
+
+    def _tile_store(self):
+        # the catalog tiles of this camera, closed on disconnect
+        if self._catalog_store is None:
+            self._catalog_store = catalog_store(self.inst_params.catalog_path, shared=False)
+        return self._catalog_store
+
+    async def create_synthetic_image(self, exposure, binning=(1, 1), window=None, **kwargs):
+
+        defocus = await self._update_scene(**kwargs)
 
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(
@@ -253,37 +412,220 @@ class SkymakerCamera(BaseCamera, ExposureTypeMixIn, ImageAreaMixIn, CoolerMixIn,
                 exp_time=exposure.exptime,
                 seeing_arcsec=self.seeing_arcsec,
                 sky_flux=self.sky_flux,
-                defocus=defocus
+                defocus=defocus,
+                backend=self.render_backend,
+                binning=binning,
+                window=window,
+                context=self.render_context,
+                **self._faint_render(kwargs.get("mag_cutoff", None))
             )
         )
-        
 
-    async def _expose_internal(self, exposure, **kwargs):
+    def _faint_render(self, mag_cutoff):
+        # render arguments for the stars below mag_cutoff, in faint_stars mode background
+        # their flux is folded into the sky, in mode skip those of a deeper catalog are left out
+        if mag_cutoff is None or self.faint_stars == "render":
+            return {}
+        return {"mag_cutoff": mag_cutoff, "fold_faint": self.faint_stars == "background"}
+
+    def _faint_cutoff(self, exptime, mag_limit=None):
+        # faintest G magnitude worth rendering in an exposure of exptime, at most the depth,
+        # rounded up to 0.1 mag so that close exposure times share catalog reads and cached frames
+        depth = mag_limit or self.mag_limit or self.inst_params.mag_lim_lower
+        cutoff = calc_mag_limit(self.inst_params, sn=self.faint_sn, sky_flux=self.sky_flux, exp_time=exptime)
+        return min(depth, math.ceil(float(cutoff) * 10) / 10)
 
-        def rebin(arr, bin):
-            new_shape=[int(arr.shape[0]/bin[0]), int(arr.shape[1]/bin[1])]
-            shape = (new_shape[0], arr.shape[0] // new_shape[0],
-                    new_shape[1], arr.shape[1] // new_shape[1])
-            return arr.reshape(shape).sum(-1).sum(1)
 
-        exposure.scraper_store = self.scraper_store.copy()
+    def _scraper_store(self, exptime=None, **kwargs):
+        # telescope state of an exposure, the scraped values overridden by km_d, ra_h and dec_d,
+        # the depth mag_limit of this exposure if given and the mag_cutoff of faint stars for exptime
+        scraper_store = self.scraper_store.copy()
 
         if kmirror_angle := kwargs.get("km_d", None):
-            exposure.scraper_store.set("km_d", kmirror_angle)
+            scraper_store.set("km_d", kmirror_angle)
 
         if ra_h := kwargs.get("ra_h", None):
             if dec_d := kwargs.get("dec_d", None):
-                exposure.scraper_store.set("ra_h", ra_h)
-                exposure.scraper_store.set("dec_d", dec_d)
+                scraper_store.set("ra_h", ra_h)
+                scraper_store.set("dec_d", dec_d)
+
+        if mag_limit := kwargs.get("mag_limit", None):
+            scraper_store.set("mag_limit", mag_limit)
+
+        if exptime and self.faint_stars != "render":
+            scraper_store.set("mag_cutoff", self._faint_cutoff(exptime, kwargs.get("mag_limit", None)))
+
+        return scraper_store
+
+    async def expose_stamps(self, exptime, centers=None, nstamps=4, size=32, **kwargs):
+        """ Guide box readout, renders only stamps instead of a full frame.
+
+        :param exptime: exposure time in seconds
+        :type exptime: float
+        :param centers: guide boxes as (x, y, size) around 0-indexed binned pixel x, y,
+                        if None boxes of ``size`` around the ``nstamps`` brightest guide stars
+        :type centers: list
+        :param nstamps: number of guide stars if no centers are given
+        :type nstamps: int
+        :param size: box size in binned pixels if no centers are given
+        :type size: int
+        :return: uint16 stack of shape (n, size, size) and per stamp metadata
+        :rtype: tuple
+        """
+        scraper_store = self._scraper_store(exptime, **kwargs)
+        obstime = astropy.time.Time.now()
+        defocus = await self._update_scene(**scraper_store)
+
+        hbin, vbin = self.binning
+        stars = [None] * len(centers) if centers is not None else []
+        if centers is None:
+            # the pixel center convention of the binned renderer
+            x_position = (self.guide_stars.chip_xxs / self.inst_params.chip_size_mm[0] * self.inst_params.chip_size_pix[0] + 0.5) / hbin - 0.5
+            y_position = (self.guide_stars.chip_yys / self.inst_params.chip_size_mm[1] * self.inst_params.chip_size_pix[1] + 0.5) / vbin - 0.5
+            on_chip = np.flatnonzero((x_position >= 0) & (x_position < self.region_bounds.wd) &
+                                     (y_position >= 0) & (y_position < self.region_bounds.ht))
+            stars = on_chip[np.argsort(self.guide_stars.mags[on_chip], kind="stable")[:nstamps]]
+            centers = [(x_position[star], y_position[star], size) for star in stars]
+
+        mag_cutoff = dict(scraper_store).get("mag_cutoff", None)
+        loop = asyncio.get_event_loop()
+        try:
+            stack, windows = await loop.run_in_executor(
+                None,
+                lambda: make_guide_stamps(
+                    chip_x=self.guide_stars.chip_xxs,
+                    chip_y=self.guide_stars.chip_yys,
+                    gmag=self.guide_stars.mags,
+                    inst=self.inst_params,
+                    centers=centers,
+                    exp_time=exptime,
+                    seeing_arcsec=self.seeing_arcsec,
+                    sky_flux=self.sky_flux,
+                    defocus=defocus,
+                    backend=self.render_backend,
+                    binning=self.binning,
+                    context=self.render_context,
+                    **self._faint_render(mag_cutoff)
+                )
+            )
+        except ValueError as ex:
+            # guide boxes of different sizes or larger than the chip
+            raise CameraError(f"guide stamps: {ex}") from ex
+
+        data = np.empty(stack.shape, np.uint16)
+        for stamp, out in zip(stack, data):
+            readout_frame(stamp, gain=self.gain, out=out)
+
+        metadata = []
+        for (x0, y0, wd, ht), star in zip(windows, stars):
+            meta = {"x0": x0, "y0": y0, "size": wd, "exptime": exptime, "obstime": obstime.isot, "binning": [hbin, vbin]}
+            if mag_cutoff is not None:
+                meta["mag_cutoff"] = mag_cutoff
+            if star is not None:
+                meta.update(ra=float(self.guide_stars.ras[star]), dec=float(self.guide_stars.decs[star]),
+                            mag=float(self.guide_stars.mags[star]))
+            metadata.append(meta)
+
+        return data, metadata
+
+    async def expose_burst(self, exptime, nframes, jitter_arcsec=None, **kwargs):
+        """ Burst readout, renders ``nframes`` exposures of the same field in one call.
+
+        The guide stars, field angle and PSF are set up once and the stars
+        rendered once, only the noise and the optional jitter differ per frame.
+
+        :param exptime: exposure time of every frame in seconds
+        :type exptime: float
+        :param nframes: number of frames
+        :type nframes: int
+        :param jitter_arcsec: rms of random pointing offsets per frame, or (nframes, 2) offsets (dx, dy)
+        :type jitter_arcsec: float or numpy.ndarray
+        :return: uint16 cube of shape (nframes, ht, wd) and its metadata
+        :rtype: tuple
+        """
+        scraper_store = self._scraper_store(exptime, **kwargs)
+        obstime = astropy.time.Time.now()
+        defocus = await self._update_scene(**scraper_store)
+
+        binning = self.binning if self.render_binned else (1, 1)
+        window = self._render_window((1, 1) if self.render_binned else self.binning)
+
+        loop = asyncio.get_event_loop()
+        cube, offsets = await loop.run_in_executor(
+            None,
+            lambda: make_synthetic_cube(
+                chip_x=self.guide_stars.chip_xxs,
+                chip_y=self.guide_stars.chip_yys,
+                gmag=self.guide_stars.mags,
+                inst=self.inst_params,
+                n_frames=nframes,
+                exp_time=exptime,
+                seeing_arcsec=self.seeing_arcsec,
+                sky_flux=self.sky_flux,
+                defocus=defocus,
+                backend=self.render_backend,
+                binning=binning,
+                window=window,
+                jitter_arcsec=jitter_arcsec,
+                context=self.render_context,
+                **self._faint_render(dict(scraper_store).get("mag_cutoff", None))
+            )
+        )
+
+        readout_binning = (1, 1) if self.render_binned else self.binning
+        data = np.empty((nframes,) + binned_shape(cube.shape[1:], readout_binning), np.uint16)
+        for frame, out in zip(cube, data):
+            readout_frame(frame, readout_binning, self.gain, out=out)
+
+        metadata = {"exptime": exptime, "obstime": obstime.isot, "binning": list(self.binning),
+                    "image_area": await self._get_image_area_internal(), "jitter_arcsec": offsets.tolist(),
+                    "scraper_store": dict(scraper_store)}
+        return data, metadata
+
+    def stream(self, exptime, fps=None, maxsize=2, policy="drop-oldest", **kwargs):
+        """ Video mode, an async iterator of exposures taken back to back.
+
+        The next exposure is rendered while the consumer handles the current
+        one, see `.VideoStream` for cadence, queue policy and statistics.
+        Every frame owns its data, a frame held by the consumer never changes.
+
+        :param exptime: exposure time in seconds
+        :type exptime: float
+        :param fps: frames per second to aim for, None for as fast as possible
+        :type fps: float
+        :param maxsize: frames queued at most
+        :type maxsize: int
+        :param policy: "drop-oldest" or "block" when the consumer falls behind
+        :type policy: str
+        :return: the stream, iterate with ``async for exposure in stream``
+        :rtype: VideoStream
+        """
+        async def produce():
+            return await self.expose(exptime, **kwargs)
+
+        return VideoStream(produce, fps=fps, maxsize=maxsize, policy=policy)
+
+    async def _expose_internal(self, exposure, **kwargs):
+
+        exposure.scraper_store = self._scraper_store(exposure.exptime, **kwargs)
 
         self.notify(CameraEvent.EXPOSURE_INTEGRATING)
 
-        data = await self.create_synthetic_image(exposure, **exposure.scraper_store)
+        if self.render_binned:
+            data = await self.create_synthetic_image(exposure, binning=self.binning, window=self._render_window((1, 1)),
+                                                     **exposure.scraper_store)
+            binning = (1, 1)
+        else:
+            data = await self.create_synthetic_image(exposure, window=self._render_window(self.binning),
+                                                     **exposure.scraper_store)
+            binning = self.binning
 
 #        self.notify(CameraEvent.EXPOSURE_READING)
 
-        # we convert everything to U16 for basecam compatibility
-        exposure.data = rebin(data, self.binning).astype(np.uint16)
+        # we convert everything to U16 for basecam compatibility, saturating at the ADC range.
+        # every exposure owns its data, only the float scratch rows are reused.
+        scratch = self.render_context.buffer("readout_scratch", (64, binned_shape(data.shape, binning)[1]))
+        exposure.data = readout_frame(data, binning, self.gain, scratch=scratch)
 #        exposure.obstime = astropy.time.Time("2000-01-01 00:00:00")
         exposure.obstime = astropy.time.Time.now()
 
@@ -293,13 +635,17 @@ class SkymakerCamera(BaseCamera, ExposureTypeMixIn, ImageAreaMixIn, CoolerMixIn,
         return exposure
 
     def _status_internal(self):
-        return {"temperature": self.temperature, "cooler": math.nan}
+        status = {"temperature": self.temperature, "cooler": math.nan}
+        if self.render_context.frame_cache is not None:
+            status["frame_cache_hits"] = self.render_context.frame_cache.hits
+            status["frame_cache_misses"] = self.render_context.frame_cache.misses
+        return status
 
     async def _get_binning_internal(self):
         return self.binning
 
     async def _set_binning_internal(self, hbin, vbin):
-        self.region_bounds = Size(self.detector_size.wd / hbin, self.detector_size.ht / vbin)
+        self.region_bounds = Size(self.detector_size.wd // hbin, self.detector_size.ht // vbin)
         self.image_area = Rect(0, 0, self.region_bounds.wd, self.region_bounds.ht)
         self.binning = [hbin, vbin]
 
@@ -315,11 +661,27 @@ class SkymakerCamera(BaseCamera, ExposureTypeMixIn, ImageAreaMixIn, CoolerMixIn,
         self._changetemperature_task = self.loop.create_task(changetemperature())
 
     async def _get_image_area_internal(self):
-
-        return self.image_area
+        x0, y0, wd, ht = self.image_area
+        return (x0 + 1, x0 + wd, y0 + 1, y0 + ht)
 
     async def _set_image_area_internal(self, area=None):
-        return # not supported
+        """Internal method to set the image area, 1-indexed (x0, x1, y0, y1) in binned pixels."""
+        if area is None:
+            self.image_area = Rect(0, 0, self.region_bounds.wd, self.region_bounds.ht)
+            return
+
+        x0, x1, y0, y1 = (int(a) for a in area)
+        if not (1 <= x0 <= x1 <= self.region_bounds.wd and 1 <= y0 <= y1 <= self.region_bounds.ht):
+            raise CameraError(f"image area {area} outside of {self.region_bounds}")
+        self.image_area = Rect(x0 - 1, y0 - 1, x1 - x0 + 1, y1 - y0 + 1)
+
+    def _render_window(self, binning):
+        # image area on the render grid, None for the full chip
+        if tuple(self.image_area) == (0, 0, self.region_bounds.wd, self.region_bounds.ht):
+            return None
+        x0, y0, wd, ht = self.image_area
+        hbin, vbin = binning
+        return (x0 * hbin, y0 * vbin, wd * hbin, ht * vbin)
 
     async def _set_gain_internal(self, gain):
         """Internal method to set the gain."""
@@ -13,6 +13,8 @@ from scipy.ndimage import gaussian_filter, gaussian_gradient_magnitude
 from scipy import optimize
 import healpy as hp
 from astropy.table import Table, hstack, vstack
+
+from skymakercam.tilestore import catalog_store, concatenate_tiles
 #Instrument specs
 
 
@@ -46,36 +48,111 @@ def get_cat_using_healpix(c:SkyCoord, inst, plotflag=False):
     return data_combined
 
 
-def get_cat_using_healpix2(c:SkyCoord, inst, plotflag=False, verbose=False):
+def healpix_disc(c:SkyCoord, inst, nside=64):
+    # nested pixels of the cone of outer_search_radius around c
     vec = hp.ang2vec(np.deg2rad(-c.dec.value + 90), np.deg2rad(c.ra.value))
+    return hp.query_disc(nside=nside, vec=vec, radius=np.deg2rad(inst.outer_search_radius),inclusive=True,nest=True)
+
 
-    ipix_disc = hp.query_disc(nside=64, vec=vec, radius=np.deg2rad(inst.outer_search_radius),inclusive=True,nest=True)
+def get_cat_using_healpix2(c:SkyCoord, inst, plotflag=False, verbose=False, store=None, mag_limit=None):
+    # tiles come from store, default the shared store of inst.catalog_path (see catalog_store), the
+    # magnitude pyramid in Gaia_Healpix_pyramid if built, else the packed Gaia_Healpix_6.pack file,
+    # else the columnar Gaia_Healpix_6_columns tiles if converted, else the structured Gaia_Healpix_6 ones.
+    # the store keeps recently used tiles across calls and opens missing ones in parallel.
+    # with mag_limit only stars brighter than it are returned, a prefix of each columnar tile,
+    # from a magnitude pyramid only the levels brighter than it are read.
+    ipix_disc = healpix_disc(c, inst)
     if verbose: 
         print(ipix_disc)
 
+    if store is None:
+        store = catalog_store(inst.catalog_path)
+
     if plotflag:
         fig,ax = plt.subplots(figsize=(12,12))
         ax.set_aspect("equal")
         ax.axhline(c.dec.value)
         ax.axvline(c.ra.value)
-        
-    counter=0
-    for ipix in ipix_disc:
-        filename = inst.catalog_path + "/Gaia_Healpix_6/lvl6_{:06d}.npy".format(ipix)
-        data = np.load(filename)
-        #hdul = fits.open(filename)
-        #data= Table(hdul[1].data)
-        if verbose: print(filename,len(data))
-        #data = data.filled()
+
+    tiles = store.tiles(ipix_disc, mag_limit)
+    for ipix, data in zip(ipix_disc, tiles):
+        if verbose: print(store.path(ipix),len(data))
         if plotflag:
             ax.plot(data["ra"],data["dec"],".")
-        if counter==0:
-            data_combined = data
-            counter+=1
-        else:
-            #data_combined = vstack([data_combined, data])
-            data_combined = np.concatenate([data_combined, data])
-    return data_combined
+
+    return concatenate_tiles(tiles)
+
+
+async def get_cat_using_healpix2_async(c:SkyCoord, inst, store=None, mag_limit=None):
+    # get_cat_using_healpix2 for the event loop, the tiles are read in an executor.
+    if store is None:
+        store = catalog_store(inst.catalog_path)
+    return await store.query_async(healpix_disc(c, inst), mag_limit)
+
+
+def chip_polygon(c:SkyCoord, pa, inst, east_is_right=True, margin_mm=0.0):
+    # ra, dec in degrees of the corners of the guider chip for the field center c and position angle pa,
+    # the inverse of ad2xy and in_box as find_guide_stars uses them. margin_mm grows the chip on all sides.
+    half_width = inst.chip_size_mm[0] / 2.
+    top = np.sqrt(inst.r_outer**2 - half_width**2)
+    bottom = top - inst.chip_size_mm[1]
+    x = np.array([-1., 1., 1., -1.]) * (half_width + margin_mm)
+    y = np.array([bottom - margin_mm, bottom - margin_mm, top + margin_mm, top + margin_mm])
+
+    # chip to focal plane, find_guide_stars flips x and pa if east_is_right
+    if east_is_right:
+        pa = -pa
+    cos_pa, sin_pa = np.cos(np.deg2rad(pa)), np.sin(np.deg2rad(pa))
+    x, y = x * cos_pa - y * sin_pa, x * sin_pa + y * cos_pa
+    if east_is_right:
+        x = -x
+
+    # focal plane to sky, ad2xy measures y along the meridian and x along the parallel of the star
+    dec = c.dec.deg + y * 1e3 / inst.image_scale / 3600.
+    half_dx = np.deg2rad(np.abs(x) * 1e3 / inst.image_scale / 3600.) / 2.
+    dra = 2. * np.rad2deg(np.arcsin(np.clip(np.sin(half_dx) / np.cos(np.deg2rad(dec)), -1., 1.)))
+    ra = c.ra.deg - np.sign(x) * dra
+    return ra, dec
+
+
+def chip_footprint(c:SkyCoord, pa, inst, nside=64, rotation_margin=0.0, margin_mm=0.1, east_is_right=True):
+    # nested pixels of the tiles the guider chip touches for position angles within pa +- rotation_margin.
+    # the chip is sampled every 2 degrees of pa, each sample grown by the arc its far corner
+    # moves within half a step, and by margin_mm for the edges mapped as great circles.
+    # close to a pole, where the chip corners of chip_polygon wrap around it, the pixels
+    # of the disc the chip can reach are returned instead.
+    steps = int(np.ceil(2. * rotation_margin / 2.)) + 1
+    grow = margin_mm + inst.r_outer * np.deg2rad(rotation_margin / max(steps - 1, 1))
+    margin = grow if rotation_margin else margin_mm
+    # the far chip corners lie on r_outer, grown by the margin along both edges
+    reach = (inst.r_outer + np.sqrt(2.) * margin) * 1e3 / inst.image_scale / 3600.
+    if 90. - np.abs(c.dec.deg) < 2. * reach:
+        vec = hp.ang2vec(c.ra.deg, c.dec.deg, lonlat=True)
+        return np.sort(hp.query_disc(nside, vec, np.deg2rad(reach), inclusive=True, nest=True)).astype(np.int64)
+    pixels = set()
+    for angle in np.linspace(pa - rotation_margin, pa + rotation_margin, steps):
+        ra, dec = chip_polygon(c, angle, inst, east_is_right, margin)
+        vertices = hp.ang2vec(ra, dec, lonlat=True)
+        pixels.update(hp.query_polygon(nside, vertices, inclusive=True, nest=True).tolist())
+    return np.array(sorted(pixels), dtype=np.int64)
+
+
+def get_cat_using_footprint(c:SkyCoord, pa, inst, rotation_margin=0.0, margin_mm=0.1, east_is_right=True, store=None, mag_limit=None):
+    # like get_cat_using_healpix2, but only the tiles the guider chip touches (see chip_footprint)
+    # instead of all tiles of the outer_search_radius cone. the stars of these tiles beyond the
+    # chip are still returned, find_guide_stars selects the ones on the chip.
+    if store is None:
+        store = catalog_store(inst.catalog_path)
+    pixels = chip_footprint(c, pa, inst, rotation_margin=rotation_margin, margin_mm=margin_mm, east_is_right=east_is_right)
+    return store.query(pixels, mag_limit)
+
+
+async def get_cat_using_footprint_async(c:SkyCoord, pa, inst, rotation_margin=0.0, margin_mm=0.1, east_is_right=True, store=None, mag_limit=None):
+    # get_cat_using_footprint for the event loop, the tiles are read in an executor.
+    if store is None:
+        store = catalog_store(inst.catalog_path)
+    pixels = chip_footprint(c, pa, inst, rotation_margin=rotation_margin, margin_mm=margin_mm, east_is_right=east_is_right)
+    return await store.query_async(pixels, mag_limit)
 
 
 def calc_sn(gmag, inst, n_pix=7*7, sky_flux=10, exp_time=5):
@@ -86,3 +163,13 @@ def calc_sn(gmag, inst, n_pix=7*7, sky_flux=10, exp_time=5):
         noise = np.sqrt(inst.readout_noise**2+signal+n_pix*background)
         sn = signal/noise
         return sn
+
+
+def calc_mag_limit(inst, sn=1.0, n_pix=7*7, sky_flux=10, exp_time=5):
+    # G magnitude at which calc_sn reaches sn, fainter stars have a lower signal to noise.
+    # the noise model of calc_sn solved for the signal S = flux * exp_time,
+    # S**2 = sn**2 * (readout_noise**2 + S + n_pix * background), works on arrays of sky_flux and exp_time.
+    background = (sky_flux + inst.dark_current) * exp_time
+    sn2 = sn ** 2
+    signal = (sn2 + np.sqrt(sn2 ** 2 + 4 * sn2 * (inst.readout_noise ** 2 + n_pix * background))) / 2
+    return -2.5 * np.log10(signal / exp_time) - inst.zp
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: framecache.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import hashlib
+import math
+from collections import OrderedDict
+
+import numpy as np
+from scipy.fft import irfft2, next_fast_len, rfft2
+from scipy.ndimage import affine_transform, fourier_shift
+
+
+__all__ = ['FrameCache', 'IncrementalRenderer']
+
+
+class FrameCache:
+    """ Noiseless, convolved star images normalized to one second exposure.
+
+    The image of a star field only scales with the exposure time, so
+    repeated exposures of the same guide stars with the same seeing and
+    defocus only need a multiplication and new noise. Entries are keyed
+    with ``key``, the least recently used beyond ``maxsize`` is dropped.
+
+    :param maxsize: number of frames kept
+    :type maxsize: int
+    """
+
+    def __init__(self, maxsize=1):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+
+    @staticmethod
+    def key(x_position, y_position, flux, shape, seeing_pixel, defocus, backend):
+        """ Cache key of a star field rendered with the given PSF and backend."""
+        digest = hashlib.blake2b(digest_size=16)
+        for array in (x_position, y_position, flux):
+            digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+        return (digest.hexdigest(), tuple(shape), seeing_pixel, defocus, backend)
+
+    def get(self, key):
+        """ The cached frame for ``key`` or None, counts hits and misses."""
+        frame = self._frames.get(key)
+        if frame is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._frames.move_to_end(key)
+        return frame
+
+    def put(self, key, frame):
+        """ Keep a copy of ``frame`` under ``key``."""
+        spare = None
+        if key not in self._frames and len(self._frames) >= self.maxsize:
+            _, spare = self._frames.popitem(last=False)
+        if spare is None or spare.shape != frame.shape or spare.dtype != frame.dtype:
+            spare = np.empty_like(frame)
+        np.copyto(spare, frame)
+        self._frames[key] = spare
+
+    def invalidate(self):
+        """ Drop all frames, e.g. after the telescope or the focus moved."""
+        self._frames.clear()
+
+    def __len__(self):
+        return len(self._frames)
+
+
+class IncrementalRenderer:
+    """ Reuse of the last rendered noiseless frame for small telescope moves.
+
+    While guiding, consecutive frames show the same stars moved by a few
+    pixels or rotated by a fraction of a degree. ``render`` fits the
+    translation and rotation between the stars of the last full render
+    (the anchor) and the new positions and resamples the anchor frame
+    instead of rendering again. It declines with None if the star set
+    changed, the PSF or frame changed, the fit leaves residuals or the move
+    exceeds the limits, the caller then renders and calls ``remember``.
+    Shifts always start from the anchor, so interpolation blur does not
+    accumulate. PSF wings of stars close to the edge are not restored.
+
+    :param max_shift: largest star displacement in pixels
+    :type max_shift: float
+    :param max_rotation: largest rotation in degrees
+    :type max_rotation: float
+    :param tolerance: largest residual of the rigid fit in pixels
+    :type tolerance: float
+    :param method: "bilinear" or "fourier", the latter falls back to bilinear for rotations
+    :type method: str
+    """
+
+    def __init__(self, max_shift=4.0, max_rotation=0.2, tolerance=0.05, method="bilinear"):
+        if method not in ("bilinear", "fourier"):
+            raise ValueError(f"unknown shift method {method!r}")
+        self.max_shift = max_shift
+        self.max_rotation = max_rotation
+        self.tolerance = tolerance
+        self.method = method
+        self.reused = 0
+        self.rendered = 0
+        self._anchor = None
+        self._spectrum = None
+
+    def remember(self, x_position, y_position, flux, params, frame):
+        """ Make a freshly rendered frame the anchor of the following shifts.
+
+        :param params: anything identifying the PSF and grid, e.g. (shape, seeing, defocus, backend)
+        """
+        self.rendered += 1
+        self._anchor = (np.array(x_position, dtype=float), np.array(y_position, dtype=float),
+                        np.array(flux, dtype=float), params, frame.copy())
+        self._spectrum = None
+
+    def render(self, x_position, y_position, flux, params, out):
+        """ The anchor moved onto the new star positions in ``out``, None if not applicable."""
+        if self._anchor is None:
+            return None
+        x_anchor, y_anchor, flux_anchor, params_anchor, frame = self._anchor
+        if params != params_anchor or frame.shape != out.shape or not np.array_equal(flux, flux_anchor):
+            return None
+
+        move = self._fit(x_anchor, y_anchor, np.asarray(x_position, dtype=float), np.asarray(y_position, dtype=float))
+        if move is None:
+            return None
+        angle, shift_x, shift_y = move
+
+        if self.method == "fourier" and angle == 0.0:
+            self._fourier_shift(frame, shift_y, shift_x, out)
+        else:
+            cos, sin = math.cos(angle), math.sin(angle)
+            # affine_transform maps output (y, x) onto input (y, x): the inverse rotation
+            matrix = np.array([[cos, -sin], [sin, cos]])
+            offset = -matrix @ np.array([shift_y, shift_x])
+            affine_transform(frame, matrix, offset=offset, output=out, order=1, mode="constant")
+        np.maximum(out, 0, out=out)
+
+        self.reused += 1
+        return out
+
+    def _fit(self, x_anchor, y_anchor, x_position, y_position):
+        # least squares rotation and translation taking the anchor stars onto the new ones
+        if x_anchor.size == 0:
+            return 0.0, 0.0, 0.0
+        anchor = np.stack([x_anchor, y_anchor], axis=1)
+        target = np.stack([x_position, y_position], axis=1)
+        anchor_center, target_center = anchor.mean(axis=0), target.mean(axis=0)
+        h = (anchor - anchor_center).T @ (target - target_center)
+        angle = math.atan2(h[0, 1] - h[1, 0], h[0, 0] + h[1, 1])
+        if abs(math.degrees(angle)) > self.max_rotation:
+            return None
+        if abs(angle) < 1e-9:
+            angle = 0.0
+
+        cos, sin = math.cos(angle), math.sin(angle)
+        rotation = np.array([[cos, -sin], [sin, cos]])
+        shift = target_center - rotation @ anchor_center
+        residual = target - (anchor @ rotation.T + shift)
+        if np.abs(residual).max() > self.tolerance or np.abs(target - anchor).max() > self.max_shift:
+            return None
+        return angle, shift[0], shift[1]
+
+    def _fourier_shift(self, frame, shift_y, shift_x, out):
+        # pad by the largest shift so nothing wraps around the frame edges
+        ny, nx = frame.shape
+        pad = int(math.ceil(self.max_shift)) + 1
+        padded = (next_fast_len(ny + pad, real=True), next_fast_len(nx + pad, real=True))
+        if self._spectrum is None or self._spectrum[0] != padded:
+            self._spectrum = (padded, rfft2(frame, s=padded))
+        spectrum = fourier_shift(self._spectrum[1], (shift_y, shift_x), n=padded[1])
+        shifted = irfft2(spectrum, s=padded, overwrite_x=True)
+        # negative shifts pull in pixels from the far end of the padding, which is empty
+        out[...] = shifted[:ny, :nx]
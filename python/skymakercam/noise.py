@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: noise.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+__all__ = ['NoiseEngine', 'NoisePool']
+
+
+class NoiseEngine:
+    """ Detector noise drawn from independent numpy Generator streams.
+
+    A frame is cut into chunks of ``chunk_rows`` rows, every chunk gets its
+    own ``Generator`` spawned from the engine's ``SeedSequence``. The noise
+    of a frame therefore only depends on the seed and the number of frames
+    drawn before, not on the number of threads.
+
+    :param seed: seed or SeedSequence, None for fresh entropy
+    :type seed: int or numpy.random.SeedSequence
+    :param threads: number of threads drawing chunks in parallel
+    :type threads: int
+    :param gaussian_lambda: expected counts from which on poisson noise is
+                            approximated by a normal distribution, None to never approximate
+    :type gaussian_lambda: float
+    :param chunk_rows: rows per chunk
+    :type chunk_rows: int
+    """
+
+    def __init__(self, seed=None, threads=1, gaussian_lambda=1000.0, chunk_rows=64):
+        self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.threads = threads
+        self.gaussian_lambda = gaussian_lambda
+        self.chunk_rows = chunk_rows
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="noise") if threads > 1 else None
+
+    def close(self):
+        """ Stop the worker threads."""
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+
+    def generator(self):
+        """ A Generator on a new stream spawned from the engine, for other random draws."""
+        with self._lock:
+            return np.random.default_rng(self.seed_sequence.spawn(1)[0])
+
+    def apply(self, frame, background=0.0, readout_noise=0.0, bias=0.0):
+        """ Replace an expected star image by a noisy frame, in place.
+
+        The sum of poisson variates is poisson, so stars and background
+        share one draw of Poisson(star + background). Read noise and bias
+        are added on top. Without background only pixels with signal are
+        drawn, for a star image that gets its detector noise from a
+        ``NoisePool``.
+
+        :param frame: expected electrons per pixel from the stars, overwritten
+        :type frame: numpy.ndarray
+        :param background: expected background electrons per pixel
+        :type background: float
+        :param readout_noise: read noise sigma in electrons
+        :type readout_noise: float
+        :param bias: bias level in electrons
+        :type bias: float
+        :return: frame
+        :rtype: numpy.ndarray
+        """
+        rows = range(0, frame.shape[0], self.chunk_rows)
+        with self._lock:
+            streams = self.seed_sequence.spawn(len(rows))
+
+        def draw(row, stream):
+            rng = np.random.default_rng(stream)
+            chunk = frame[row:row + self.chunk_rows]
+            if background:
+                chunk += background
+                self._photon_noise(rng, chunk)
+            else:
+                signal = chunk > 0
+                if signal.any():
+                    values = chunk[signal]
+                    self._photon_noise(rng, values)
+                    chunk[signal] = values
+            if readout_noise:
+                self._readout_noise(rng, chunk, readout_noise, bias)
+            elif bias:
+                chunk += bias
+
+        if self._executor:
+            list(self._executor.map(draw, rows, streams))
+        else:
+            for row, stream in zip(rows, streams):
+                draw(row, stream)
+
+        return frame
+
+    def _photon_noise(self, rng, chunk):
+        if self.gaussian_lambda is None:
+            chunk[...] = rng.poisson(chunk)
+            return
+
+        high = chunk >= self.gaussian_lambda
+        if not high.any():
+            chunk[...] = rng.poisson(chunk)
+            return
+
+        low = ~high
+        if low.any():
+            chunk[low] = rng.poisson(chunk[low])
+        lam = chunk[high]
+        lam += np.sqrt(lam) * rng.standard_normal(lam.size, dtype=_normal_dtype(chunk))
+        chunk[high] = lam
+
+    def _readout_noise(self, rng, chunk, readout_noise, bias):
+        noise = rng.standard_normal(chunk.shape, dtype=_normal_dtype(chunk))
+        noise *= readout_noise
+        noise += bias
+        chunk += noise
+
+
+class NoisePool:
+    """ Detector noise frames prepared ahead of time by a background thread.
+
+    Background photon noise, read noise and bias do not depend on the star
+    field. For every parameter set asked for with ``get`` the pool keeps
+    ``depth`` ready frames of Poisson(background) + Normal(bias, readout_noise)
+    and a worker thread tops them up, so ``get`` normally returns at once.
+    Every parameter set draws from its own stream spawned from the engine,
+    frames handed back with ``release`` are recycled. The frames of a stream
+    are drawn one at a time and handed out in the order drawn, whether
+    ready or drawn by ``get`` itself, so a seeded engine gives the same
+    frames however the worker thread is scheduled.
+
+    :param engine: engine the per parameter set streams are spawned from
+    :type engine: NoiseEngine
+    :param depth: ready frames kept per parameter set
+    :type depth: int
+    :param max_keys: parameter sets kept, the least recently used is dropped
+    :type max_keys: int
+    """
+
+    def __init__(self, engine=None, depth=2, max_keys=4):
+        self.engine = engine or NoiseEngine()
+        self.depth = depth
+        self.max_keys = max_keys
+        self.hits = 0
+        self.misses = 0
+
+        self._ready = OrderedDict()
+        self._engines = {}
+        self._draw_locks = {}
+        self._free = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    @property
+    def ready_frames(self):
+        """ Number of prepared frames over all parameter sets."""
+        with self._condition:
+            return sum(len(ready) for ready in self._ready.values())
+
+    def get(self, shape, background, readout_noise, bias, dtype=np.float32):
+        """ A detector noise frame, taken from the pool or drawn right away.
+
+        The frame belongs to the caller until it is given back with ``release``.
+        """
+        key = (tuple(shape), np.dtype(dtype).str, float(background), float(readout_noise), float(bias))
+
+        with self._condition:
+            self._start()
+            ready = self._register(key)
+            engine, draw_lock = self._engines[key], self._draw_locks[key]
+            frame = ready.popleft() if ready else None
+            if frame is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._condition.notify_all()
+
+        if frame is None:
+            # the next frame of the stream, the worker may have put it into ready meanwhile
+            with draw_lock:
+                with self._condition:
+                    frame = ready.popleft() if ready else None
+                if frame is None:
+                    frame = self._draw(key, engine)
+        return frame
+
+    def release(self, frame):
+        """ Give a frame from ``get`` back for reuse."""
+        with self._condition:
+            if len(self._free) < self.depth * self.max_keys:
+                self._free.append(frame)
+
+    def close(self):
+        """ Stop the worker thread and drop all frames."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self._ready.clear()
+        self._free.clear()
+
+    def _start(self):
+        if not self._running:
+            self._running = True
+            self._thread = threading.Thread(target=self._refill, name="noise-pool", daemon=True)
+            self._thread.start()
+
+    def _register(self, key):
+        if key not in self._ready:
+            self._ready[key] = deque()
+            self._engines[key] = NoiseEngine(seed=self.engine.seed_sequence.spawn(1)[0],
+                                             gaussian_lambda=self.engine.gaussian_lambda,
+                                             chunk_rows=self.engine.chunk_rows)
+            self._draw_locks[key] = threading.Lock()
+            while len(self._ready) > self.max_keys:
+                stale, _ = self._ready.popitem(last=False)
+                del self._engines[stale]
+                del self._draw_locks[stale]
+        self._ready.move_to_end(key)
+        return self._ready[key]
+
+    def _draw(self, key, engine):
+        shape, dtype, background, readout_noise, bias = key
+        with self._condition:
+            frame = None
+            for index, candidate in enumerate(self._free):
+                if candidate.shape == shape and candidate.dtype.str == dtype:
+                    frame = self._free.pop(index)
+                    break
+        if frame is None:
+            frame = np.empty(shape, dtype)
+        frame.fill(0)
+        return engine.apply(frame, background, readout_noise, bias)
+
+    def _refill(self):
+        while True:
+            with self._condition:
+                key = None
+                while self._running and key is None:
+                    key = next((key for key, ready in reversed(self._ready.items()) if len(ready) < self.depth), None)
+                    if key is None:
+                        self._condition.wait()
+                if not self._running:
+                    return
+                engine, draw_lock = self._engines[key], self._draw_locks[key]
+
+            # queued before another frame of the stream is drawn, the frames stay in stream order
+            with draw_lock:
+                frame = self._draw(key, engine)
+                with self._condition:
+                    if key in self._ready:
+                        self._ready[key].append(frame)
+
+
+def _normal_dtype(array):
+    # Generator.standard_normal only draws float32 or float64
+    return np.float32 if array.dtype == np.float32 else np.float64
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: readout.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import numpy as np
+
+
+__all__ = ['readout_frame', 'binned_shape']
+
+
+ADC_MAX = 65535
+
+
+def binned_shape(shape, binning):
+    """ Shape of a (ny, nx) frame read out with binning (hbin, vbin), incomplete bins are dropped."""
+    hbin, vbin = binning
+    return (shape[0] // vbin, shape[1] // hbin)
+
+
+def readout_frame(frame, binning=(1, 1), gain=1.0, out=None, adc_max=ADC_MAX, block_rows=64, scratch=None):
+    """ Bin, convert electrons to ADU, saturate and digitize a frame in one pass.
+
+    The frame is processed in blocks of ``block_rows`` output rows, each block
+    is summed over the bins, divided by the gain, rounded, clipped to
+    [0, adc_max] and written into ``out``. Rows and columns that do not fill
+    a whole bin are dropped, like ``make_synthetic_image`` does when rendering
+    binned. Apart from the small block buffer nothing is allocated.
+
+    :param frame: electrons per pixel
+    :type frame: numpy.ndarray
+    :param binning: (hbin, vbin)
+    :type binning: tuple
+    :param gain: electrons per ADU
+    :type gain: float
+    :param out: uint16 array of ``binned_shape(frame.shape, binning)``, allocated if None
+    :type out: numpy.ndarray
+    :param adc_max: largest ADC value, brighter pixels saturate
+    :type adc_max: int
+    :param block_rows: output rows processed at once
+    :type block_rows: int
+    :param scratch: float32 array of at least (block_rows, nx) to reuse
+    :type scratch: numpy.ndarray
+    :return: out
+    :rtype: numpy.ndarray
+    """
+    hbin, vbin = binning
+    ny, nx = binned_shape(frame.shape, binning)
+    if out is None:
+        out = np.empty((ny, nx), np.uint16)
+    elif out.shape != (ny, nx):
+        raise ValueError(f"readout buffer {out.shape} does not match binned frame {(ny, nx)}")
+
+    block_rows = min(block_rows, ny) or 1
+    if scratch is None or scratch.shape[0] < block_rows or scratch.shape[1] < nx:
+        scratch = np.empty((block_rows, nx), np.float32)
+    scale = 1.0 / gain
+
+    for row in range(0, ny, block_rows):
+        rows = min(block_rows, ny - row)
+        block = scratch[:rows, :nx]
+        pixels = frame[row * vbin:(row + rows) * vbin, :nx * hbin]
+        if hbin == 1 and vbin == 1:
+            np.multiply(pixels, scale, out=block)
+        else:
+            # splitting the axes of the slice is a view, the sum over both bin axes is one reduction
+            np.sum(pixels.reshape(rows, vbin, nx, hbin), axis=(1, 3), out=block)
+            block *= scale
+        # clipped to [0.5, adc_max + 0.5] the truncating cast rounds to the nearest ADU
+        block += 0.5
+        np.clip(block, 0.5, adc_max + 0.5, out=block)
+        np.copyto(out[row:row + rows], block, casting='unsafe')
+
+    return out
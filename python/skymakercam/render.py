@@ -0,0 +1,607 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: render.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import functools
+import math
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.fft import fft, irfft2, next_fast_len, rfft, rfft2
+from scipy.ndimage import gaussian_filter
+from scipy.special import erf
+
+from skymakercam.noise import NoiseEngine
+
+
+__all__ = ['RenderContext', 'render_noiseless', 'deposit_stars', 'per_axis', 'psf_sigma', 'convolve_ndimage', 'convolve_fft', 'render_stamps', 'render_tiled',
+           'padded_window', 'shift_frames', 'convolve_jitter', 'gaussian_transfer_function', 'estimate_cost', 'choose_backend', 'RENDER_BACKENDS', 'register_backend']
+
+
+# kernel extent in sigma, the same default scipy.ndimage.gaussian_filter uses.
+TRUNCATE = 4.0
+
+
+class RenderContext:
+    """ Reusable work buffers for ``make_synthetic_image``.
+
+    Every render stage writes into named buffers that are kept between
+    exposures and only reallocated when the frame shape changes, the
+    frame returned by ``make_synthetic_image`` is one of them and is
+    overwritten by the next render. Not thread safe, one render at a time.
+
+    :param dtype: floating point type of the frames
+    :type dtype: numpy.dtype
+    :param noise: the noise engine, a default unseeded one if None
+    :type noise: NoiseEngine
+    :param noise_pool: pool of prepared detector noise frames, None to draw them with each frame
+    :type noise_pool: NoisePool
+    :param threads: size of the thread pool of the tiled backend
+    :type threads: int
+    :param tiles: number of row bands of the tiled backend, defaults to threads
+    :type tiles: int
+    :param frame_cache: cache of noiseless frames, None to render every exposure
+    :type frame_cache: FrameCache
+    :param incremental: shifts the last rendered frame for small moves, None to always render
+    :type incremental: IncrementalRenderer
+    """
+
+    def __init__(self, dtype=np.float32, noise=None, noise_pool=None, threads=1, tiles=None, frame_cache=None,
+                 incremental=None):
+        self.dtype = np.dtype(dtype)
+        self.noise = noise or NoiseEngine()
+        self.noise_pool = noise_pool
+        self.frame_cache = frame_cache
+        self.incremental = incremental
+        self.threads = threads
+        self.tiles = tiles or threads
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="render") if threads > 1 else None
+        self._buffers = {}
+
+    def close(self):
+        """ Stop the render threads."""
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+    def buffer(self, name, shape, dtype=None):
+        """ Uninitialized buffer ``name`` of ``shape``, allocated on first use."""
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        shape = tuple(shape)
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(shape, dtype)
+        return buffer
+
+    def zeros(self, name, shape, dtype=None):
+        """ Buffer ``name`` of ``shape`` set to zero."""
+        buffer = self.buffer(name, shape, dtype)
+        buffer.fill(0)
+        return buffer
+
+    @property
+    def nbytes(self):
+        """ Memory held by all buffers."""
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+
+RenderBackend = namedtuple('RenderBackend', ['render', 'cost'])
+
+RENDER_BACKENDS = OrderedDict()
+
+
+def register_backend(name, cost=None):
+    """ Decorator registering a render function as backend ``name``.
+
+    The render function is called as ``render(x_position, y_position, flux,
+    shape, seeing_pixel, defocus, context, out)`` and renders the expected
+    star image into ``out``. ``cost(n_stars, shape, seeing_pixel, defocus,
+    threads, truncate)`` estimates its time in nanoseconds for
+    ``choose_backend``, None there or as cost leaves the backend to manual
+    selection. A backend registered again under the same name replaces the
+    old one.
+    """
+    def register(render):
+        RENDER_BACKENDS[name] = RenderBackend(render, cost)
+        return render
+    return register
+
+
+def render_noiseless(backend, x_position, y_position, flux, shape, seeing_pixel, defocus, context):
+    """ Expected star image rendered with ``backend`` into the context buffer ``star_image_c``.
+
+    :param backend: name of a backend in RENDER_BACKENDS, e.g. "ndimage", "fft", "stamps" or "tiled"
+    :type backend: str
+    :return: the convolved star image
+    :rtype: numpy.ndarray
+    """
+    if backend not in RENDER_BACKENDS:
+        raise ValueError(f"unknown render backend {backend!r}")
+
+    star_image_c = context.buffer("star_image_c", shape)
+    RENDER_BACKENDS[backend].render(x_position, y_position, flux, shape, seeing_pixel, defocus, context, star_image_c)
+    return star_image_c
+
+
+def deposit_stars(x_position, y_position, flux, shape, out=None):
+    """ Deposit point sources onto a pixel grid with bilinear weights.
+
+    The flux of every star is split over the four pixels surrounding its
+    position, contributions of overlapping stars are summed. Weights that
+    would fall outside the image are dropped, pixel ``i`` is centered on
+    coordinate ``i``.
+
+    :param x_position: x pixel positions
+    :type x_position: numpy.ndarray
+    :param y_position: y pixel positions
+    :type y_position: numpy.ndarray
+    :param flux: flux per star
+    :type flux: numpy.ndarray
+    :param shape: image shape as (ny, nx)
+    :type shape: tuple
+    :param out: image to accumulate into, a new zeroed image if None
+    :type out: numpy.ndarray
+    :return: the image with the stars added
+    :rtype: numpy.ndarray
+    """
+    ny, nx = shape
+    if out is None:
+        out = np.zeros(shape)
+
+    x_position = np.asarray(x_position, dtype=float)
+    y_position = np.asarray(y_position, dtype=float)
+    flux = np.broadcast_to(np.asarray(flux, dtype=float), x_position.shape)
+    if x_position.size == 0:
+        return out
+
+    i = np.floor(x_position).astype(np.intp)
+    j = np.floor(y_position).astype(np.intp)
+    xx = x_position - i
+    yy = y_position - j
+
+    in_x = ((0 <= i) & (i < nx), (-1 <= i) & (i < nx - 1))
+    in_y = ((0 <= j) & (j < ny), (-1 <= j) & (j < ny - 1))
+    weight_x = (1 - xx, xx)
+    weight_y = (1 - yy, yy)
+
+    index, weight = [], []
+    for dy in (0, 1):
+        for dx in (0, 1):
+            valid = in_x[dx] & in_y[dy]
+            index.append(((j + dy) * nx + i + dx)[valid])
+            weight.append((weight_x[dx] * weight_y[dy] * flux)[valid])
+    index = np.concatenate(index)
+    weight = np.concatenate(weight)
+
+    # sum duplicate pixels first, so the scatter below touches each pixel once
+    pixels, inverse = np.unique(index, return_inverse=True)
+    out.reshape(-1)[pixels] += np.bincount(inverse.ravel(), weights=weight, minlength=pixels.size)
+
+    return out
+
+
+def per_axis(value):
+    """ A scalar or (y, x) pair as a (y, x) tuple of floats."""
+    if np.ndim(value) == 0:
+        return (float(value), float(value))
+    value_y, value_x = value
+    return (float(value_y), float(value_x))
+
+
+def psf_sigma(seeing_pixel, defocus=0.0):
+    """ Sigma of the gaussian PSF combining seeing and defocus.
+
+    Convolving two gaussians adds their variances, so this is the sigma
+    of ``convolve_ndimage`` applied to a point source. Scalars give a
+    scalar, (y, x) pairs give a (y, x) tuple.
+    """
+    if np.ndim(seeing_pixel) == 0 and np.ndim(defocus) == 0:
+        return math.hypot(seeing_pixel, defocus)
+    return tuple(math.hypot(s, d) for s, d in zip(per_axis(seeing_pixel), per_axis(defocus)))
+
+
+def kernel_radius(sigma, truncate=TRUNCATE):
+    """ Half width in pixels of a gaussian kernel truncated at ``truncate`` sigma."""
+    return int(truncate * sigma + 0.5)
+
+
+def convolve_ndimage(star_image, seeing_pixel, defocus=0.0, out=None):
+    """ Convolve a deposited star image with seeing and defocus over the full frame.
+
+    Sigmas are in pixels, scalars or (y, x) pairs. With ``out`` both
+    passes run in place in that array, gaussian_filter works line by line.
+    """
+    star_image_c = gaussian_filter(star_image, sigma=seeing_pixel, mode="constant", output=out)
+    if np.any(defocus):
+        star_image_c = gaussian_filter(star_image_c, sigma=defocus, mode='constant', output=star_image_c)
+    return star_image_c
+
+
+def _pixel_profile(offset, sigma):
+    # fraction of a 1d gaussian falling into pixels whose centers are offset from the star.
+    scale = 1.0 / (math.sqrt(2.0) * sigma)
+    return 0.5 * (erf((offset + 0.5) * scale) - erf((offset - 0.5) * scale))
+
+
+def render_stamps(x_position, y_position, flux, shape, sigma, out=None, truncate=TRUNCATE):
+    """ Render gaussian stars into cutouts around each star only.
+
+    The PSF is integrated analytically over each pixel of a stamp of
+    half width ``truncate * sigma``, the cost scales with the number of
+    stars times the stamp area and not with the chip area. Flux falling
+    off the chip is lost, like ``mode='constant'`` in ``convolve_ndimage``.
+
+    :param x_position: x pixel positions
+    :type x_position: numpy.ndarray
+    :param y_position: y pixel positions
+    :type y_position: numpy.ndarray
+    :param flux: flux per star
+    :type flux: numpy.ndarray
+    :param shape: image shape as (ny, nx)
+    :type shape: tuple
+    :param sigma: gaussian sigma in pixels, scalar or (y, x), see ``psf_sigma``
+    :type sigma: float or tuple
+    :param out: image to accumulate into, a new zeroed image if None
+    :type out: numpy.ndarray
+    :return: the image with the stars added
+    :rtype: numpy.ndarray
+    """
+    ny, nx = shape
+    if out is None:
+        out = np.zeros(shape)
+    sigma_y, sigma_x = per_axis(sigma)
+    if sigma_y <= 0 or sigma_x <= 0:
+        return deposit_stars(x_position, y_position, flux, shape, out=out)
+
+    x_position = np.asarray(x_position, dtype=float)
+    y_position = np.asarray(y_position, dtype=float)
+    flux = np.broadcast_to(np.asarray(flux, dtype=float), x_position.shape)
+
+    radius_x = kernel_radius(sigma_x, truncate)
+    radius_y = kernel_radius(sigma_y, truncate)
+    offsets_x = np.arange(-radius_x, radius_x + 1)
+    offsets_y = np.arange(-radius_y, radius_y + 1)
+
+    x_center = np.rint(x_position).astype(np.intp)
+    y_center = np.rint(y_position).astype(np.intp)
+    profile_x = _pixel_profile(x_center[:, None] + offsets_x - x_position[:, None], sigma_x)
+    profile_y = _pixel_profile(y_center[:, None] + offsets_y - y_position[:, None], sigma_y)
+
+    for index in range(x_position.size):
+        x0, y0 = x_center[index] - radius_x, y_center[index] - radius_y
+        xa, xb = max(x0, 0), min(x0 + offsets_x.size, nx)
+        ya, yb = max(y0, 0), min(y0 + offsets_y.size, ny)
+        if xa >= xb or ya >= yb:
+            continue
+        out[ya:yb, xa:xb] += flux[index] * np.outer(profile_y[index, ya - y0:yb - y0],
+                                                    profile_x[index, xa - x0:xb - x0])
+
+    return out
+
+
+def convolve_fft(star_image, seeing_pixel, defocus=0.0, workers=None, out=None):
+    """ Convolve a deposited star image with seeing and defocus in one rfft pass.
+
+    Equals ``convolve_ndimage`` away from the borders, but the cost does
+    not grow with the kernel size, the transfer function comes from the
+    cache of ``gaussian_transfer_function``. The zero padding makes the
+    circular convolution one constant mode pass of the combined kernel.
+    ``convolve_ndimage`` crops between its seeing and defocus passes and
+    drops the light blurred across the border before the defocus pass, so
+    within a defocus kernel radius of the borders the two differ. The
+    padded spectrum is a temporary, scipy.fft has no output argument.
+    float32 input stays single precision.
+    """
+    ny, nx = star_image.shape
+    transfer, padded = gaussian_transfer_function(star_image.shape, per_axis(seeing_pixel), per_axis(defocus))
+
+    spectrum = rfft2(star_image, s=padded, workers=workers)
+    spectrum *= transfer
+    star_image_c = irfft2(spectrum, s=padded, workers=workers, overwrite_x=True)[:ny, :nx]
+    if out is None:
+        out = star_image_c
+    else:
+        out[...] = star_image_c
+    # round off leaves tiny negative values far from the stars
+    return np.maximum(out, 0, out=out)
+
+
+def render_tiled(x_position, y_position, flux, shape, seeing_pixel, defocus=0.0, out=None,
+                 tiles=1, executor=None, context=None, truncate=TRUNCATE):
+    """ Deposit and convolve in row bands, optionally on a thread pool.
+
+    Every band is extended by a halo of the combined seeing and defocus
+    kernel radius, gets the stars falling into band and halo deposited and
+    is convolved on its own with gaussian_filter. The band rows do not see
+    the cut, so the result is bit identical to ``convolve_ndimage`` of the
+    full frame for any number of tiles.
+
+    :param tiles: number of row bands
+    :type tiles: int
+    :param executor: runs the bands in parallel, in the calling thread if None
+    :type executor: concurrent.futures.Executor
+    :param context: provides the band work buffers, allocated per call if None
+    :type context: RenderContext
+    :return: the convolved image
+    :rtype: numpy.ndarray
+    """
+    ny, nx = shape
+    if out is None:
+        out = np.zeros(shape)
+    seeing_y, defocus_y = per_axis(seeing_pixel)[0], per_axis(defocus)[0]
+    halo = kernel_radius(seeing_y, truncate) + (kernel_radius(defocus_y, truncate) if defocus_y else 0)
+
+    x_position = np.asarray(x_position, dtype=float)
+    y_position = np.asarray(y_position, dtype=float)
+    flux = np.broadcast_to(np.asarray(flux, dtype=float), x_position.shape)
+    row = np.floor(y_position)
+
+    edges = np.linspace(0, ny, max(1, min(tiles, ny)) + 1).astype(int)
+
+    def render(tile, first, last):
+        top, bottom = max(first - halo, 0), min(last + halo, ny)
+        band_shape = (bottom - top, nx)
+        if context is None:
+            band, band_c = np.zeros(band_shape, out.dtype), np.empty(band_shape, out.dtype)
+        else:
+            band = context.zeros(f"tile_{tile}", band_shape)
+            band_c = context.buffer(f"tile_{tile}_c", band_shape)
+
+        near = (row + 1 >= top) & (row < bottom)
+        # an integer offset keeps the sub pixel fractions bit identical
+        deposit_stars(x_position[near], y_position[near] - top, flux[near], band_shape, out=band)
+        convolve_ndimage(band, seeing_pixel, defocus, out=band_c)
+        out[first:last] = band_c[first - top:last - top]
+
+    bands = list(zip(range(len(edges) - 1), edges[:-1], edges[1:]))
+    if executor:
+        list(executor.map(lambda band: render(*band), bands))
+    else:
+        for band in bands:
+            render(*band)
+
+    return out
+
+
+def padded_window(window, seeing_pixel, defocus=0.0, shift=(0.0, 0.0), truncate=TRUNCATE):
+    """ Render grid around a readout window, wide enough for the PSF of stars outside it.
+
+    The window is padded on all sides by the seeing plus defocus kernel
+    radius, the largest image motion ``shift`` and one pixel for the
+    bilinear deposit. Stars are rendered on the padded grid and the window
+    is cut out, inside it the result does not differ from a render of the
+    whole chip.
+
+    :param window: (x0, y0, wd, ht) in pixels of the render grid, 0-indexed
+    :type window: tuple
+    :param shift: largest image motion (x, y) in pixels, e.g. of the sub steps of convolve_jitter
+    :type shift: tuple
+    :return: origin (x, y) of the padded grid, its shape (ny, nx) and the slices of the window in it
+    :rtype: tuple
+    """
+    x0, y0, wd, ht = window
+    margin = [kernel_radius(seeing, truncate) + (kernel_radius(blur, truncate) if blur else 0) + int(math.ceil(abs(move))) + 1
+              for seeing, blur, move in zip(per_axis(seeing_pixel), per_axis(defocus), (shift[1], shift[0]))]
+    margin_y, margin_x = margin
+    return ((x0 - margin_x, y0 - margin_y),
+            (ht + 2 * margin_y, wd + 2 * margin_x),
+            (slice(margin_y, margin_y + ht), slice(margin_x, margin_x + wd)))
+
+
+def shift_frames(frame, offsets, out, crop=None, workers=None):
+    """ Copies of a frame moved by sub pixel offsets, one FFT for all of them.
+
+    The frame is transformed once on a grid padded by the largest offset,
+    every copy is the inverse transform after a phase ramp. Flux moved
+    over the frame edge is lost, nothing wraps around.
+
+    :param frame: image to move
+    :type frame: numpy.ndarray
+    :param offsets: (n, 2) offsets (dx, dy) in pixels
+    :type offsets: numpy.ndarray
+    :param out: stack of n frames receiving the copies, cut to ``crop`` if given
+    :type out: numpy.ndarray
+    :param crop: slices applied to every moved copy
+    :type crop: tuple
+    :return: out
+    :rtype: numpy.ndarray
+    """
+    offsets = np.asarray(offsets, dtype=float).reshape(-1, 2)
+    ny, nx = frame.shape
+    pad = int(math.ceil(np.abs(offsets).max(initial=0.0))) + 1
+    padded = (next_fast_len(ny + pad, real=True), next_fast_len(nx + pad, real=True))
+    spectrum = rfft2(frame, s=padded, workers=workers)
+    freq_y = np.fft.fftfreq(padded[0])
+    freq_x = np.fft.rfftfreq(padded[1])
+
+    for index, (dx, dy) in enumerate(offsets):
+        ramp = np.exp(-2j * np.pi * dy * freq_y)[:, None] * np.exp(-2j * np.pi * dx * freq_x)
+        shifted = irfft2(ramp * spectrum, s=padded, workers=workers, overwrite_x=True)[:ny, :nx]
+        out[index] = shifted[crop] if crop is not None else shifted
+        # round off leaves tiny negative values far from the stars
+        np.maximum(out[index], 0, out=out[index])
+    return out
+
+
+def _gaussian_kernel1d(sigma, truncate=TRUNCATE):
+    # sampled and normalized like scipy.ndimage.gaussian_filter does it.
+    radius = kernel_radius(sigma, truncate)
+    x = np.arange(-radius, radius + 1)
+    phi = np.exp(-0.5 / sigma ** 2 * x ** 2)
+    return phi / phi.sum()
+
+
+@functools.lru_cache(maxsize=8)
+def gaussian_transfer_function(shape, seeing_pixel, defocus=(0.0, 0.0), truncate=TRUNCATE):
+    """ Transfer function of the seeing kernel convolved with the defocus kernel.
+
+    The frame is zero padded by the kernel radius, so the circular fft
+    convolution equals one ``mode='constant'`` pass of the combined kernel. Cached by (shape, seeing_pixel,
+    defocus), exposures at the same focus skip the kernel construction.
+    Sigmas are hashable scalars or (y, x) tuples.
+
+    :return: read only rfft2 spectrum and the padded (ny, nx) shape it belongs to
+    :rtype: tuple
+    """
+    axes, padded = [], []
+    for axis, (size, seeing, focus) in enumerate(zip(shape, per_axis(seeing_pixel), per_axis(defocus))):
+        kernel = _psf_kernel1d(seeing, focus, truncate)
+        size = next_fast_len(size + kernel.size // 2, real=True)
+        axes.append(_kernel_spectrum(kernel, size, real=axis == 1))
+        padded.append(size)
+
+    transfer = np.multiply.outer(*axes)
+    transfer.flags.writeable = False
+    return transfer, tuple(padded)
+
+
+def _psf_kernel1d(seeing, focus, truncate=TRUNCATE):
+    # sampled seeing kernel convolved with the defocus kernel, like convolve_ndimage applies them.
+    kernel = _gaussian_kernel1d(seeing, truncate)
+    if focus != 0.0:
+        kernel = np.convolve(kernel, _gaussian_kernel1d(focus, truncate))
+    return kernel
+
+
+def _kernel_spectrum(kernel, size, real):
+    # spectrum of a symmetric kernel centered on index 0 of a periodic axis of size, real valued.
+    radius = kernel.size // 2
+    wrapped = np.zeros(size)
+    wrapped[:radius + 1] = kernel[radius:]
+    wrapped[size - radius:] = kernel[:radius]
+    return rfft(wrapped).real if real else fft(wrapped).real
+
+
+def convolve_jitter(star_image, seeing_steps, offsets, defocus=0.0, workers=None, out=None, truncate=TRUNCATE):
+    """ Convolve with the PSF averaged over the sub steps of an exposure.
+
+    Sub step k contributes a seeing kernel of sigma ``seeing_steps[k]``,
+    convolved with the defocus and shifted by ``offsets[k]``. Each term is
+    separable, so the transfer function of the average is one matrix
+    product of the per axis spectra with their phase ramps, and the frame
+    is transformed once whatever the number of sub steps. One sub step
+    without offset equals ``convolve_fft``.
+
+    :param star_image: deposited star image
+    :type star_image: numpy.ndarray
+    :param seeing_steps: (k, 2) seeing sigmas (y, x) in pixels per sub step
+    :type seeing_steps: numpy.ndarray
+    :param offsets: (k, 2) image motion (dx, dy) in pixels per sub step
+    :type offsets: numpy.ndarray
+    :return: the convolved image
+    :rtype: numpy.ndarray
+    """
+    ny, nx = star_image.shape
+    seeing_steps = np.asarray(seeing_steps, dtype=float).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=float).reshape(-1, 2)
+    defocus = per_axis(defocus)
+
+    # kernels of all steps, per axis (y, x)
+    kernels = [[_psf_kernel1d(step[axis], defocus[axis], truncate) for step in seeing_steps] for axis in (0, 1)]
+    padded = tuple(next_fast_len(size + max(kernel.size for kernel in axis_kernels) // 2
+                                 + int(math.ceil(np.abs(shift).max(initial=0.0))) + 1, real=True)
+                   for size, axis_kernels, shift in zip((ny, nx), kernels, (offsets[:, 1], offsets[:, 0])))
+
+    terms = []
+    for axis, shift in ((0, offsets[:, 1]), (1, offsets[:, 0])):
+        size = padded[axis]
+        frequency = np.fft.rfftfreq(size) if axis == 1 else np.fft.fftfreq(size)
+        spectra = np.array([_kernel_spectrum(kernel, size, real=axis == 1) for kernel in kernels[axis]])
+        terms.append(spectra * np.exp(-2j * np.pi * shift[:, None] * frequency))
+    transfer = terms[0].T @ terms[1]
+    transfer /= len(seeing_steps)
+
+    spectrum = rfft2(star_image, s=padded, workers=workers)
+    spectrum *= transfer
+    star_image_c = irfft2(spectrum, s=padded, workers=workers, overwrite_x=True)[:ny, :nx]
+    if out is None:
+        out = star_image_c
+    else:
+        out[...] = star_image_c
+    # round off leaves tiny negative values far from the stars
+    return np.maximum(out, 0, out=out)
+
+
+def _ndimage_cost(n_stars, shape, seeing_pixel, defocus, threads, truncate):
+    # per pixel timings of gaussian_filter taps, measured on a single core.
+    taps = 0
+    for seeing, focus in zip(per_axis(seeing_pixel), per_axis(defocus)):
+        taps += 2 * kernel_radius(seeing, truncate) + 1
+        if focus != 0.0:
+            taps += 2 * kernel_radius(focus, truncate) + 1
+    return shape[0] * shape[1] * (0.9 * taps + 20)
+
+
+def _fft_cost(n_stars, shape, seeing_pixel, defocus, threads, truncate):
+    padded = 1
+    for size, seeing, focus in zip(shape, per_axis(seeing_pixel), per_axis(defocus)):
+        padded *= size + kernel_radius(seeing, truncate) + kernel_radius(focus, truncate)
+    return 2.0 * padded * math.log2(padded)
+
+
+def _stamps_cost(n_stars, shape, seeing_pixel, defocus, threads, truncate):
+    stamp = 1
+    for seeing, focus in zip(per_axis(seeing_pixel), per_axis(defocus)):
+        stamp *= 2 * kernel_radius(psf_sigma(seeing, focus), truncate) + 1
+    return n_stars * (10 * stamp + 1e4)
+
+
+def _tiled_cost(n_stars, shape, seeing_pixel, defocus, threads, truncate):
+    # the ndimage cost plus the halos of the bands, spread over the threads
+    if threads <= 1:
+        return None
+    halo = kernel_radius(per_axis(seeing_pixel)[0], truncate) + kernel_radius(per_axis(defocus)[0], truncate)
+    return _ndimage_cost(n_stars, shape, seeing_pixel, defocus, threads, truncate) * (1 + 2 * halo * threads / shape[0]) / threads
+
+
+@register_backend("ndimage", cost=_ndimage_cost)
+def _render_ndimage(x_position, y_position, flux, shape, seeing_pixel, defocus, context, out):
+    star_image = deposit_stars(x_position, y_position, flux, shape, out=context.zeros("star_image", shape))
+    convolve_ndimage(star_image, seeing_pixel, defocus, out=out)
+
+
+@register_backend("fft", cost=_fft_cost)
+def _render_fft(x_position, y_position, flux, shape, seeing_pixel, defocus, context, out):
+    star_image = deposit_stars(x_position, y_position, flux, shape, out=context.zeros("star_image", shape))
+    convolve_fft(star_image, seeing_pixel, defocus, out=out)
+
+
+@register_backend("stamps", cost=_stamps_cost)
+def _render_stamps(x_position, y_position, flux, shape, seeing_pixel, defocus, context, out):
+    out.fill(0)
+    render_stamps(x_position, y_position, flux, shape, psf_sigma(seeing_pixel, defocus), out=out)
+
+
+@register_backend("tiled", cost=_tiled_cost)
+def _render_tiled(x_position, y_position, flux, shape, seeing_pixel, defocus, context, out):
+    render_tiled(x_position, y_position, flux, shape, seeing_pixel, defocus, out=out,
+                 tiles=context.tiles, executor=context.executor, context=context)
+
+
+def estimate_cost(n_stars, shape, seeing_pixel, defocus=0.0, threads=1, truncate=TRUNCATE):
+    """ Rough render time in nanoseconds for each backend with a cost model.
+
+    Shape and sigmas are those of the render grid, so binning is accounted
+    for. Backends without a cost model or not applicable, like "tiled" on a
+    single thread, are left out.
+
+    :return: estimated cost per backend name
+    :rtype: dict
+    """
+    cost = {}
+    for name, backend in RENDER_BACKENDS.items():
+        if backend.cost is not None:
+            estimate = backend.cost(n_stars, shape, seeing_pixel, defocus, threads, truncate)
+            if estimate is not None:
+                cost[name] = estimate
+    return cost
+
+
+def choose_backend(n_stars, shape, seeing_pixel, defocus=0.0, threads=1, truncate=TRUNCATE):
+    """ Name of the cheapest backend according to ``estimate_cost``."""
+    cost = estimate_cost(n_stars, shape, seeing_pixel, defocus, threads, truncate)
+    return min(cost, key=cost.get)
@@ -14,6 +14,10 @@ from astropy.coordinates import SkyCoord  # High-level coordinates
 #import healpy as hp
 #from astropy.table import Table, hstack, vstack
 from skymakercam.coords import *
+from skymakercam.framecache import FrameCache
+from skymakercam.tilestore import CatalogColumns
+from skymakercam.render import (RenderContext, choose_backend, convolve_jitter, deposit_stars, padded_window, render_noiseless,
+                                shift_frames)
 
 
 
@@ -29,7 +33,7 @@ class Guidestars:
         self.cats2 = cats2
 
 
-def find_guide_stars(c, pa, inst, remote_catalog=False, east_is_right=True, cull_cat=True, recycled_cat = None, return_focal_plane_coords=False, remote_maglim=None):
+def find_guide_stars(c, pa, inst, remote_catalog=False, east_is_right=True, cull_cat=True, recycled_cat = None, return_focal_plane_coords=False, remote_maglim=None, mag_limit=None):
     # function to figure out which (suitable) guide stars are on the guider chip
     # input:
     # c in SkyCoord;          contains ra & dec of IFU field center
@@ -37,12 +41,15 @@ def find_guide_stars(c, pa, inst, remote_catalog=False, east_is_right=True, cull
     # remote_catalog = True;  queries the GAIA TAP to obtain a catalog on the fly
     # east_is_right = True;   accounts for the handedness fip resulting from the 5 mirror configuration
     #                         should be set to FALSE for the spectrophotometric telescope, which has only 2 mirrors
+    # mag_limit;              faintest G magnitude used, the depth of this exposure, default inst.mag_lim_lower
     #
     # returns: ra,dec, G-band magnitude of all stars on the chip, as well as xy pixel positions (in mm)
                         #note! this does not account for the 6th mirror, which flips the handedness
 
     inner_search_radius=inst.inner_search_radius
     outer_search_radius=inst.outer_search_radius
+    if mag_limit is None:
+        mag_limit = inst.mag_lim_lower
     global cat 
     
     #make sure c is in icrs
@@ -54,7 +61,7 @@ def find_guide_stars(c, pa, inst, remote_catalog=False, east_is_right=True, cull
     else:
         if remote_catalog:
             if remote_maglim is None:
-                remote_maglim = inst.mag_lim_lower
+                remote_maglim = mag_limit
             radius = u.Quantity(outer_search_radius, u.deg)
             #j = Gaia.cone_search_async(coordinate=c_icrs, radius)
             gaia_query = "SELECT source_id, ra,dec,phot_g_mean_mag FROM gaiaedr3.gaia_source WHERE phot_g_mean_mag <= "+str(remote_maglim)+" AND 1=CONTAINS(POINT('ICRS',ra,dec), CIRCLE('ICRS',"+str(c_icrs.ra.deg)+","+str(c_icrs.dec.deg)+", "+str(radius.value)+"))"
@@ -74,15 +81,19 @@ def find_guide_stars(c, pa, inst, remote_catalog=False, east_is_right=True, cull
             t1 = time.time()
             #print("Culling complete. It took me {:.1f} s".format(t1-t0))
         
+    #columnar tiles are sorted by magnitude, the faint end is cut off without a scan.
+    #the global cat keeps all its stars for later calls with a fainter mag_limit
+    stars = cat.brighter(mag_limit) if isinstance(cat, CatalogColumns) else cat
+
     #print("Circular selection")
     t0 = time.time()
-    dd=sphdist(c_icrs.ra.deg,c_icrs.dec.deg,cat['ra'],cat['dec'])
+    dd=sphdist(c_icrs.ra.deg,c_icrs.dec.deg,stars['ra'],stars['dec'])
 
     #pick the subset that is within 1.5 degree
     #also check some magnitude range
     
-    ii=(dd < outer_search_radius) & (dd > inner_search_radius)  & (cat['phot_g_mean_mag'] < inst.mag_lim_lower) & (cat['phot_g_mean_mag'] > inst.mag_lim_upper)
-    cats2=cat[ii]
+    ii=(dd < outer_search_radius) & (dd > inner_search_radius)  & (stars['phot_g_mean_mag'] < mag_limit) & (stars['phot_g_mean_mag'] > inst.mag_lim_upper)
+    cats2=stars[ii]
     t1 = time.time()
     #print("Circular selection complete. It took me {:.1f} s".format(t1-t0))
     #convert ra&dec of guide stars to xy position in relation to field center (in mm)
@@ -165,7 +176,93 @@ def find_guide_stars_auto(input_touple, inst, folder = "/guide_star_search_resul
     return index,len(ras), time.time() - t0
 
 
-def make_synthetic_image(chip_x, chip_y, gmag, inst, exp_time=5, seeing_arcsec=3.5, sky_flux=10, defocus=0.0):
+def make_synthetic_image(chip_x, chip_y, gmag, inst, exp_time=5, seeing_arcsec=3.5, sky_flux=10, defocus=0.0, backend="auto", binning=(1, 1), window=None,
+                         substeps=1, tip_tilt_arcsec=0.0, seeing_jitter=0.0, rng=None, context=None, mag_cutoff=None, fold_faint=False):
+    # renders a noisy guider frame in electrons
+    # all stages run in the buffers of the RenderContext context, the returned frame
+    # belongs to it and is overwritten by the next call with the same context.
+    # with a FrameCache in the context the noiseless image of an unchanged star field
+    # is only scaled with exp_time instead of rendered again, with an IncrementalRenderer
+    # small moves of the same stars shift the last rendered frame.
+    # with binning (hbin, vbin) the frame is rendered directly on the binned grid,
+    # each pixel holds the sum of hbin * vbin detector pixels incl. background, bias and read noise.
+    # with window (x0, y0, wd, ht) in pixels of the binned grid only that part of the chip is returned,
+    # only stars whose PSF reaches into it are rendered and only its pixels get noise.
+    # backend "ndimage" deposits all stars and convolves the whole frame,
+    # "fft" does the same with one cached transfer function for seeing and defocus,
+    # "stamps" evaluates the PSF only around each star,
+    # "tiled" runs the ndimage path in row bands on the thread pool of the context,
+    # "auto" picks the cheapest one for the star count and kernel size.
+    # with substeps > 1 the exposure is split into sub steps with a random walk of the image
+    # centroid of tip_tilt_arcsec rms per step and seeing varying by seeing_jitter (relative rms),
+    # drawn from rng (default a stream of the context noise engine). the stars are convolved
+    # once with the PSF averaged over the sub steps, the backend is not used then.
+    # stars fainter than mag_cutoff (see catalog.calc_mag_limit) are not rendered, with fold_faint
+    # their flux is spread evenly over the chip as part of the sky background.
+
+    if context is None:
+        context = RenderContext()
+
+    star_image_c, crop, detector_noise = render_expected_image(chip_x, chip_y, gmag, inst, exp_time, seeing_arcsec, sky_flux,
+                                                               defocus, backend, binning, window, context,
+                                                               substeps, tip_tilt_arcsec, seeing_jitter, rng,
+                                                               mag_cutoff, fold_faint)
+    if crop is not None:
+        star_image_c = star_image_c[crop]
+
+    if context.noise_pool:
+        combined = context.noise.apply(star_image_c)
+        noise_frame = context.noise_pool.get(star_image_c.shape, *detector_noise, dtype=combined.dtype)
+        combined += noise_frame
+        context.noise_pool.release(noise_frame)
+    else:
+        combined = context.noise.apply(star_image_c, *detector_noise)
+
+    return combined
+
+
+def make_synthetic_cube(chip_x, chip_y, gmag, inst, n_frames, exp_time=5, seeing_arcsec=3.5, sky_flux=10, defocus=0.0, backend="auto", binning=(1, 1), window=None, jitter_arcsec=None, rng=None, context=None,
+                        mag_cutoff=None, fold_faint=False):
+    # renders a burst of n_frames noisy frames in electrons as a new (n_frames, ny, nx) cube.
+    # the stars are deposited and convolved once, the noise of all frames is drawn in one pass.
+    # jitter_arcsec moves the stars of each frame, either the rms of random pointing offsets
+    # drawn from rng (default a stream of the context noise engine) or (n_frames, 2) offsets (dx, dy).
+    # returns the cube and the (n_frames, 2) offsets in arcsec.
+    # the other parameters are those of make_synthetic_image.
+
+    if context is None:
+        context = RenderContext()
+
+    star_image_c, crop, detector_noise = render_expected_image(chip_x, chip_y, gmag, inst, exp_time, seeing_arcsec, sky_flux,
+                                                               defocus, backend, binning, window, context,
+                                                               mag_cutoff=mag_cutoff, fold_faint=fold_faint)
+    frame_shape = star_image_c[crop].shape if crop is not None else star_image_c.shape
+    cube = np.empty((n_frames,) + frame_shape, dtype=star_image_c.dtype)
+
+    if jitter_arcsec is None:
+        offsets = np.zeros((n_frames, 2))
+    elif np.ndim(jitter_arcsec) == 0:
+        offsets = (rng or context.noise.generator()).normal(0.0, jitter_arcsec, (n_frames, 2))
+    else:
+        offsets = np.asarray(jitter_arcsec, dtype=float).reshape(n_frames, 2)
+
+    if np.any(offsets):
+        # arcsec to pixels of the binned render grid, per axis (x, y)
+        pixel_arcsec = inst.chip_size_mm[0] / inst.chip_size_pix[0] * 1000 / inst.image_scale
+        shift_frames(star_image_c, offsets / pixel_arcsec / np.array(binning), cube, crop=crop)
+    else:
+        cube[...] = star_image_c[crop] if crop is not None else star_image_c
+
+    # frames stacked along the rows are one frame for the row chunked noise engine
+    context.noise.apply(cube.reshape(-1, frame_shape[-1]), *detector_noise)
+    return cube, offsets
+
+
+def render_expected_image(chip_x, chip_y, gmag, inst, exp_time, seeing_arcsec, sky_flux, defocus, backend, binning, window, context,
+                          substeps=1, tip_tilt_arcsec=0.0, seeing_jitter=0.0, rng=None, mag_cutoff=None, fold_faint=False):
+    # noiseless star image in electrons for make_synthetic_image, in the context buffer star_image_c.
+    # with a window the padded render grid is returned, crop cuts the window out of it.
+    # returns the image, crop or None and the binned detector noise (background, readout_noise, bias).
 
     seeing_pixel = seeing_arcsec * inst.image_scale / (inst.chip_size_mm[0] / inst.chip_size_pix[0] * 1000) / 2.36
     
@@ -178,6 +275,14 @@ def make_synthetic_image(chip_x, chip_y, gmag, inst, exp_time=5, seeing_arcsec=3
     y_position = y_position[selection_on_chip]
     gmag = gmag[selection_on_chip]
 
+    # stars below the noise are skipped, folded into the background their flux keeps the mean sky level
+    faint_flux = 0.0
+    if mag_cutoff is not None:
+        faint = gmag > mag_cutoff
+        if fold_faint:
+            faint_flux = np.sum(10 ** (-(gmag[faint] + inst.zp) / 2.5)) / (inst.chip_size_pix[0] * inst.chip_size_pix[1])
+        x_position, y_position, gmag = x_position[~faint], y_position[~faint], gmag[~faint]
+
     #print("{} of {} stars are on the chip.".format(np.sum(selection_on_chip),len(selection_on_chip)))
     
     #gaia_legend_mag = np.arange(17,4,mag_lim_index)
@@ -185,50 +290,109 @@ def make_synthetic_image(chip_x, chip_y, gmag, inst, exp_time=5, seeing_arcsec=3
     
     gaia_flux = 10 ** (-(gmag + inst.zp) / 2.5)
 
-    background = (sky_flux + inst.dark_current) * exp_time
+    background = (sky_flux + faint_flux + inst.dark_current) * exp_time
     n_pix = 7*7
 
 
     signal = gaia_flux * exp_time
     noise = np.sqrt(inst.readout_noise ** 2 + signal + n_pix * background)
 
-    star_image = np.zeros((inst.chip_size_pix[1],inst.chip_size_pix[0]))
-
-    for index, current_flux in enumerate(gaia_flux):
-        current_x = x_position[index]
-        current_y = y_position[index]
-
-        i = int(current_x)
-        j = int(current_y)
-
-        xx = current_x-i
-        yy = current_y-j
-
-        star_image[j,i] = (1 - xx) * (1 - yy) * current_flux * exp_time
-
-
-        if i < inst.chip_size_pix[0] - 1:
-            star_image[j,i+1] = (xx) * (1-yy) * current_flux * exp_time
-        if j < inst.chip_size_pix[1] - 1:
-            star_image[j+1,i] = (1 - xx) * (yy) * current_flux * exp_time
-        if (i < inst.chip_size_pix[0] - 1) & (j < inst.chip_size_pix[1] - 1):
-            star_image[j+1,i+1] = (xx) * (yy) * current_flux * exp_time
-
-        #star_image[int(current_y),int(current_x)] = current_flux*exp_time
-
-    star_image_c = gaussian_filter(star_image, sigma=seeing_pixel, mode="constant")
-    if defocus != 0.0:
-        star_image_c = gaussian_filter(star_image_c, sigma=defocus, mode='constant')
-        #star_image_c = gaussian_gradient_magnitude(star_image, sigma=1+defocus/10000, mode='constant')
-
-    star_image_c_noise = np.random.poisson(lam=star_image_c,size = star_image_c.shape)
-    
-    background_array = np.random.poisson(background,size=star_image.shape)
-
-    readout_noise_array = np.random.normal(loc=0,scale = inst.readout_noise,size=star_image.shape)
-
-    combined = star_image_c_noise + background_array + readout_noise_array + inst.bias
-
-    return combined
-
-
+    hbin, vbin = binning
+    n_binned = hbin * vbin
+    shape = (inst.chip_size_pix[1] // vbin, inst.chip_size_pix[0] // hbin)
+
+    # binned pixel k is centered on detector coordinate k * bin + (bin - 1) / 2
+    x_position = (x_position + 0.5) / hbin - 0.5
+    y_position = (y_position + 0.5) / vbin - 0.5
+    seeing_pixel = (seeing_pixel / vbin, seeing_pixel / hbin)
+    defocus = (defocus / vbin, defocus / hbin)
+
+    if substeps > 1:
+        # random walk of the image centroid and seeing fluctuations, new for every exposure
+        rng = rng or context.noise.generator()
+        pixel_arcsec = inst.chip_size_mm[0] / inst.chip_size_pix[0] * 1000 / inst.image_scale
+        offsets = np.cumsum(rng.normal(0.0, tip_tilt_arcsec, (substeps, 2)), axis=0) / pixel_arcsec / np.array(binning)
+        seeing_steps = np.array(seeing_pixel) * np.clip(1 + seeing_jitter * rng.standard_normal((substeps, 1)), 0.1, None)
+
+    crop = None
+    if window is not None:
+        # the window padding covers the widest seeing and the largest image motion of the sub steps
+        padding = (seeing_steps.max(axis=0), np.abs(offsets).max(axis=0)) if substeps > 1 else (seeing_pixel, (0.0, 0.0))
+        (x_origin, y_origin), shape, crop = padded_window(window, padding[0], defocus, shift=padding[1])
+        x_position = x_position - x_origin
+        y_position = y_position - y_origin
+        near = (x_position > -1) & (x_position < shape[1]) & (y_position > -1) & (y_position < shape[0])
+        x_position, y_position, gaia_flux = x_position[near], y_position[near], gaia_flux[near]
+
+    # sums of poisson and normal variates are poisson and normal again
+    detector_noise = (background * n_binned, inst.readout_noise * np.sqrt(n_binned), inst.bias * n_binned)
+
+    if substeps > 1:
+        # nothing to cache, the deposited stars are convolved once with the kernel averaged over the sub steps.
+        star_image = deposit_stars(x_position, y_position, gaia_flux, shape, out=context.zeros("star_image", shape))
+        star_image_c = convolve_jitter(star_image, seeing_steps, offsets, defocus, out=context.buffer("star_image_c", shape))
+        star_image_c *= exp_time
+        return star_image_c, crop, detector_noise
+
+    if backend == "auto":
+        backend = choose_backend(len(gaia_flux), shape, seeing_pixel, defocus, threads=context.threads)
+
+    cache = context.frame_cache
+    key = FrameCache.key(x_position, y_position, gaia_flux, shape, seeing_pixel, defocus, backend) if cache is not None else None
+    cached = cache.get(key) if cache is not None else None
+
+    if cached is None:
+        incremental = context.incremental
+        params = (shape, seeing_pixel, defocus, backend)
+        star_image_c = None
+        if incremental is not None:
+            star_image_c = incremental.render(x_position, y_position, gaia_flux, params, context.buffer("star_image_c", shape))
+        if star_image_c is None:
+            star_image_c = render_noiseless(backend, x_position, y_position, gaia_flux, shape, seeing_pixel, defocus, context)
+            if incremental is not None:
+                incremental.remember(x_position, y_position, gaia_flux, params, star_image_c)
+        if cache is not None:
+            cache.put(key, star_image_c)
+        star_image_c *= exp_time
+    else:
+        star_image_c = np.multiply(cached, exp_time, out=context.buffer("star_image_c", shape))
+
+    return star_image_c, crop, detector_noise
+
+
+def guide_windows(centers, shape):
+    # guide boxes (x, y, size) centered on pixel x, y, moved inside a chip of shape (ny, nx),
+    # returns windows (x0, y0, size, size) for make_synthetic_image.
+    windows = []
+    for x, y, size in centers:
+        size = int(size)
+        if size < 1 or size > min(shape):
+            raise ValueError(f"guide box size {size} does not fit on a {shape[1]}x{shape[0]} chip")
+        x0 = min(max(int(round(x)) - size // 2, 0), shape[1] - size)
+        y0 = min(max(int(round(y)) - size // 2, 0), shape[0] - size)
+        windows.append((x0, y0, size, size))
+    return windows
+
+
+def make_guide_stamps(chip_x, chip_y, gmag, inst, centers, exp_time=5, seeing_arcsec=3.5, sky_flux=10, defocus=0.0, backend="auto", binning=(1, 1), context=None,
+                      mag_cutoff=None, fold_faint=False):
+    # renders only guide boxes (x, y, size) around pixel x, y of the binned grid, all of one size,
+    # boxes reaching over the chip edge are moved inside.
+    # returns the stack of noisy stamps (n, size, size) and the window (x0, y0, size, size) of each.
+    # every stamp is rendered like make_synthetic_image with window, the stack is a new array.
+    hbin, vbin = binning
+    shape = (inst.chip_size_pix[1] // vbin, inst.chip_size_pix[0] // hbin)
+    windows = guide_windows(centers, shape)
+    if len({window[2] for window in windows}) > 1:
+        raise ValueError("guide boxes of a stack need to have the same size")
+
+    if context is None:
+        context = RenderContext()
+
+    size = windows[0][2] if windows else 0
+    stack = np.empty((len(windows), size, size), dtype=context.dtype)
+    for stamp, window in zip(stack, windows):
+        stamp[...] = make_synthetic_image(chip_x, chip_y, gmag, inst, exp_time=exp_time, seeing_arcsec=seeing_arcsec,
+                                          sky_flux=sky_flux, defocus=defocus, backend=backend, binning=binning,
+                                          window=window, context=context, mag_cutoff=mag_cutoff, fold_faint=fold_faint)
+    return stack, windows
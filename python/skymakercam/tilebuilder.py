@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: tilebuilder.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import csv
+import gzip
+import itertools
+import os
+import shutil
+import time
+import zlib
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import healpy as hp
+import numpy as np
+from astropy.io import fits
+
+
+__all__ = ['build_tiles', 'partition_source', 'merge_bucket', 'read_chunks', 'TILE_COLUMNS']
+
+
+# fields of the Gaia_Healpix_6 tiles written, a subset of the gaia_source columns
+TILE_COLUMNS = OrderedDict([('source_id', np.int64), ('ra', np.float64), ('dec', np.float64),
+                            ('phot_g_mean_mag', np.float32)])
+
+# Gaia dumps write missing values as empty fields or as null
+NULL_VALUES = ("", "null", "NULL", "nan", "NaN")
+
+
+def build_tiles(sources, target, work=None, nside=64, bucket_nside=4, chunk_rows=500000, processes=None,
+                progress=None):
+    """ Build ``lvl6_XXXXXX.npy`` tiles for get_cat_using_healpix2 from a Gaia source dump.
+
+    The dump is a list of CSV (optionally gzipped) or FITS files, like the
+    ``GaiaSource_*.csv.gz`` files of the Gaia archive. It is built in two
+    phases, both run on a process pool:
+
+    1. every source file is read in chunks of ``chunk_rows`` rows and the
+       rows are appended to one part per coarse ``bucket_nside`` pixel in
+       ``work``. The parts of a file appear at once by renaming its
+       directory when the file is done, the directory is named by path,
+       size and modification time of the file.
+    2. the parts of every bucket are merged, split into the nested ``nside``
+       pixels the bucket holds and written as tiles sorted by magnitude.
+       A marker in ``work`` records the parts a finished bucket was merged from.
+       Tiles in ``target`` of pixels no source has stars in any more are removed.
+
+    Memory is bounded by a chunk in phase 1 and a bucket in phase 2 per
+    process, ``12 * bucket_nside**2`` buckets split the dump. An interrupted
+    build is resumed by running it again, partitioned source files and
+    merged buckets are skipped as long as the sources did not change. A
+    bucket is merged again when sources were added, removed or modified
+    since. Rows without position or G magnitude are dropped.
+
+    :param sources: CSV or FITS files of the dump
+    :type sources: list
+    :param target: tile directory, e.g. catalog_path/Gaia_Healpix_6
+    :type target: str
+    :param work: directory of the parts, target/.parts by default, removed when done
+    :type work: str
+    :param nside: HEALPix nside of the tiles
+    :type nside: int
+    :param bucket_nside: HEALPix nside of the buckets merged at once, at most nside
+    :type bucket_nside: int
+    :param chunk_rows: rows read at once from a source file
+    :type chunk_rows: int
+    :param processes: worker processes, None for one per cpu, 0 to run in this process
+    :type processes: int
+    :param progress: called with a copy of the stats after every source file and bucket
+    :type progress: callable
+    :return: stats with files, rows, bytes, buckets, tiles, skipped files and buckets,
+             removed tiles, seconds, rows_per_s and mb_per_s
+    :rtype: dict
+    """
+    if bucket_nside > nside:
+        raise ValueError(f"buckets of nside {bucket_nside} are smaller than the tiles of nside {nside}")
+    work = work or os.path.join(target, ".parts")
+    merged = os.path.join(work, ".merged")
+    os.makedirs(target, exist_ok=True)
+    os.makedirs(merged, exist_ok=True)
+    t0 = time.monotonic()
+    stats = {"files": 0, "rows": 0, "bytes": 0, "buckets": 0, "tiles": 0, "skipped_files": 0,
+             "skipped_buckets": 0, "removed_tiles": 0, "seconds": 0.0, "rows_per_s": 0.0, "mb_per_s": 0.0}
+
+    def report():
+        stats["seconds"] = time.monotonic() - t0
+        stats["rows_per_s"] = stats["rows"] / max(stats["seconds"], 1e-9)
+        stats["mb_per_s"] = stats["bytes"] / 2**20 / max(stats["seconds"], 1e-9)
+        if progress:
+            progress(dict(stats))
+
+    executor = ProcessPoolExecutor(processes) if processes != 0 else None
+    mapper = executor.map if executor else map
+    try:
+        # phase 1, sources not partitioned by an earlier run
+        names = [_part_name(source) for source in sources]
+        pending = [(source, os.path.join(work, name), nside, bucket_nside, chunk_rows)
+                   for source, name in zip(sources, names) if not os.path.isdir(os.path.join(work, name))]
+        stats["skipped_files"] = len(sources) - len(pending)
+        for rows, nbytes in mapper(_partition_job, pending):
+            stats["files"] += 1
+            stats["rows"] += rows
+            stats["bytes"] += nbytes
+            report()
+
+        # phase 2, buckets not merged by an earlier run
+        parts = defaultdict(list)
+        for name in names:
+            for part in os.listdir(os.path.join(work, name)):
+                parts[int(part.split(".", 1)[0])].append(os.path.join(work, name, part))
+        done = {}
+        for bucket in os.listdir(merged):
+            with open(os.path.join(merged, bucket)) as marker:
+                done[int(bucket)] = marker.read()
+        pending = [(bucket, parts[bucket], target, nside, bucket_nside) for bucket in sorted(parts)
+                   if done.get(bucket) != _merge_marker(parts[bucket])]
+        stats["skipped_buckets"] = len(parts) - len(pending)
+        for (bucket, bucket_parts, *_), tiles in zip(pending, mapper(_merge_job, pending)):
+            with open(os.path.join(merged, str(bucket)), "w") as marker:
+                marker.write(_merge_marker(bucket_parts))
+            stats["buckets"] += 1
+            stats["tiles"] += tiles
+            report()
+
+        # tiles of buckets that only removed sources had stars in, merged buckets removed their own
+        shift = 2 * (hp.nside2order(nside) - hp.nside2order(bucket_nside))
+        stale = [ipix for ipix in _tile_pixels(target, nside) if ipix >> shift not in parts]
+        stats["removed_tiles"] = _remove_tiles(target, stale, nside)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    shutil.rmtree(work)
+    report()
+    return stats
+
+
+def read_chunks(source, chunk_rows=500000, columns=TILE_COLUMNS):
+    """ Rows of a CSV or FITS dump file as structured arrays of at most ``chunk_rows`` rows.
+
+    CSV files may be gzipped and start with ``#`` comment lines (ECSV
+    metadata), the first other line names the columns, every chunk is
+    parsed by one ``numpy.loadtxt``. FITS files are memory mapped, their
+    first table extension is read chunk by chunk. Rows with a null in any
+    of the float ``columns`` are dropped.
+    """
+    dtype = np.dtype(list(columns.items()))
+    if source.endswith((".fits", ".fits.gz", ".fit")):
+        with fits.open(source, memmap=True) as hdul:
+            data = next(hdu.data for hdu in hdul if isinstance(hdu, fits.BinTableHDU))
+            for start in range(0, len(data), chunk_rows):
+                rows = data[start:start + chunk_rows]
+                chunk = np.empty(len(rows), dtype)
+                for name in columns:
+                    chunk[name] = rows[name]
+                yield chunk[_valid(chunk)]
+        return
+
+    opener = gzip.open if source.endswith(".gz") else open
+    with opener(source, "rt", newline="") as stream:
+        lines = (line for line in stream if not line.startswith("#"))
+        header = next(csv.reader([next(lines)]))
+        indices = [header.index(name) for name in columns]
+        # nulls make loadtxt fail, the chunks holding some are parsed again with them read as nan
+        nulls = {index: _float_or_nan for index, name in zip(indices, columns) if dtype[name].kind == 'f'}
+        while True:
+            block = list(itertools.islice(lines, chunk_rows))
+            if not block:
+                return
+            try:
+                chunk = np.loadtxt(block, dtype, delimiter=",", usecols=indices, quotechar='"', ndmin=1)
+            except ValueError:
+                chunk = np.loadtxt(block, dtype, delimiter=",", usecols=indices, quotechar='"', ndmin=1,
+                                   converters=nulls)
+            yield chunk[_valid(chunk)]
+
+
+def partition_source(source, part_dir, nside=64, bucket_nside=4, chunk_rows=500000):
+    """ Split one dump file into raw parts of rows by bucket pixel.
+
+    Every chunk is sorted by nested ``nside`` pixel and the rows of each
+    ``bucket_nside`` pixel are appended to ``<bucket>.rows`` as raw
+    ``TILE_COLUMNS`` records. The parts are written into
+    ``part_dir + ".tmp"``, which is renamed to ``part_dir`` when the file
+    is done, a left over temporary directory of an interrupted run is
+    removed first.
+
+    :return: rows and bytes read
+    :rtype: tuple
+    """
+    partial = part_dir + ".tmp"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    shift = 2 * (hp.nside2order(nside) - hp.nside2order(bucket_nside))
+    rows = 0
+    for chunk in read_chunks(source, chunk_rows):
+        pixels = hp.ang2pix(nside, chunk['ra'], chunk['dec'], nest=True, lonlat=True)
+        # sorted by pixel the rows of a bucket are one slice, nested pixels of a bucket are contiguous
+        order = np.argsort(pixels, kind='stable')
+        buckets, chunk = pixels[order] >> shift, chunk[order]
+        for bucket, start, stop in _runs(buckets):
+            with open(os.path.join(partial, f"{bucket}.rows"), "ab") as stream:
+                chunk[start:stop].tofile(stream)
+        rows += len(chunk)
+    os.rename(partial, part_dir)
+    return rows, os.path.getsize(source)
+
+
+def merge_bucket(bucket, parts, target, nside=64, bucket_nside=4):
+    """ Write the tiles of the pixels in ``bucket`` from its parts, sorted by magnitude.
+
+    Every tile is written to a temporary file and renamed into place, an
+    interrupted merge leaves complete tiles only. Tiles of pixels of the
+    bucket without rows, left by an earlier build, are removed.
+
+    :return: number of tiles written
+    :rtype: int
+    """
+    dtype = np.dtype(list(TILE_COLUMNS.items()))
+    rows = np.concatenate([np.fromfile(part, dtype) for part in parts])
+    pixels = hp.ang2pix(nside, rows['ra'], rows['dec'], nest=True, lonlat=True)
+    # one sort by pixel, then magnitude within a pixel
+    rows = rows[np.lexsort((rows['phot_g_mean_mag'], pixels))]
+    pixels.sort()
+    tiles = 0
+    for ipix, start, stop in _runs(pixels):
+        path = os.path.join(target, _tile_name(ipix, nside))
+        with open(path + ".tmp", "wb") as stream:
+            np.save(stream, rows[start:stop])
+        os.replace(path + ".tmp", path)
+        tiles += 1
+    shift = 2 * (hp.nside2order(nside) - hp.nside2order(bucket_nside))
+    _remove_tiles(target, set(range(bucket << shift, (bucket + 1) << shift)) - set(pixels.tolist()), nside)
+    return tiles
+
+
+def _partition_job(job):
+    return partition_source(*job)
+
+
+def _merge_job(job):
+    return merge_bucket(*job)
+
+
+def _runs(values):
+    # (value, start, stop) of the runs of equal values of a sorted array
+    if not len(values):
+        return []
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    stops = np.r_[starts[1:], len(values)]
+    return zip(values[starts].tolist(), starts.tolist(), stops.tolist())
+
+
+def _float_or_nan(value):
+    return np.nan if value.strip() in NULL_VALUES else float(value)
+
+
+def _valid(chunk):
+    # rows with finite floats, nulls of the float columns are read as nan
+    valid = np.ones(len(chunk), bool)
+    for name in chunk.dtype.names:
+        if chunk.dtype[name].kind == 'f':
+            valid &= np.isfinite(chunk[name])
+    return valid
+
+
+def _tile_name(ipix, nside=64):
+    return f"lvl{hp.nside2order(nside)}_{ipix:06d}.npy"
+
+
+def _tile_pixels(target, nside=64):
+    # pixels of the tiles in target
+    prefix = f"lvl{hp.nside2order(nside)}_"
+    return [int(name[len(prefix):-4]) for name in os.listdir(target)
+            if name.startswith(prefix) and name.endswith(".npy")]
+
+
+def _remove_tiles(target, pixels, nside=64):
+    # removes the tiles of pixels that exist, returns how many
+    removed = 0
+    for ipix in pixels:
+        try:
+            os.remove(os.path.join(target, _tile_name(ipix, nside)))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def _part_name(source):
+    # parts directory of a source file, unique for files of the same name in different directories,
+    # a file modified since it was partitioned gets a new one
+    base = os.path.basename(source)
+    stat = os.stat(source)
+    key = f"{os.path.abspath(source)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return f"{base}.{zlib.crc32(key.encode()):08x}"
+
+
+def _merge_marker(parts):
+    # content of the marker of a merged bucket, the parts directories and files it was merged from
+    return "\n".join(sorted(os.path.join(os.path.basename(os.path.dirname(part)), os.path.basename(part))
+                            for part in parts))
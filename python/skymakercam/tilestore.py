@@ -0,0 +1,661 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: tilestore.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import asyncio
+import functools
+import json
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import healpy as hp
+import numpy as np
+from astropy.io import fits
+
+
+__all__ = ['TileStore', 'ColumnTileStore', 'PackedTileStore', 'PyramidStore', 'CatalogColumns', 'tile_store',
+           'column_tile_store', 'packed_tile_store', 'pyramid_store', 'catalog_store', 'concatenate_tiles', 'brighter',
+           'columns_from_rows', 'write_column_tile', 'convert_npy_tiles', 'convert_fits_tiles', 'write_packed_store',
+           'write_pyramid', 'tile_pixels', 'PYRAMID_LEVELS']
+
+
+# columns of the columnar tiles, in file order, and their types
+COLUMNS = OrderedDict([('ra', np.float64), ('dec', np.float64), ('phot_g_mean_mag', np.float32), ('source_id', np.int64)])
+MAG_COLUMN = 'phot_g_mean_mag'
+
+# packed store file: magic, header length, json header, then the index and columns 64 byte aligned
+PACKED_MAGIC = b"SKYPACK1"
+PACKED_ALIGN = 64
+
+# (nside, faintest magnitude) of the levels of a magnitude pyramid, the last one holds the rest
+PYRAMID_LEVELS = ((8, 12.0), (32, 15.0), (64, None))
+
+
+class TileStore:
+    """ HEALPix catalog tiles opened as memory maps and kept in a LRU cache.
+
+    Tiles are ``.npy`` files named by ``pattern`` in ``directory``, opened
+    with ``mmap_mode='r'`` so only the pages a query touches are read.
+    Opened tiles stay cached until their bytes exceed ``max_bytes``, then
+    the least recently used are closed. While tracking within a region the
+    same tiles are asked for again and again and cost no file access.
+
+    :param directory: directory holding the tiles
+    :type directory: str
+    :param pattern: file name of a tile, formatted with the pixel number
+    :type pattern: str
+    :param max_bytes: bytes of tiles kept open
+    :type max_bytes: int
+    :param threads: tiles opened in parallel by ``tiles`` and ``query``,
+                    on network file systems every open waits for a round trip
+    :type threads: int
+    """
+
+    def __init__(self, directory, pattern="lvl6_{:06d}.npy", max_bytes=256 * 2**20, threads=8):
+        self.directory = directory
+        self.pattern = pattern
+        self.max_bytes = max_bytes
+        self.threads = threads
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="tiles") if threads > 1 else None
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def path(self, ipix):
+        """ File name of tile ``ipix``."""
+        return os.path.join(self.directory, self.pattern.format(ipix))
+
+    def tile(self, ipix):
+        """ Catalog rows of tile ``ipix``, a read only memory map."""
+        ipix = int(ipix)
+        with self._lock:
+            tile = self._tiles.get(ipix)
+            if tile is not None:
+                self._tiles.move_to_end(ipix)
+                self.hits += 1
+                return tile
+            self.misses += 1
+
+        tile = self._open(ipix)
+
+        with self._lock:
+            if ipix not in self._tiles:
+                self._tiles[ipix] = tile
+                self.nbytes += tile.nbytes
+            # keep at least the tile just opened, even if it alone exceeds the budget
+            while self.nbytes > self.max_bytes and len(self._tiles) > 1:
+                _, stale = self._tiles.popitem(last=False)
+                self.nbytes -= stale.nbytes
+        return tile
+
+    def tiles(self, pixels, mag_limit=None):
+        """ The tiles of ``pixels`` in that order, missing ones opened on the thread pool.
+
+        With ``mag_limit`` only their stars brighter than it.
+        """
+        if self._executor is None:
+            tiles = [self.tile(ipix) for ipix in pixels]
+        else:
+            tiles = list(self._executor.map(self.tile, pixels))
+        if mag_limit is not None:
+            tiles = [brighter(tile, mag_limit) for tile in tiles]
+        return tiles
+
+    def query(self, pixels, mag_limit=None):
+        """ Rows of all tiles in ``pixels``, in that order, as one new array.
+
+        The result is allocated once with the summed length and the tiles
+        are copied into it, instead of growing it tile by tile. With
+        ``mag_limit`` only stars brighter than it are returned.
+        """
+        return concatenate_tiles(self.tiles(pixels, mag_limit))
+
+    async def query_async(self, pixels, mag_limit=None):
+        """ ``query`` run off the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.query, list(pixels), mag_limit)
+
+    def close(self):
+        """ Stop the reader threads and close all cached tiles."""
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+        self.clear()
+
+    def clear(self):
+        """ Close all cached tiles."""
+        with self._lock:
+            self._tiles.clear()
+            self.nbytes = 0
+
+    def _open(self, ipix):
+        try:
+            return np.load(self.path(ipix), mmap_mode='r')
+        except ValueError:
+            # empty tiles can not be mapped
+            return np.load(self.path(ipix))
+
+
+class ColumnTileStore(TileStore):
+    """ TileStore of columnar tiles written by ``write_column_tile``.
+
+    Every tile holds contiguous ra, dec, phot_g_mean_mag and source_id
+    arrays sorted by magnitude, so the stars brighter than a limit are a
+    prefix of each column found by bisection.
+    """
+
+    def __init__(self, directory, pattern="lvl6_{:06d}.npz", max_bytes=256 * 2**20, threads=8):
+        super().__init__(directory, pattern, max_bytes, threads)
+
+    def _open(self, ipix):
+        with np.load(self.path(ipix)) as columns:
+            return CatalogColumns({name: columns[name] for name in columns.files}, sorted_by=MAG_COLUMN)
+
+
+class PackedTileStore:
+    """ All columnar tiles of a catalog packed into one memory mapped file.
+
+    The file written by ``write_packed_store`` holds the tiles one after
+    the other in nested pixel order, each as a block of its columns sorted
+    by magnitude. A table of ``12 * nside**2`` (byte offset, rows) pairs in
+    the header locates every pixel, so a tile is a view of the mapping and
+    a query opens no file. The mapping is advised as random access, the
+    default read around of a page fault can be megabytes for a tile of a
+    few kilobytes, and the block of a requested tile is advised as needed,
+    so it is read with one request.
+
+    :param filename: packed store file
+    :type filename: str
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        with open(filename, "rb") as packed:
+            magic = packed.read(len(PACKED_MAGIC))
+            if magic != PACKED_MAGIC:
+                raise ValueError(f"{filename} is not a packed catalog store")
+            length = int(np.frombuffer(packed.read(8), "<u8")[0])
+            self.header = json.loads(packed.read(length).decode())
+        self.nside = self.header["nside"]
+        self.sorted_by = self.header["sorted_by"]
+        self.dtypes = OrderedDict((name, np.dtype(dtype)) for name, dtype in self.header["columns"])
+        self.row_bytes = sum(dtype.itemsize for dtype in self.dtypes.values())
+
+        with open(filename, "rb") as packed:
+            self._mmap = mmap.mmap(packed.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self._mmap, "madvise"):
+            self._mmap.madvise(mmap.MADV_RANDOM)
+        self._map = np.frombuffer(self._mmap, np.uint8)
+        npix = hp.nside2npix(self.nside)
+        self.index = self._map[self.header["index"]:self.header["index"] + 16 * npix].view("<i8").reshape(npix, 2)
+
+    def __len__(self):
+        return self.header["rows"]
+
+    def path(self, ipix):
+        """ Name of tile ``ipix`` within the store, for messages."""
+        return f"{self.filename}[{int(ipix)}]"
+
+    def tile(self, ipix):
+        """ Catalog rows of pixel ``ipix``, views of the mapped block."""
+        offset, rows = (int(value) for value in self.index[int(ipix)])
+        self.hits += 1
+        if rows and hasattr(self._mmap, "madvise"):
+            start = offset - offset % mmap.PAGESIZE
+            self._mmap.madvise(mmap.MADV_WILLNEED, start, offset + rows * self.row_bytes - start)
+        columns = OrderedDict()
+        for name, dtype in self.dtypes.items():
+            columns[name] = self._map[offset:offset + rows * dtype.itemsize].view(dtype)
+            offset += rows * dtype.itemsize
+        return CatalogColumns(columns, sorted_by=self.sorted_by)
+
+    def tiles(self, pixels, mag_limit=None):
+        """ The tiles of ``pixels`` in that order, with ``mag_limit`` their stars brighter than it."""
+        tiles = [self.tile(ipix) for ipix in pixels]
+        if mag_limit is not None:
+            tiles = [tile.brighter(mag_limit) for tile in tiles]
+        return tiles
+
+    def query(self, pixels, mag_limit=None):
+        """ Rows of all tiles in ``pixels``, in that order, as one new CatalogColumns."""
+        return concatenate_tiles(self.tiles(pixels, mag_limit))
+
+    async def query_async(self, pixels, mag_limit=None):
+        """ ``query`` run off the event loop, page faults of a cold store block."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.query, list(pixels), mag_limit)
+
+    def close(self):
+        """ Drop the mapping, tiles handed out keep it alive until they are gone."""
+        self.index = None
+        self._map = None
+        self._mmap = None
+
+    def clear(self):
+        """ Nothing is cached apart from the mapping itself."""
+
+
+class PyramidStore:
+    """ Catalog split by magnitude into levels of increasing depth and nside.
+
+    Every level is a packed store written by ``write_pyramid`` holding
+    the stars from its ``mag_min`` up to its ``mag_max`` in tiles of its
+    nside. The bright levels are sparse and tiled coarsely, the faint ones
+    finely. A query with a magnitude limit reads only the levels starting
+    brighter than it, so a bright limit reads a few small coarse tiles
+    instead of the full depth.
+
+    Pixels are given in nested ``nside`` (the finest level), the tiles of
+    a coarser level cover several of them and their stars are returned
+    with the first pixel of a query within each, so a query can return
+    stars somewhat beyond the asked pixels.
+
+    :param directory: directory holding the level files
+    :type directory: str
+    :param nside: HEALPix nside of the pixels asked for
+    :type nside: int
+    """
+
+    def __init__(self, directory, nside=64):
+        self.directory = directory
+        self.nside = nside
+        self.levels = sorted((PackedTileStore(os.path.join(directory, name))
+                              for name in os.listdir(directory) if name.endswith(".pack")),
+                             key=lambda level: level.header["mag_min"])
+        if not self.levels:
+            raise ValueError(f"no pyramid levels in {directory}")
+        for level in self.levels:
+            if level.nside > nside:
+                raise ValueError(f"pyramid level of nside {level.nside} is finer than the pixels of nside {nside}")
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+
+    def path(self, ipix):
+        """ Name of pixel ``ipix`` within the pyramid, for messages."""
+        return f"{self.directory}[{int(ipix)}]"
+
+    def levels_for(self, mag_limit=None):
+        """ The levels holding stars brighter than ``mag_limit``."""
+        return [level for level in self.levels if mag_limit is None or level.header["mag_min"] < mag_limit]
+
+    def tiles(self, pixels, mag_limit=None):
+        """ The stars of ``pixels`` in that order, with ``mag_limit`` only those brighter than it.
+
+        A coarse tile is returned with the first pixel it covers, the other
+        pixels get none of its stars.
+        """
+        pixels = [int(ipix) for ipix in pixels]
+        parts = [[] for _ in pixels]
+        order = hp.nside2order(self.nside)
+        for level in self.levels_for(mag_limit):
+            shift = 2 * (order - hp.nside2order(level.nside))
+            seen = set()
+            for part, ipix in zip(parts, pixels):
+                if ipix >> shift not in seen:
+                    seen.add(ipix >> shift)
+                    tile = level.tile(ipix >> shift)
+                    part.append(tile if mag_limit is None else tile.brighter(mag_limit))
+        self.hits += len(pixels)
+        empty = CatalogColumns(OrderedDict((name, np.empty(0, dtype)) for name, dtype in self.levels[0].dtypes.items()),
+                               sorted_by=MAG_COLUMN)
+        return [CatalogColumns.concatenate(part) if len(part) > 1 else part[0] if part else empty for part in parts]
+
+    def query(self, pixels, mag_limit=None):
+        """ Rows of all levels needed for ``pixels``, as one new CatalogColumns."""
+        return concatenate_tiles(self.tiles(pixels, mag_limit))
+
+    async def query_async(self, pixels, mag_limit=None):
+        """ ``query`` run off the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.query, list(pixels), mag_limit)
+
+    def close(self):
+        """ Drop the mappings of all levels."""
+        for level in self.levels:
+            level.close()
+
+    def clear(self):
+        """ Nothing is cached apart from the mappings."""
+
+
+class CatalogColumns:
+    """ Catalog rows as one contiguous array per column.
+
+    Indexed with a column name it returns that column, indexed with a
+    slice, mask or index array it returns the selected rows as
+    CatalogColumns, like a structured array does.
+
+    :param columns: equally long arrays by column name
+    :type columns: dict
+    :param sorted_by: name of the column the rows are sorted by, if any
+    :type sorted_by: str
+    """
+
+    def __init__(self, columns, sorted_by=None):
+        self.columns = OrderedDict(columns)
+        self.sorted_by = sorted_by
+
+    @property
+    def names(self):
+        return tuple(self.columns)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.columns[key]
+        sorted_by = self.sorted_by if isinstance(key, slice) and (key.step or 1) > 0 else None
+        return CatalogColumns({name: column[key] for name, column in self.columns.items()}, sorted_by)
+
+    def __iter__(self):
+        # rows as dicts, for code written for structured arrays
+        for index in range(len(self)):
+            yield {name: column[index] for name, column in self.columns.items()}
+
+    def brighter(self, mag_limit, column=MAG_COLUMN):
+        """ The rows with ``column`` below ``mag_limit``, a prefix view if sorted by it."""
+        if self.sorted_by == column:
+            return self[:np.searchsorted(self.columns[column], mag_limit, side='left')]
+        return self[self.columns[column] < mag_limit]
+
+    @classmethod
+    def concatenate(cls, tiles):
+        """ The rows of all tiles after each other, every column allocated once."""
+        names = tiles[0].names
+        length = sum(len(tile) for tile in tiles)
+        columns = OrderedDict((name, np.empty(length, tiles[0][name].dtype)) for name in names)
+        start = 0
+        for tile in tiles:
+            for name in names:
+                columns[name][start:start + len(tile)] = tile[name]
+            start += len(tile)
+        return cls(columns)
+
+
+def brighter(tile, mag_limit):
+    """ Stars of a structured or columnar tile brighter than ``mag_limit``."""
+    if isinstance(tile, CatalogColumns):
+        return tile.brighter(mag_limit)
+    return tile[tile[MAG_COLUMN] < mag_limit]
+
+
+def concatenate_tiles(tiles):
+    """ One array allocated once holding the rows of all tiles after each other."""
+    if not tiles:
+        return np.empty(0)
+    if isinstance(tiles[0], CatalogColumns):
+        return CatalogColumns.concatenate(tiles)
+    combined = np.empty(sum(len(tile) for tile in tiles), dtype=tiles[0].dtype)
+    start = 0
+    for tile in tiles:
+        combined[start:start + len(tile)] = tile
+        start += len(tile)
+    return combined
+
+
+@functools.lru_cache(maxsize=None)
+def tile_store(directory, pattern="lvl6_{:06d}.npy"):
+    """ The shared TileStore of a tile directory, its cache lives across calls."""
+    return TileStore(directory, pattern)
+
+
+@functools.lru_cache(maxsize=None)
+def column_tile_store(directory, pattern="lvl6_{:06d}.npz"):
+    """ The shared ColumnTileStore of a columnar tile directory."""
+    return ColumnTileStore(directory, pattern)
+
+
+@functools.lru_cache(maxsize=None)
+def packed_tile_store(filename):
+    """ The shared PackedTileStore of a packed store file, mapped once."""
+    return PackedTileStore(filename)
+
+
+@functools.lru_cache(maxsize=None)
+def pyramid_store(directory):
+    """ The shared PyramidStore of a pyramid directory."""
+    return PyramidStore(directory)
+
+
+def catalog_store(catalog_path, shared=True):
+    """ Shared store of the best tile format found in ``catalog_path``.
+
+    The magnitude pyramid in ``Gaia_Healpix_pyramid`` if built, else the
+    packed ``Gaia_Healpix_6.pack`` file, else the columnar tiles in
+    ``Gaia_Healpix_6_columns`` if converted, else the structured
+    ``Gaia_Healpix_6`` tiles. With ``shared`` False a new store is opened,
+    owned by the caller, who closes it.
+    """
+    pyramid = os.path.join(catalog_path, "Gaia_Healpix_pyramid")
+    if os.path.isdir(pyramid):
+        return pyramid_store(pyramid) if shared else PyramidStore(pyramid)
+    packed = os.path.join(catalog_path, "Gaia_Healpix_6.pack")
+    if os.path.isfile(packed):
+        return packed_tile_store(packed) if shared else PackedTileStore(packed)
+    columns = os.path.join(catalog_path, "Gaia_Healpix_6_columns")
+    if os.path.isdir(columns):
+        return column_tile_store(columns) if shared else ColumnTileStore(columns)
+    tiles = os.path.join(catalog_path, "Gaia_Healpix_6")
+    return tile_store(tiles) if shared else TileStore(tiles)
+
+
+def columns_from_rows(rows):
+    """ Columnar, magnitude sorted copy of catalog rows with the fields of ``COLUMNS``.
+
+    Rows is a structured array, FITS record array or astropy Table, a missing
+    source_id column is left out.
+    """
+    names = rows.dtype.names if hasattr(rows, 'dtype') and rows.dtype.names else rows.colnames
+    order = np.argsort(np.asarray(rows[MAG_COLUMN], dtype=COLUMNS[MAG_COLUMN]), kind='stable')
+    return CatalogColumns(OrderedDict((name, np.ascontiguousarray(np.asarray(rows[name])[order], dtype=dtype))
+                                      for name, dtype in COLUMNS.items() if name in names), sorted_by=MAG_COLUMN)
+
+
+def write_column_tile(path, columns):
+    """ Save columns as an uncompressed columnar tile."""
+    np.savez(path, **columns.columns)
+
+
+def convert_npy_tiles(source, target, pattern="lvl6_{:06d}.npy", target_pattern="lvl6_{:06d}.npz"):
+    """ Convert the structured nested nside 64 tiles of ``Gaia_Healpix_6`` to columnar tiles.
+
+    :return: number of converted tiles
+    :rtype: int
+    """
+    os.makedirs(target, exist_ok=True)
+    converted = 0
+    for name in sorted(os.listdir(source)):
+        ipix = _tile_number(name, pattern)
+        if ipix is None:
+            continue
+        write_column_tile(os.path.join(target, target_pattern.format(ipix)),
+                          columns_from_rows(np.load(os.path.join(source, name))))
+        converted += 1
+    return converted
+
+
+def convert_fits_tiles(source, target, nside=64, pattern="{:06d}.fits", target_pattern="lvl6_{:06d}.npz"):
+    """ Convert the ring ordered FITS tiles of ``Gaia_Healpix_64`` to nested columnar tiles.
+
+    :return: number of converted tiles
+    :rtype: int
+    """
+    os.makedirs(target, exist_ok=True)
+    converted = 0
+    for name in sorted(os.listdir(source)):
+        ipix = _tile_number(name, pattern)
+        if ipix is None:
+            continue
+        with fits.open(os.path.join(source, name)) as hdul:
+            columns = columns_from_rows(hdul[1].data)
+        write_column_tile(os.path.join(target, target_pattern.format(int(hp.ring2nest(nside, ipix)))), columns)
+        converted += 1
+    return converted
+
+
+def tile_pixels(directory, pattern):
+    """ Sorted pixel numbers of the tiles named by ``pattern`` in ``directory``."""
+    return sorted(ipix for ipix in (_tile_number(name, pattern) for name in os.listdir(directory)) if ipix is not None)
+
+
+def write_packed_store(filename, store, pixels, nside=64, meta=None):
+    """ Pack the tiles of ``pixels`` from ``store`` into one file for PackedTileStore.
+
+    The tiles are read twice, once for their lengths, which lay out the
+    file, and once to copy them into it, so only one tile is held in
+    memory at a time. Structured tiles are converted to magnitude sorted
+    columns on the way, pixels missing from ``pixels`` are empty.
+
+    :param filename: packed store file to write
+    :type filename: str
+    :param store: TileStore or ColumnTileStore of the tiles
+    :type store: TileStore
+    :param pixels: nested pixel numbers of the tiles
+    :type pixels: list
+    :param nside: HEALPix nside of the tiles
+    :type nside: int
+    :param meta: further entries of the header
+    :type meta: dict
+    :return: number of packed rows
+    :rtype: int
+    """
+    pixels = sorted(int(ipix) for ipix in pixels)
+    rows = np.zeros(hp.nside2npix(nside), np.int64)
+    for ipix in pixels:
+        rows[ipix] = len(store.tile(ipix))
+        store.clear()
+
+    first = _as_columns(store.tile(pixels[0])) if pixels else CatalogColumns(
+        OrderedDict((name, np.empty(0, dtype)) for name, dtype in COLUMNS.items()))
+    # the wide columns first keep every column of a 64 byte aligned block aligned
+    dtypes = OrderedDict(sorted(((name, first[name].dtype.newbyteorder("<")) for name in first.names),
+                                key=lambda item: -item[1].itemsize))
+    row_bytes = sum(dtype.itemsize for dtype in dtypes.values())
+
+    header = {"nside": nside, "rows": int(rows.sum()), "sorted_by": MAG_COLUMN, "index": 0,
+              "columns": [[name, dtype.str] for name, dtype in dtypes.items()], **(meta or {})}
+    # the index offset is at most 20 digits wider than the 0 it replaces
+    header["index"] = _align(len(PACKED_MAGIC) + 8 + len(json.dumps(header)) + 20)
+    encoded = json.dumps(header).encode()
+
+    index = np.zeros((len(rows), 2), np.int64)
+    index[:, 1] = rows
+    blocks = _align(rows * row_bytes)
+    index[:, 0] = _align(header["index"] + index.nbytes) + np.cumsum(blocks) - blocks
+
+    packed = np.memmap(filename, np.uint8, mode="w+", shape=(int(index[-1, 0] + blocks[-1]),))
+    packed[:len(PACKED_MAGIC)] = np.frombuffer(PACKED_MAGIC, np.uint8)
+    packed[len(PACKED_MAGIC):len(PACKED_MAGIC) + 8] = np.array([len(encoded)], "<u8").view(np.uint8)
+    packed[len(PACKED_MAGIC) + 8:len(PACKED_MAGIC) + 8 + len(encoded)] = np.frombuffer(encoded, np.uint8)
+    packed[header["index"]:header["index"] + index.nbytes] = index.astype("<i8").view(np.uint8).ravel()
+
+    for ipix in pixels:
+        tile = _as_columns(store.tile(ipix))
+        store.clear()
+        offset = int(index[ipix, 0])
+        for name, dtype in dtypes.items():
+            packed[offset:offset + len(tile) * dtype.itemsize].view(dtype)[:] = tile[name]
+            offset += len(tile) * dtype.itemsize
+    packed.flush()
+    del packed
+    return int(rows.sum())
+
+
+def write_pyramid(directory, store, pixels, nside=64, levels=PYRAMID_LEVELS):
+    """ Split the tiles of ``pixels`` from ``store`` into a magnitude pyramid for PyramidStore.
+
+    Level ``i`` holds the stars from the faint limit of level ``i - 1`` up
+    to its own in tiles of its nside, each tile merged from the ``nside``
+    tiles it covers, and is written as packed store ``level_<i>.pack``.
+
+    :param directory: pyramid directory to write
+    :type directory: str
+    :param store: TileStore, ColumnTileStore or PackedTileStore of the tiles
+    :type store: TileStore
+    :param pixels: nested pixel numbers of the tiles
+    :type pixels: list
+    :param nside: HEALPix nside of the tiles
+    :type nside: int
+    :param levels: (nside, faintest magnitude) of each level, brightest first, None for no limit
+    :type levels: tuple
+    :return: rows of each level
+    :rtype: list
+    """
+    os.makedirs(directory, exist_ok=True)
+    pixels = sorted(int(ipix) for ipix in pixels)
+    rows = []
+    mag_min = -np.inf
+    for number, (level_nside, mag_max) in enumerate(levels):
+        if level_nside > nside:
+            raise ValueError(f"pyramid level of nside {level_nside} is finer than the tiles of nside {nside}")
+        mag_max = np.inf if mag_max is None else mag_max
+        shift = 2 * (hp.nside2order(nside) - hp.nside2order(level_nside))
+        level = _MagnitudeSlice(store, pixels, shift, mag_min, mag_max)
+        rows.append(write_packed_store(os.path.join(directory, f"level_{number}.pack"), level,
+                                       sorted(set(ipix >> shift for ipix in pixels)), level_nside,
+                                       meta={"mag_min": float(mag_min), "mag_max": float(mag_max)}))
+        mag_min = mag_max
+    return rows
+
+
+class _MagnitudeSlice:
+    # tiles of a coarser nside holding the stars of mag_min <= m < mag_max of the tiles they cover,
+    # read one coarse tile at a time by write_packed_store
+
+    def __init__(self, store, pixels, shift, mag_min, mag_max):
+        self.store = store
+        self.children = {}
+        for ipix in pixels:
+            self.children.setdefault(ipix >> shift, []).append(ipix)
+        self.mag_min = mag_min
+        self.mag_max = mag_max
+
+    def tile(self, ipix):
+        parts = []
+        for child in self.children.get(ipix, []):
+            tile = _as_columns(self.store.tile(child))
+            mags = tile[MAG_COLUMN]
+            parts.append(tile[np.searchsorted(mags, self.mag_min, side='left'):np.searchsorted(mags, self.mag_max, side='left')])
+        self.store.clear()
+        merged = CatalogColumns.concatenate(parts)
+        order = np.argsort(merged[MAG_COLUMN], kind='stable')
+        return CatalogColumns(OrderedDict((name, column[order]) for name, column in merged.columns.items()),
+                              sorted_by=MAG_COLUMN)
+
+    def clear(self):
+        pass
+
+
+def _as_columns(tile):
+    # magnitude sorted columns of a structured or columnar tile
+    return tile if isinstance(tile, CatalogColumns) else columns_from_rows(tile)
+
+
+def _align(offset):
+    return -(-offset // PACKED_ALIGN) * PACKED_ALIGN
+
+
+def _tile_number(name, pattern):
+    # pixel number of a tile file name made with pattern, None for other files
+    prefix, suffix = pattern.split("{", 1)[0], pattern.rsplit("}", 1)[1]
+    number = name[len(prefix):len(name) - len(suffix)]
+    if name.startswith(prefix) and name.endswith(suffix) and number.isdigit():
+        return int(number)
+    return None
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: video.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import asyncio
+import time
+
+
+__all__ = ['VideoStream']
+
+
+class VideoStream:
+    """ Frames of an async producer delivered as an async iterator.
+
+    A background task calls ``produce`` at the configured cadence and puts
+    the frames into a bounded queue, so the next frame is rendered while the
+    consumer handles the current one. If the consumer falls behind, policy
+    "drop-oldest" replaces the oldest queued frame and counts it as dropped,
+    "block" holds the producer until there is room.
+
+    :param produce: coroutine function returning the next frame
+    :type produce: callable
+    :param fps: frames per second to aim for, None for as fast as possible
+    :type fps: float
+    :param maxsize: frames queued at most
+    :type maxsize: int
+    :param policy: "drop-oldest" or "block"
+    :type policy: str
+    """
+
+    def __init__(self, produce, fps=None, maxsize=2, policy="drop-oldest"):
+        if policy not in ("drop-oldest", "block"):
+            raise ValueError(f"unknown queue policy {policy!r}")
+        if maxsize < 1:
+            raise ValueError("the frame queue needs room for at least one frame")
+        self.produce = produce
+        self.fps = fps
+        self.maxsize = maxsize
+        self.policy = policy
+        self.produced = 0
+        self.delivered = 0
+        self.dropped = 0
+
+        self._queue = asyncio.Queue(maxsize)
+        self._task = None
+        self._started = None
+        self._closed = False
+
+    @property
+    def achieved_fps(self):
+        """ Frames delivered per second since the first one was asked for."""
+        if not self._started or not self.delivered:
+            return 0.0
+        return self.delivered / max(time.monotonic() - self._started, 1e-9)
+
+    def stats(self):
+        """ Produced, delivered and dropped frames and the achieved rate."""
+        return {"produced": self.produced, "delivered": self.delivered, "dropped": self.dropped,
+                "fps": self.achieved_fps}
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        if self._task is None:
+            self._started = time.monotonic()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+        getter = asyncio.ensure_future(self._queue.get())
+        done, _ = await asyncio.wait([getter, self._task], return_when=asyncio.FIRST_COMPLETED)
+        if getter not in done:
+            # the producer stopped, by close or with an exception raised here
+            getter.cancel()
+            if self._task.cancelled():
+                raise StopAsyncIteration
+            self._task.result()
+            raise StopAsyncIteration
+
+        self.delivered += 1
+        return getter.result()
+
+    async def close(self):
+        """ Stop producing, queued frames are discarded."""
+        self._closed = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _run(self):
+        period = 1.0 / self.fps if self.fps else 0.0
+        deadline = time.monotonic()
+        while True:
+            frame = await self.produce()
+            self.produced += 1
+
+            if self.policy == "block":
+                await self._queue.put(frame)
+            else:
+                if self._queue.full():
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                self._queue.put_nowait(frame)
+
+            # keep the cadence, but do not try to catch up after slow frames
+            deadline = max(deadline + period, time.monotonic())
+            await asyncio.sleep(max(deadline - time.monotonic(), 0.0))
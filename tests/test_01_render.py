@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: test_01_render.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from skymakercam.framecache import FrameCache, IncrementalRenderer
+from skymakercam.noise import NoiseEngine
+from skymakercam.render import (RenderContext, convolve_fft, convolve_jitter, convolve_ndimage, deposit_stars, gaussian_transfer_function,
+                                padded_window, psf_sigma, render_stamps, render_tiled, shift_frames)
+from skymakercam.starimage import guide_windows, make_guide_stamps, make_synthetic_cube, make_synthetic_image, render_expected_image
+
+
+def test_deposit_bilinear_weights():
+
+    image = deposit_stars(np.array([2.25]), np.array([3.5]), np.array([8.0]), (6, 5))
+
+    assert image.sum() == pytest.approx(8.0)
+    assert image[3, 2] == pytest.approx(0.75 * 0.5 * 8.0)
+    assert image[3, 3] == pytest.approx(0.25 * 0.5 * 8.0)
+    assert image[4, 2] == pytest.approx(0.75 * 0.5 * 8.0)
+    assert image[4, 3] == pytest.approx(0.25 * 0.5 * 8.0)
+
+
+def test_deposit_overlapping_stars_accumulate():
+
+    image = deposit_stars(np.array([1.0, 1.0, 1.5]), np.array([1.0, 1.0, 1.0]), np.array([1.0, 2.0, 4.0]), (3, 3))
+
+    assert image[1, 1] == pytest.approx(1.0 + 2.0 + 2.0)
+    assert image[1, 2] == pytest.approx(2.0)
+    assert image.sum() == pytest.approx(7.0)
+
+
+def test_deposit_drops_weights_beyond_last_pixel():
+
+    image = deposit_stars(np.array([4.5]), np.array([5.5]), np.array([1.0]), (6, 5))
+
+    assert image[5, 4] == pytest.approx(0.25)
+    assert image.sum() == pytest.approx(0.25)
+
+
+def test_stamps_match_full_frame_convolution():
+
+    shape = (80, 100)
+    x_position, y_position, flux = np.array([30.3, 60.8]), np.array([40.6, 20.1]), np.array([1000.0, 500.0])
+
+    full = convolve_ndimage(deposit_stars(x_position, y_position, flux, shape), 2.5, defocus=1.5)
+    stamps = render_stamps(x_position, y_position, flux, shape, psf_sigma(2.5, 1.5))
+
+    assert stamps.sum() == pytest.approx(full.sum(), rel=1e-3)
+    assert np.abs(stamps - full).max() < 3e-2 * full.max()
+
+
+def test_stamps_clip_at_chip_edges():
+
+    image = render_stamps(np.array([0.0]), np.array([0.0]), np.array([1.0]), (20, 20), 2.0)
+
+    # pixel 0 covers [-0.5, 0.5], everything left of -0.5 is lost in each axis
+    on_chip = 0.5 * (1 + math.erf(0.5 / 2.0 / math.sqrt(2)))
+    assert image.sum() == pytest.approx(on_chip ** 2, rel=1e-3)
+
+
+def test_fft_matches_full_frame_convolution():
+
+    shape = (90, 70)
+    star_image = deposit_stars(np.array([35.3, 5.0]), np.array([40.6, 80.0]), np.array([1000.0, 500.0]), shape)
+
+    full = convolve_ndimage(star_image, 2.5)
+    fft = convolve_fft(star_image, 2.5)
+
+    assert fft.shape == shape
+    assert np.abs(fft - full).max() < 1e-9 * full.max()
+
+
+def test_fft_transfer_function_is_cached():
+
+    gaussian_transfer_function.cache_clear()
+    star_image = deposit_stars(np.array([10.5]), np.array([12.5]), np.array([1.0]), (32, 40))
+
+    convolve_fft(star_image, 1.5, defocus=3.0)
+    convolve_fft(star_image, 1.5, defocus=3.0)
+
+    info = gaussian_transfer_function.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+
+
+def make_inst(**kwargs):
+
+    params = dict(chip_size_pix=[400, 300], chip_size_mm=[4.0, 3.0], image_scale=8.92, zp=-20.0,
+                  dark_current=15, readout_noise=5, bias=100)
+    params.update(kwargs)
+    return SimpleNamespace(**params)
+
+
+def test_binned_frame_has_summed_background_statistics():
+
+    inst = make_inst()
+    empty = np.array([])
+
+    frame = make_synthetic_image(empty, empty, empty, inst, exp_time=2, sky_flux=10, binning=(2, 4))
+
+    assert frame.shape == (75, 200)
+    background = (10 + inst.dark_current) * 2
+    assert frame.mean() == pytest.approx(8 * (background + inst.bias), rel=1e-2)
+    assert frame.var() == pytest.approx(8 * (background + inst.readout_noise ** 2), rel=5e-2)
+
+
+def test_faint_stars_folded_into_background_keep_the_flux():
+
+    inst = make_inst()
+    rng = np.random.default_rng(3)
+    chip_x, chip_y = rng.uniform(0.5, 3.5, 400), rng.uniform(0.5, 2.5, 400)
+    gmag = np.r_[np.full(4, 8.0), np.full(396, 14.0)]
+
+    full = make_synthetic_image(chip_x, chip_y, gmag, inst, backend="ndimage", context=RenderContext()).copy()
+    folded = make_synthetic_image(chip_x, chip_y, gmag, inst, backend="ndimage", context=RenderContext(),
+                                  mag_cutoff=10.0, fold_faint=True).copy()
+    skipped = make_synthetic_image(chip_x, chip_y, gmag, inst, backend="ndimage", context=RenderContext(),
+                                   mag_cutoff=10.0)
+
+    faint = 396 * 10 ** (-(14.0 + inst.zp) / 2.5) * 5 / folded.size
+    assert folded.mean() == pytest.approx(full.mean(), rel=1e-3)
+    assert full.mean() - skipped.mean() == pytest.approx(faint, rel=0.1)
+
+
+def test_render_context_reuses_float32_buffers():
+
+    inst = make_inst()
+    context = RenderContext()
+    chip_x, chip_y, gmag = np.array([1.0, 2.5]), np.array([1.2, 0.7]), np.array([10.0, 12.0])
+
+    first = make_synthetic_image(chip_x, chip_y, gmag, inst, backend="ndimage", context=context)
+    nbytes = context.nbytes
+    second = make_synthetic_image(chip_x, chip_y, gmag, inst, backend="ndimage", context=context)
+
+    assert second is first
+    assert second.dtype == np.float32
+    assert context.nbytes == nbytes
+
+
+@pytest.mark.parametrize("tiles", [1, 3, 7])
+def test_tiled_render_is_bit_identical(tiles):
+
+    shape = (120, 90)
+    rng = np.random.default_rng(11)
+    x_position, y_position, flux = rng.uniform(0, 90, 50), rng.uniform(0, 120, 50), rng.uniform(1, 1e3, 50)
+    full = convolve_ndimage(deposit_stars(x_position, y_position, flux, shape), (2.0, 1.5), defocus=(3.0, 2.0))
+
+    with ThreadPoolExecutor(3) as executor:
+        tiled = render_tiled(x_position, y_position, flux, shape, (2.0, 1.5), defocus=(3.0, 2.0), tiles=tiles, executor=executor)
+
+    assert np.array_equal(tiled, full)
+
+
+def test_tiled_frame_is_reproducible_for_any_tile_count():
+
+    inst = make_inst()
+    chip_x, chip_y, gmag = np.array([1.0, 2.5, 3.9]), np.array([1.2, 0.7, 2.9]), np.array([10.0, 12.0, 11.0])
+
+    frames = []
+    for tiles in (1, 4):
+        context = RenderContext(noise=NoiseEngine(seed=9), threads=2, tiles=tiles)
+        try:
+            frames.append(make_synthetic_image(chip_x, chip_y, gmag, inst, defocus=2.0, backend="tiled", context=context))
+        finally:
+            context.close()
+
+    assert np.array_equal(*frames)
+
+
+def test_frame_cache_scales_noiseless_frame_with_exposure_time():
+
+    inst = make_inst(readout_noise=0.0, bias=0.0, dark_current=0.0)
+    chip_x, chip_y, gmag = np.array([1.0, 2.5]), np.array([1.2, 0.7]), np.array([3.0, 4.0])
+    context = RenderContext(noise=NoiseEngine(seed=4, gaussian_lambda=1.0), frame_cache=FrameCache())
+
+    short = make_synthetic_image(chip_x, chip_y, gmag, inst, exp_time=1, sky_flux=0, context=context).sum()
+    long = make_synthetic_image(chip_x, chip_y, gmag, inst, exp_time=4, sky_flux=0, context=context).sum()
+
+    assert (context.frame_cache.hits, context.frame_cache.misses) == (1, 1)
+    assert long == pytest.approx(4 * short, rel=1e-3)
+
+    context.frame_cache.invalidate()
+    make_synthetic_image(chip_x, chip_y, gmag, inst, exp_time=1, sky_flux=0, context=context)
+    assert context.frame_cache.misses == 2
+
+
+@pytest.mark.parametrize("method, tolerance", [("bilinear", 1e-1), ("fourier", 1e-3)])
+def test_incremental_renderer_shifts_last_frame(method, tolerance):
+
+    shape = (80, 100)
+    x_position, y_position, flux = np.array([30.0, 60.0, 45.0]), np.array([40.0, 20.0, 55.0]), np.array([1e3, 5e2, 8e2])
+    params = (shape, (2.0, 2.0), 0.0, "ndimage")
+    incremental = IncrementalRenderer(method=method)
+
+    incremental.remember(x_position, y_position, flux, params, render_stamps(x_position, y_position, flux, shape, 2.0))
+    shifted = incremental.render(x_position + 1.3, y_position - 0.6, flux, params, np.empty(shape))
+    full = render_stamps(x_position + 1.3, y_position - 0.6, flux, shape, 2.0)
+
+    assert incremental.reused == 1
+    assert shifted.sum() == pytest.approx(full.sum(), rel=1e-2)
+    assert np.abs(shifted - full).max() < tolerance * full.max()
+
+
+def test_incremental_renderer_declines_changed_fields():
+
+    shape = (50, 50)
+    x_position, y_position, flux = np.array([20.0, 30.0]), np.array([25.0, 10.0]), np.array([1.0, 2.0])
+    params = (shape, (2.0, 2.0), 0.0, "ndimage")
+    incremental = IncrementalRenderer(max_shift=2.0)
+    incremental.remember(x_position, y_position, flux, params, np.zeros(shape))
+    out = np.empty(shape)
+
+    assert incremental.render(x_position + 3.0, y_position, flux, params, out) is None
+    assert incremental.render(x_position, y_position, flux * 2, params, out) is None
+    assert incremental.render(x_position, y_position, flux, (shape, (2.5, 2.5), 0.0, "ndimage"), out) is None
+    assert incremental.render(x_position + [0.5, -0.5], y_position, flux, params, out) is None
+    assert incremental.reused == 0
+
+
+def test_padded_window_matches_full_frame():
+
+    shape = (120, 90)
+    rng = np.random.default_rng(5)
+    x_position, y_position, flux = rng.uniform(0, 90, 60), rng.uniform(0, 120, 60), rng.uniform(1, 1e3, 60)
+    full = convolve_ndimage(deposit_stars(x_position, y_position, flux, shape), (2.0, 1.5), defocus=(3.0, 2.0))
+
+    (x_origin, y_origin), padded, crop = padded_window((30, 40, 25, 20), (2.0, 1.5), defocus=(3.0, 2.0))
+    window = convolve_ndimage(deposit_stars(x_position - x_origin, y_position - y_origin, flux, padded), (2.0, 1.5),
+                              defocus=(3.0, 2.0))[crop]
+
+    assert window.shape == (20, 25)
+    assert np.array_equal(window, full[40:60, 30:55])
+
+
+def test_window_renders_stars_outside_it():
+
+    inst = make_inst(readout_noise=0.0, bias=0.0, dark_current=0.0)
+    # one bright star 3 pixels left of the window
+    chip_x, chip_y, gmag = np.array([0.97]), np.array([1.5]), np.array([3.0])
+    context = RenderContext(noise=NoiseEngine(seed=2, gaussian_lambda=1.0))
+
+    full = make_synthetic_image(chip_x, chip_y, gmag, inst, sky_flux=0, defocus=2.0, context=context)[140:160, 100:130].copy()
+    window = make_synthetic_image(chip_x, chip_y, gmag, inst, sky_flux=0, defocus=2.0, window=(100, 140, 30, 20), context=context)
+
+    assert window.shape == (20, 30)
+    assert window.sum() == pytest.approx(full.sum(), rel=1e-2)
+
+
+def test_guide_windows_stay_on_chip():
+
+    assert guide_windows([(10.2, 20.7, 8), (1.0, 298.0, 8), (399.0, 0.0, 5)], (300, 400)) == \
+        [(6, 17, 8, 8), (0, 292, 8, 8), (395, 0, 5, 5)]
+    with pytest.raises(ValueError):
+        guide_windows([(10.0, 10.0, 301)], (300, 400))
+
+
+def test_guide_stamps_stack_star_boxes():
+
+    inst = make_inst(readout_noise=0.0, bias=0.0, dark_current=0.0)
+    chip_x, chip_y, gmag = np.array([1.0, 2.5]), np.array([1.2, 0.7]), np.array([3.0, 4.0])
+    context = RenderContext(noise=NoiseEngine(seed=8, gaussian_lambda=1.0))
+
+    stack, windows = make_guide_stamps(chip_x, chip_y, gmag, inst, [(99.5, 119.5, 16), (249.5, 69.5, 16)], sky_flux=0,
+                                       context=context)
+
+    assert stack.shape == (2, 16, 16)
+    assert windows == [(92, 112, 16, 16), (242, 62, 16, 16)]
+    # each star sits in the center of its box
+    assert np.unravel_index(stack[0].argmax(), (16, 16)) in [(7, 7), (7, 8), (8, 7), (8, 8)]
+    assert stack[0].sum() > stack[1].sum() > 0
+
+
+def test_shift_frames_moves_stars():
+
+    shape = (60, 80)
+    frame = render_stamps(np.array([40.0]), np.array([30.0]), np.array([100.0]), shape, 2.0)
+
+    stack = shift_frames(frame, [(0.0, 0.0), (2.4, -1.5)], np.empty((2,) + shape))
+
+    assert np.allclose(stack[0], frame, atol=1e-9)
+    assert np.abs(stack[1] - render_stamps(np.array([42.4]), np.array([28.5]), np.array([100.0]), shape, 2.0)).max() < 1e-3
+
+
+def test_cube_frames_have_independent_noise_and_jitter():
+
+    inst = make_inst()
+    chip_x, chip_y, gmag = np.array([2.0]), np.array([1.5]), np.array([3.0])
+    context = RenderContext(noise=NoiseEngine(seed=6))
+
+    cube, offsets = make_synthetic_cube(chip_x, chip_y, gmag, inst, 3, exp_time=1, binning=(2, 2), context=context)
+
+    assert cube.shape == (3, 150, 200)
+    assert not np.any(offsets)
+    assert not np.array_equal(cube[0], cube[1])
+    assert cube[0].sum() == pytest.approx(cube[2].sum(), rel=1e-3)
+
+    jitter = [(0.0, 0.0), (2 * 10 / 8.92, 0.0)]  # 2 detector pixels, 1 binned pixel in x
+    cube, offsets = make_synthetic_cube(chip_x, chip_y, gmag, inst, 2, exp_time=1, sky_flux=0, binning=(2, 2),
+                                        jitter_arcsec=jitter, context=context)
+
+    profiles = [(frame - np.median(frame))[55:95, 80:120].sum(axis=0) for frame in cube]
+    centroid = [profile @ np.arange(80, 120) / profile.sum() for profile in profiles]
+    assert centroid[1] - centroid[0] == pytest.approx(1.0, abs=0.05)
+
+
+def test_jitter_convolution_averages_shifted_kernels():
+
+    shape = (70, 90)
+    x_position, y_position, flux = np.array([40.0, 20.0]), np.array([30.0, 50.0]), np.array([100.0, 50.0])
+    star_image = deposit_stars(x_position, y_position, flux, shape)
+
+    static = convolve_jitter(star_image, [(2.0, 1.5)], [(0.0, 0.0)], defocus=1.0)
+    assert np.abs(static - convolve_fft(star_image, (2.0, 1.5), defocus=1.0)).max() < 1e-9
+
+    steps = convolve_jitter(star_image, [(2.0, 2.0), (3.0, 3.0)], [(1.5, 0.0), (-1.0, 2.5)])
+    expected = (render_stamps(x_position + 1.5, y_position, flux, shape, 2.0) +
+                render_stamps(x_position - 1.0, y_position + 2.5, flux, shape, 3.0)) / 2
+    assert steps.sum() == pytest.approx(flux.sum(), rel=1e-3)
+    assert np.abs(steps - expected).max() < 2e-2 * expected.max()
+
+
+def test_substeps_blur_the_exposure():
+
+    inst = make_inst(readout_noise=0.0, bias=0.0, dark_current=0.0)
+    chip_x, chip_y, gmag = np.array([2.0]), np.array([1.5]), np.array([3.0])
+    context = RenderContext(noise=NoiseEngine(seed=1, gaussian_lambda=1.0))
+
+    def second_moment(frame):
+        y, x = np.indices(frame.shape)
+        x_mean, y_mean = (frame * x).sum() / frame.sum(), (frame * y).sum() / frame.sum()
+        return (frame * ((x - x_mean) ** 2 + (y - y_mean) ** 2)).sum() / frame.sum()
+
+    static = second_moment(make_synthetic_image(chip_x, chip_y, gmag, inst, sky_flux=0, context=context).copy())
+    moving = second_moment(make_synthetic_image(chip_x, chip_y, gmag, inst, sky_flux=0, substeps=20, tip_tilt_arcsec=0.5,
+                                                rng=np.random.default_rng(3), context=context).copy())
+    again = second_moment(make_synthetic_image(chip_x, chip_y, gmag, inst, sky_flux=0, substeps=20, tip_tilt_arcsec=0.5,
+                                               rng=np.random.default_rng(3), context=context).copy())
+
+    assert moving > 1.2 * static
+    assert again == pytest.approx(moving, rel=1e-2)
+
+
+def test_window_covers_the_jitter_of_substeps():
+
+    inst = make_inst()
+    # one bright star 12 pixels left of the window, moved into it by the tip/tilt random walk
+    chip_x, chip_y, gmag = np.array([0.88]), np.array([1.5]), np.array([3.0])
+    window = (100, 140, 30, 20)
+
+    def render(window):
+        image, crop, _ = render_expected_image(chip_x, chip_y, gmag, inst, 1.0, 3.5, 0.0, 0.0, "ndimage", (1, 1), window,
+                                               RenderContext(), substeps=20, tip_tilt_arcsec=5.0, seeing_jitter=0.2,
+                                               rng=np.random.default_rng(2))
+        return image[crop] if crop is not None else image
+
+    full = render(None)
+    windowed = render(window)
+
+    assert full[140:160, 100:130].sum() > 0.01 * full.sum()
+    full = full[140:160, 100:130]
+    # the fourier shifts of the sub steps depend a little on the size of the render grid
+    assert np.allclose(windowed, full, rtol=1e-2, atol=1e-3 * full.max())
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: test_02_noise.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import time
+
+import numpy as np
+import pytest
+
+from skymakercam.noise import NoiseEngine, NoisePool
+
+
+def noisy(engine, shape=(300, 200), lam=50.0):
+
+    return engine.apply(np.full(shape, lam, dtype=np.float32), 10.0, 5.0, 100.0)
+
+
+def test_noise_is_reproducible_for_a_seed():
+
+    first, second = NoiseEngine(seed=7), NoiseEngine(seed=7)
+
+    assert np.array_equal(noisy(first), noisy(second))
+    assert np.array_equal(noisy(first), noisy(second))
+    assert not np.array_equal(noisy(first), noisy(NoiseEngine(seed=8)))
+
+
+def test_noise_does_not_depend_on_thread_count():
+
+    single, threaded = NoiseEngine(seed=3, threads=1), NoiseEngine(seed=3, threads=4)
+    try:
+        assert np.array_equal(noisy(single), noisy(threaded))
+    finally:
+        threaded.close()
+
+
+@pytest.mark.parametrize("gaussian_lambda", [None, 1.0])
+def test_fused_poisson_statistics(gaussian_lambda):
+
+    frame = noisy(NoiseEngine(seed=1, gaussian_lambda=gaussian_lambda), lam=200.0)
+
+    assert frame.mean() == pytest.approx(200.0 + 10.0 + 100.0, rel=2e-3)
+    assert frame.var() == pytest.approx(200.0 + 10.0 + 25.0, rel=3e-2)
+
+
+def test_noise_pool_refills_in_background():
+
+    pool = NoisePool(NoiseEngine(seed=5), depth=2)
+    try:
+        first = pool.get((40, 30), 100.0, 5.0, 10.0)
+        pool.release(first)
+        deadline = time.monotonic() + 5
+        while pool.ready_frames < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        second = pool.get((40, 30), 100.0, 5.0, 10.0)
+    finally:
+        pool.close()
+
+    assert (pool.misses, pool.hits) == (1, 1)
+    assert second.mean() == pytest.approx(110.0, rel=2e-2)
+
+
+def test_noise_pool_frames_do_not_depend_on_timing():
+
+    frames = []
+    for pause in (0.0, 0.02):
+        pool = NoisePool(NoiseEngine(seed=5), depth=2)
+        try:
+            drawn = []
+            for _ in range(6):
+                frame = pool.get((200, 100), 100.0, 5.0, 10.0)
+                drawn.append(frame.copy())
+                pool.release(frame)
+                time.sleep(pause)
+        finally:
+            pool.close()
+        frames.append(drawn)
+
+    for fast, slow in zip(*frames):
+        assert np.array_equal(fast, slow)
+
+
+def test_star_only_noise_leaves_empty_pixels_alone():
+
+    frame = np.zeros((10, 10), dtype=np.float32)
+    frame[4, 4] = 1e4
+
+    NoiseEngine(seed=2).apply(frame)
+
+    assert np.count_nonzero(frame) == 1
+    assert frame[4, 4] == pytest.approx(1e4, rel=5e-2)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: test_03_readout.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import numpy as np
+import pytest
+
+from skymakercam.readout import binned_shape, readout_frame
+
+
+def test_readout_saturates_instead_of_wrapping():
+
+    frame = np.array([[-20.0, 0.4, 1000.6, 70000.0]], dtype=np.float32)
+
+    data = readout_frame(frame)
+
+    assert data.dtype == np.uint16
+    assert data.tolist() == [[0, 0, 1001, 65535]]
+
+
+@pytest.mark.parametrize("shape, binning", [((12, 8), (2, 4)), ((13, 10), (3, 4)), ((200, 7), (1, 1))])
+def test_readout_bins_non_divisible_frames(shape, binning):
+
+    rng = np.random.default_rng(3)
+    frame = rng.uniform(0, 1000, shape).astype(np.float32)
+    hbin, vbin = binning
+    ny, nx = binned_shape(shape, binning)
+
+    data = readout_frame(frame, binning, gain=2.5, block_rows=5)
+
+    expected = frame[:ny * vbin, :nx * hbin].astype(float).reshape(ny, vbin, nx, hbin).sum(axis=(1, 3)) / 2.5
+    assert data.shape == (ny, nx)
+    assert np.array_equal(data, np.clip(np.rint(expected), 0, 65535).astype(np.uint16))
+
+
+def test_readout_writes_into_given_buffer():
+
+    out = np.empty((3, 2), np.uint16)
+
+    assert readout_frame(np.ones((6, 4)), (2, 2), out=out) is out
+    assert (out == 4).all()
+    with pytest.raises(ValueError):
+        readout_frame(np.ones((6, 4)), (1, 1), out=out)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: test_04_video.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import asyncio
+
+import pytest
+
+from skymakercam.video import VideoStream
+
+
+def counter(delay=0.0):
+    count = 0
+
+    async def produce():
+        nonlocal count
+        await asyncio.sleep(delay)
+        count += 1
+        return count
+
+    return produce
+
+
+async def consume(stream, n_frames, delay=0.0):
+    frames = []
+    async with stream:
+        async for frame in stream:
+            frames.append(frame)
+            await asyncio.sleep(delay)
+            if len(frames) == n_frames:
+                break
+    return frames
+
+
+def test_block_policy_delivers_every_frame():
+
+    stream = VideoStream(counter(), maxsize=1, policy="block")
+
+    frames = asyncio.run(consume(stream, 5, delay=0.01))
+
+    assert frames == [1, 2, 3, 4, 5]
+    assert stream.dropped == 0
+
+
+def test_drop_oldest_policy_skips_frames_of_slow_consumers():
+
+    stream = VideoStream(counter(0.001), maxsize=2, policy="drop-oldest")
+
+    frames = asyncio.run(consume(stream, 5, delay=0.02))
+
+    assert frames == sorted(frames)
+    assert frames[-1] > 5
+    assert stream.dropped > 0
+    assert stream.produced >= stream.delivered + stream.dropped
+
+
+def test_stream_keeps_the_cadence():
+
+    stream = VideoStream(counter(), fps=50, maxsize=2, policy="block")
+
+    asyncio.run(consume(stream, 10))
+
+    assert stream.achieved_fps == pytest.approx(50, rel=0.3)
+
+
+def test_producer_errors_reach_the_consumer():
+
+    async def produce():
+        raise RuntimeError("readout failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(consume(VideoStream(produce), 1))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: test_05_backends.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import math
+
+import numpy as np
+import pytest
+
+from skymakercam.noise import NoiseEngine
+from skymakercam.render import RENDER_BACKENDS, RenderContext, choose_backend, psf_sigma, register_backend, render_noiseless
+
+
+SHAPE = (240, 320)
+SEEING = (2.2, 1.8)
+DEFOCUS = (1.5, 2.0)
+BOX = 16
+
+
+def star_grid():
+    # isolated stars on a grid, random sub pixel positions and fluxes
+    rng = np.random.default_rng(17)
+    y_grid, x_grid = np.meshgrid(np.arange(40, SHAPE[0] - 39, 40), np.arange(40, SHAPE[1] - 39, 40), indexing="ij")
+    x_position = x_grid.ravel() + rng.uniform(-0.5, 0.5, x_grid.size)
+    y_position = y_grid.ravel() + rng.uniform(-0.5, 0.5, y_grid.size)
+    return x_position, y_position, rng.uniform(1e3, 1e5, x_grid.size)
+
+
+def boxes(image, x_position, y_position):
+    # box around each star and its origin
+    for x, y in zip(x_position, y_position):
+        y0, x0 = int(round(y)) - BOX, int(round(x)) - BOX
+        yield image[y0:y0 + 2 * BOX + 1, x0:x0 + 2 * BOX + 1].astype(float), x0, y0
+
+
+def measure(image, x_position, y_position):
+    # flux, centroid and fwhm (y, x) from the moments in a box around each star
+    results = []
+    for stamp, x0, y0 in boxes(image, x_position, y_position):
+        yy, xx = np.indices(stamp.shape)
+        flux = stamp.sum()
+        x_mean, y_mean = (stamp * xx).sum() / flux, (stamp * yy).sum() / flux
+        fwhm_x = math.sqrt((stamp * (xx - x_mean) ** 2).sum() / flux) * 2.3548
+        fwhm_y = math.sqrt((stamp * (yy - y_mean) ** 2).sum() / flux) * 2.3548
+        results.append((flux, x0 + x_mean, y0 + y_mean, fwhm_y, fwhm_x))
+    return np.array(results)
+
+
+@pytest.fixture(scope="module")
+def rendered():
+    x_position, y_position, flux = star_grid()
+    measured = {}
+    for backend in RENDER_BACKENDS:
+        context = RenderContext(dtype=np.float64, threads=2, tiles=3)
+        try:
+            image = render_noiseless(backend, x_position, y_position, flux, SHAPE, SEEING, DEFOCUS, context)
+            measured[backend] = measure(image, x_position, y_position)
+        finally:
+            context.close()
+    return (x_position, y_position, flux), measured
+
+
+@pytest.mark.parametrize("backend", list(RENDER_BACKENDS))
+def test_backend_conserves_flux(rendered, backend):
+
+    (x_position, y_position, flux), measured = rendered
+
+    assert np.allclose(measured[backend][:, 0], flux, rtol=1e-3)
+
+
+@pytest.mark.parametrize("backend", list(RENDER_BACKENDS))
+def test_backend_centroids(rendered, backend):
+
+    (x_position, y_position, flux), measured = rendered
+
+    assert np.abs(measured[backend][:, 1] - x_position).max() < 0.01
+    assert np.abs(measured[backend][:, 2] - y_position).max() < 0.01
+
+
+@pytest.mark.parametrize("backend", list(RENDER_BACKENDS))
+def test_backend_fwhm(rendered, backend):
+
+    _, measured = rendered
+    fwhm = 2.3548 * np.array(psf_sigma(SEEING, DEFOCUS))
+
+    # bilinear deposition and pixel integration broaden by less than a few percent
+    assert np.allclose(measured[backend][:, 3:], fwhm, rtol=3e-2)
+
+
+@pytest.mark.parametrize("backend", list(RENDER_BACKENDS))
+def test_backends_agree_with_each_other(rendered, backend):
+
+    _, measured = rendered
+    reference = measured["ndimage"]
+
+    assert np.allclose(measured[backend][:, 0], reference[:, 0], rtol=1e-3)
+    assert np.abs(measured[backend][:, 1:3] - reference[:, 1:3]).max() < 0.01
+    assert np.allclose(measured[backend][:, 3:], reference[:, 3:], rtol=3e-2)
+
+
+def test_noisy_frames_are_statistically_equivalent():
+
+    x_position, y_position, flux = star_grid()
+    sums = {}
+    for backend in RENDER_BACKENDS:
+        context = RenderContext(noise=NoiseEngine(seed=3), threads=2)
+        try:
+            image = render_noiseless(backend, x_position, y_position, flux, SHAPE, SEEING, DEFOCUS, context)
+            frame = context.noise.apply(image, 20.0, 5.0, 100.0) - 120.0
+            sums[backend] = np.array([stamp.sum() for stamp, _, _ in boxes(frame, x_position, y_position)])
+        finally:
+            context.close()
+
+    # photometry of every star agrees within 5 sigma of its photon, background and read noise
+    sigma = np.sqrt(flux + (2 * BOX + 1) ** 2 * (20.0 + 25.0))
+    for backend, measured in sums.items():
+        assert np.all(np.abs(measured - flux) < 5 * sigma), backend
+
+
+def test_registered_backend_is_selected_by_its_cost():
+
+    calls = []
+
+    @register_backend("test-free", cost=lambda *args: 0.0)
+    def render(x_position, y_position, flux, shape, seeing_pixel, defocus, context, out):
+        calls.append(shape)
+        out.fill(1.0)
+
+    try:
+        assert choose_backend(10, SHAPE, SEEING, DEFOCUS) == "test-free"
+        image = render_noiseless("test-free", [], [], [], (4, 5), SEEING, DEFOCUS, RenderContext())
+        assert calls == [(4, 5)] and (image == 1.0).all()
+    finally:
+        del RENDER_BACKENDS["test-free"]
+
+    assert choose_backend(10, SHAPE, SEEING, DEFOCUS) != "test-free"
+    with pytest.raises(ValueError):
+        render_noiseless("test-free", [], [], [], (4, 5), SEEING, DEFOCUS, RenderContext())
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: test_06_catalog.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import asyncio
+from types import SimpleNamespace
+
+import healpy as hp
+import numpy as np
+import pytest
+from astropy.coordinates import SkyCoord
+from astropy.table import Table
+import astropy.units as u
+
+from skymakercam.catalog import (calc_mag_limit, calc_sn, chip_footprint, chip_polygon, get_cat_using_footprint,
+                                 get_cat_using_healpix2, get_cat_using_healpix2_async, healpix_disc)
+from skymakercam.coords import ad2xy, in_box
+from skymakercam.params import load as params_load
+from skymakercam.starimage import find_guide_stars
+from skymakercam.tilestore import (CatalogColumns, ColumnTileStore, PackedTileStore, PyramidStore, TileStore,
+                                   catalog_store, convert_fits_tiles, convert_npy_tiles, tile_pixels, write_packed_store,
+                                   write_pyramid)
+
+
+TILE_DTYPE = [('source_id', '<i8'), ('ra', '<f8'), ('dec', '<f8'), ('phot_g_mean_mag', '<f4')]
+
+
+def write_tiles(directory, pixels, rows=100, nside=64):
+    # tiles of stars spread over each nested healpix pixel
+    rng = np.random.default_rng(12)
+    directory.mkdir(parents=True, exist_ok=True)
+    for ipix in pixels:
+        theta, phi = hp.pix2ang(nside, ipix, nest=True)
+        tile = np.zeros(rows, TILE_DTYPE)
+        tile['source_id'] = ipix * 1000 + np.arange(rows)
+        tile['ra'] = np.rad2deg(phi) + rng.uniform(-0.1, 0.1, rows)
+        tile['dec'] = 90 - np.rad2deg(theta) + rng.uniform(-0.1, 0.1, rows)
+        tile['phot_g_mean_mag'] = rng.uniform(5, 17, rows)
+        np.save(directory / f"lvl6_{ipix:06d}.npy", tile)
+
+
+def test_tile_store_keeps_tiles_within_budget(tmp_path):
+
+    write_tiles(tmp_path, range(4), rows=100)
+    tile_bytes = 100 * np.dtype(TILE_DTYPE).itemsize
+    store = TileStore(str(tmp_path), max_bytes=2 * tile_bytes)
+
+    assert isinstance(store.tile(0), np.memmap)
+    store.tile(1)
+    store.tile(0)
+    store.tile(2)
+
+    assert (store.hits, store.misses) == (1, 3)
+    assert len(store) == 2 and store.nbytes == 2 * tile_bytes
+    store.tile(0)
+    assert store.hits == 2
+    store.tile(1)
+    assert store.misses == 4
+
+
+def test_tile_store_query_concatenates_in_order(tmp_path):
+
+    write_tiles(tmp_path, [5, 3, 9], rows=10)
+    store = TileStore(str(tmp_path))
+
+    rows = store.query([9, 3, 5])
+
+    assert not isinstance(rows, np.memmap)
+    assert rows.dtype == np.dtype(TILE_DTYPE)
+    assert list(rows['source_id'] // 1000) == [9] * 10 + [3] * 10 + [5] * 10
+
+
+def test_healpix_catalog_reuses_tiles_across_calls(tmp_path):
+
+    c = SkyCoord(ra=120.0 * u.deg, dec=-30.0 * u.deg)
+    inst = SimpleNamespace(catalog_path=str(tmp_path), outer_search_radius=1.0)
+    vec = hp.ang2vec(np.deg2rad(-c.dec.value + 90), np.deg2rad(c.ra.value))
+    pixels = hp.query_disc(nside=64, vec=vec, radius=np.deg2rad(1.0), inclusive=True, nest=True)
+    write_tiles(tmp_path / "Gaia_Healpix_6", pixels, rows=20)
+    store = TileStore(str(tmp_path / "Gaia_Healpix_6"))
+
+    first = get_cat_using_healpix2(c, inst, store=store)
+    second = get_cat_using_healpix2(c, inst, store=store)
+
+    assert len(first) == 20 * len(pixels)
+    assert np.array_equal(first, second)
+    assert (store.hits, store.misses) == (len(pixels), len(pixels))
+
+
+def test_parallel_reader_keeps_pixel_order(tmp_path):
+
+    pixels = [17, 2, 40, 8, 33, 1, 25]
+    write_tiles(tmp_path, pixels, rows=5)
+    store = TileStore(str(tmp_path), threads=4)
+
+    try:
+        rows = store.query(pixels)
+        rows_async = asyncio.run(store.query_async(pixels))
+    finally:
+        store.close()
+
+    assert list(rows['source_id'][::5] // 1000) == pixels
+    assert np.array_equal(rows, rows_async)
+
+
+def test_async_healpix_catalog_matches_sync(tmp_path):
+
+    c = SkyCoord(ra=10.0 * u.deg, dec=45.0 * u.deg)
+    inst = SimpleNamespace(catalog_path=str(tmp_path), outer_search_radius=0.5)
+    write_tiles(tmp_path / "Gaia_Healpix_6", healpix_disc(c, inst), rows=7)
+    store = TileStore(str(tmp_path / "Gaia_Healpix_6"), threads=3)
+
+    try:
+        assert np.array_equal(asyncio.run(get_cat_using_healpix2_async(c, inst, store=store)),
+                              get_cat_using_healpix2(c, inst, store=store))
+    finally:
+        store.close()
+
+
+def test_converted_column_tiles_are_sorted_by_magnitude(tmp_path):
+
+    write_tiles(tmp_path / "Gaia_Healpix_6", [3, 4], rows=50)
+    assert convert_npy_tiles(str(tmp_path / "Gaia_Healpix_6"), str(tmp_path / "Gaia_Healpix_6_columns")) == 2
+
+    store = catalog_store(str(tmp_path))
+    tile = store.tile(3)
+    rows = np.load(tmp_path / "Gaia_Healpix_6" / "lvl6_000003.npy")
+
+    assert isinstance(store, ColumnTileStore)
+    assert tile['ra'].dtype == np.float64 and tile['phot_g_mean_mag'].dtype == np.float32
+    assert tile['ra'].flags.c_contiguous
+    assert np.all(np.diff(tile['phot_g_mean_mag']) >= 0)
+    assert sorted(tile['source_id']) == sorted(rows['source_id'])
+
+    bright = tile.brighter(10.0)
+    assert bright['ra'].base is not None
+    assert sorted(bright['source_id']) == sorted(rows['source_id'][rows['phot_g_mean_mag'] < np.float32(10.0)])
+
+
+def test_column_tiles_answer_like_structured_tiles(tmp_path):
+
+    c = SkyCoord(ra=200.0 * u.deg, dec=10.0 * u.deg)
+    inst = SimpleNamespace(catalog_path=str(tmp_path), outer_search_radius=0.5)
+    write_tiles(tmp_path / "Gaia_Healpix_6", healpix_disc(c, inst), rows=30)
+    structured = get_cat_using_healpix2(c, inst, store=TileStore(str(tmp_path / "Gaia_Healpix_6"), threads=1), mag_limit=12.0)
+    convert_npy_tiles(str(tmp_path / "Gaia_Healpix_6"), str(tmp_path / "columns"))
+
+    columns = get_cat_using_healpix2(c, inst, store=ColumnTileStore(str(tmp_path / "columns"), threads=1), mag_limit=12.0)
+
+    assert isinstance(columns, CatalogColumns)
+    assert np.all(columns['phot_g_mean_mag'] < 12.0)
+    assert sorted(columns['source_id']) == sorted(structured['source_id'])
+    mask = columns['dec'] > 10.0
+    assert np.array_equal(columns[mask]['ra'], columns['ra'][mask])
+
+
+def test_fits_tiles_convert_from_ring_to_nest(tmp_path):
+
+    ring = 1234
+    rows = Table({'ra': [1.0, 2.0, 3.0], 'dec': [4.0, 5.0, 6.0], 'phot_g_mean_mag': [15.0, 9.0, 12.0]})
+    (tmp_path / "Gaia_Healpix_64").mkdir()
+    rows.write(tmp_path / "Gaia_Healpix_64" / f"{ring:06d}.fits")
+
+    assert convert_fits_tiles(str(tmp_path / "Gaia_Healpix_64"), str(tmp_path / "columns")) == 1
+
+    tile = ColumnTileStore(str(tmp_path / "columns")).tile(hp.ring2nest(64, ring))
+    assert list(tile['ra']) == [2.0, 3.0, 1.0]
+    assert tile.names == ('ra', 'dec', 'phot_g_mean_mag')
+
+
+def test_packed_store_matches_tile_directory(tmp_path):
+
+    write_tiles(tmp_path / "Gaia_Healpix_6", [0, 7, 4000], rows=25)
+    convert_npy_tiles(str(tmp_path / "Gaia_Healpix_6"), str(tmp_path / "Gaia_Healpix_6_columns"))
+    columns = ColumnTileStore(str(tmp_path / "Gaia_Healpix_6_columns"), threads=1)
+    assert write_packed_store(str(tmp_path / "Gaia_Healpix_6.pack"), columns, [0, 7, 4000]) == 75
+
+    packed = catalog_store(str(tmp_path))
+    assert isinstance(packed, PackedTileStore)
+    assert len(packed.tile(1)) == 0
+    for ipix in (0, 7, 4000):
+        tile = packed.tile(ipix)
+        assert not tile['ra'].flags.owndata and not tile['ra'].flags.writeable
+        for name in columns.tile(ipix).names:
+            assert np.array_equal(tile[name], columns.tile(ipix)[name])
+
+    query = packed.query([4000, 1, 0], mag_limit=11.0)
+    assert np.array_equal(query['source_id'], columns.query([4000, 0], mag_limit=11.0)['source_id'])
+
+
+def test_packed_store_from_structured_tiles(tmp_path):
+
+    c = SkyCoord(ra=10.0 * u.deg, dec=-30.0 * u.deg)
+    inst = SimpleNamespace(catalog_path=str(tmp_path), outer_search_radius=0.5)
+    pixels = healpix_disc(c, inst)
+    write_tiles(tmp_path / "Gaia_Healpix_6", pixels, rows=10)
+    structured = TileStore(str(tmp_path / "Gaia_Healpix_6"), threads=1)
+    assert tile_pixels(structured.directory, structured.pattern) == sorted(pixels)
+    write_packed_store(str(tmp_path / "sky.pack"), structured, pixels)
+
+    cat = asyncio.run(get_cat_using_healpix2_async(c, inst, store=PackedTileStore(str(tmp_path / "sky.pack"))))
+
+    assert sorted(cat['source_id']) == sorted(structured.query(pixels)['source_id'])
+    with open(tmp_path / "sky.npy", "wb") as other:
+        np.save(other, np.zeros(3))
+    with pytest.raises(ValueError):
+        PackedTileStore(str(tmp_path / "sky.npy"))
+
+
+def write_sky(directory, c, radius, n_stars=20000, nside=64):
+    # stars spread uniformly around c, each written to the tile of its nested pixel
+    rng = np.random.default_rng(3)
+    rows = np.zeros(n_stars, TILE_DTYPE)
+    rows['source_id'] = np.arange(n_stars)
+    rows['dec'] = c.dec.deg + rng.uniform(-radius, radius, n_stars)
+    rows['ra'] = c.ra.deg + rng.uniform(-radius, radius, n_stars) / np.cos(np.deg2rad(rows['dec']))
+    rows['phot_g_mean_mag'] = rng.uniform(5, 17, n_stars)
+    pixels = hp.ang2pix(nside, rows['ra'], rows['dec'], nest=True, lonlat=True)
+    directory.mkdir(parents=True)
+    for ipix in np.unique(pixels):
+        np.save(directory / f"lvl6_{ipix:06d}.npy", rows[pixels == ipix])
+    return rows
+
+
+@pytest.mark.parametrize("dec", [-30.0, 75.0])
+@pytest.mark.parametrize("east_is_right", [True, False])
+def test_chip_polygon_inverts_in_box(dec, east_is_right):
+
+    inst = params_load("skymakercam.params.lvm_agc_cam")
+    c = SkyCoord(ra=120.0 * u.deg, dec=dec * u.deg)
+    for pa in (0.0, 37.0, 200.0):
+        flags = []
+        for margin_mm in (-0.01, 0.01):
+            ra, dec_ = chip_polygon(c, pa, inst, east_is_right, margin_mm)
+            x_mm, y_mm = ad2xy({'ra': ra, 'dec': dec_}, c, inst)
+            if east_is_right:
+                x_mm = -x_mm
+            flags.append(in_box(x_mm, y_mm, -pa if east_is_right else pa, inst)[0])
+        assert flags[0].all() and not flags[1].any()
+
+
+def test_footprint_query_finds_the_same_guide_stars(tmp_path):
+
+    inst = params_load("skymakercam.params.lvm_agc_cam")
+    inst.catalog_path = str(tmp_path)
+    c = SkyCoord(ra=83.0 * u.deg, dec=-5.0 * u.deg)
+    write_sky(tmp_path / "Gaia_Healpix_6", c, 2 * inst.outer_search_radius)
+    store = TileStore(str(tmp_path / "Gaia_Healpix_6"), threads=1)
+
+    for pa in (15.0, 130.0):
+        cone = get_cat_using_healpix2(c, inst, store=store)
+        footprint = get_cat_using_footprint(c, pa, inst, store=store)
+        assert len(chip_footprint(c, pa, inst)) < len(healpix_disc(c, inst))
+        assert len(footprint) < len(cone)
+
+        expected = find_guide_stars(c, pa, inst, recycled_cat=cone)
+        found = find_guide_stars(c, pa, inst, recycled_cat=footprint)
+        assert len(expected.ras) > 0
+        assert sorted(found.ras) == sorted(expected.ras)
+
+        # turned by up to the rotation margin the chip stays within the tiles read
+        turned = get_cat_using_footprint(c, pa, inst, rotation_margin=20.0, store=store)
+        for angle in (pa - 20.0, pa - 7.0, pa + 20.0):
+            assert sorted(find_guide_stars(c, angle, inst, recycled_cat=turned).ras) == \
+                sorted(find_guide_stars(c, angle, inst, recycled_cat=cone).ras)
+
+
+@pytest.mark.parametrize("dec, pa", [(90.0, 0.0), (89.9, 0.0), (-89.7, 180.0), (-89.9, 180.0)])
+def test_chip_footprint_at_the_poles(dec, pa):
+
+    inst = params_load("skymakercam.params.lvm_agc_cam")
+    c = SkyCoord(ra=120.0 * u.deg, dec=dec * u.deg)
+    pixels = chip_footprint(c, pa, inst, rotation_margin=10.0)
+
+    # the chip lies between the radii of its near edge and its far corners, at any pa
+    near = (np.sqrt(inst.r_outer**2 - inst.chip_size_mm[0]**2 / 4.) - inst.chip_size_mm[1]) * 1e3 / inst.image_scale * u.arcsec
+    far = inst.r_outer * 1e3 / inst.image_scale * u.arcsec
+    angles = np.linspace(0., 360., 720, endpoint=False) * u.deg
+    for radius in (near, far):
+        ring = c.directional_offset_by(angles, radius)
+        assert set(hp.ang2pix(64, ring.ra.deg, ring.dec.deg, nest=True, lonlat=True)) <= set(pixels)
+    assert set(pixels) <= set(healpix_disc(c, inst))
+
+
+def test_pyramid_reads_only_the_levels_needed(tmp_path):
+
+    c = SkyCoord(ra=40.0 * u.deg, dec=20.0 * u.deg)
+    rows = write_sky(tmp_path / "Gaia_Healpix_6", c, 3.0, n_stars=30000)
+    source = TileStore(str(tmp_path / "Gaia_Healpix_6"), threads=1)
+    pixels = tile_pixels(source.directory, source.pattern)
+    levels = ((8, 10.0), (32, 14.0), (64, None))
+
+    counts = write_pyramid(str(tmp_path / "Gaia_Healpix_pyramid"), source, pixels, levels=levels)
+
+    assert sum(counts) == len(rows)
+    pyramid = catalog_store(str(tmp_path))
+    assert isinstance(pyramid, PyramidStore)
+    assert [level.nside for level in pyramid.levels] == [8, 32, 64]
+    assert len(pyramid.levels_for(9.0)) == 1 and len(pyramid.levels_for(14.0)) == 2
+    assert len(pyramid.levels_for(None)) == 3
+
+    inst = SimpleNamespace(catalog_path=str(tmp_path), outer_search_radius=0.5)
+    query = healpix_disc(c, inst)
+    for mag_limit in (9.0, 12.5, 16.0):
+        full = source.query(query, mag_limit)
+        found = pyramid.query(query, mag_limit)
+        # coarse tiles reach beyond the query pixels, within them the stars are the same
+        inside = np.isin(hp.ang2pix(64, found['ra'], found['dec'], nest=True, lonlat=True), query)
+        assert np.all(found['phot_g_mean_mag'] < mag_limit)
+        assert sorted(found['source_id'][inside]) == sorted(full['source_id'])
+        assert len(np.unique(found['source_id'])) == len(found)
+
+    tiles = pyramid.tiles(query, 9.0)
+    assert len(tiles) == len(query) and sum(len(tile) for tile in tiles) == len(pyramid.query(query, 9.0))
+
+
+def test_find_guide_stars_per_exposure_depth(tmp_path):
+
+    inst = params_load("skymakercam.params.lvm_agc_cam")
+    c = SkyCoord(ra=83.0 * u.deg, dec=-5.0 * u.deg)
+    write_sky(tmp_path / "Gaia_Healpix_6", c, 2 * inst.outer_search_radius)
+    write_pyramid(str(tmp_path / "pyramid"), TileStore(str(tmp_path / "Gaia_Healpix_6"), threads=1),
+                  tile_pixels(str(tmp_path / "Gaia_Healpix_6"), "lvl6_{:06d}.npy"), levels=((16, 12.0), (64, None)))
+    pyramid = PyramidStore(str(tmp_path / "pyramid"))
+
+    deep = find_guide_stars(c, 30.0, inst, recycled_cat=get_cat_using_healpix2(c, inst, store=pyramid))
+    shallow = find_guide_stars(c, 30.0, inst, recycled_cat=get_cat_using_healpix2(c, inst, store=pyramid, mag_limit=12.0),
+                               mag_limit=12.0)
+
+    assert np.all(deep.mags < inst.mag_lim_lower) and np.all(shallow.mags < 12.0)
+    assert sorted(shallow.ras) == sorted(deep.ras[deep.mags < 12.0])
+
+
+def test_mag_limit_inverts_calc_sn():
+
+    inst = params_load("skymakercam.params.lvm_agc_cam")
+    exp_time = np.array([0.5, 5.0, 60.0])
+
+    limit = calc_mag_limit(inst, sn=3.0, sky_flux=15, exp_time=exp_time)
+
+    assert calc_sn(limit, inst, sky_flux=15, exp_time=exp_time) == pytest.approx(3.0)
+    assert np.all(np.diff(limit) > 0)
+    assert calc_sn(limit[1] + 0.1, inst, sky_flux=15, exp_time=5.0) < 3.0
+
+
+def test_shallow_guide_stars_keep_the_recycled_catalog(tmp_path):
+
+    inst = params_load("skymakercam.params.lvm_agc_cam")
+    c = SkyCoord(ra=83.0 * u.deg, dec=-5.0 * u.deg)
+    write_sky(tmp_path / "Gaia_Healpix_6", c, 2 * inst.outer_search_radius)
+    convert_npy_tiles(str(tmp_path / "Gaia_Healpix_6"), str(tmp_path / "columns"))
+    cat = get_cat_using_healpix2(c, inst, store=ColumnTileStore(str(tmp_path / "columns"), threads=1))
+    assert isinstance(cat, CatalogColumns)
+
+    deep = find_guide_stars(c, 30.0, inst, recycled_cat=cat)
+    shallow = find_guide_stars(c, 30.0, inst, cull_cat=False, mag_limit=12.0)
+    again = find_guide_stars(c, 30.0, inst, cull_cat=False)
+
+    assert 0 < len(shallow.mags) < len(deep.mags)
+    assert np.array_equal(again.ras, deep.ras) and again.mags.max() > 12.0
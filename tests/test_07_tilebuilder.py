@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: test_07_tilebuilder.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import csv
+import gzip
+import os
+import shutil
+from types import SimpleNamespace
+
+import numpy as np
+from astropy.coordinates import SkyCoord
+from astropy.table import Table
+import astropy.units as u
+
+from skymakercam.catalog import get_cat_using_healpix2
+from skymakercam.tilebuilder import _merge_marker, _part_name, build_tiles, merge_bucket, partition_source, read_chunks
+from skymakercam.tilestore import TileStore
+
+
+def synthetic_dump(directory, files=3, rows=400, seed=5):
+    # a gaia_source like dump, stars in a 3 degree box with some null magnitudes,
+    # two gzipped ECSV style files and one FITS file
+    rng = np.random.default_rng(seed)
+    directory.mkdir()
+    sources, stars = [], []
+    for number in range(files):
+        source_id = np.arange(rows) + number * rows
+        ra = rng.uniform(150, 153, rows)
+        dec = rng.uniform(20, 23, rows)
+        gmag = rng.uniform(6, 20, rows).astype(np.float32)
+        null = rng.random(rows) < 0.05
+        stars.append(Table({'source_id': source_id[~null], 'ra': ra[~null], 'dec': dec[~null],
+                            'phot_g_mean_mag': gmag[~null]}))
+        if number < files - 1:
+            path = directory / f"GaiaSource_{number:06d}.csv.gz"
+            with gzip.open(path, "wt", newline="") as stream:
+                stream.write("# %ECSV 1.0\n# ---\n")
+                writer = csv.writer(stream)
+                writer.writerow(['solution_id', 'source_id', 'ra', 'dec', 'parallax', 'phot_g_mean_mag'])
+                for row in zip(source_id, ra.tolist(), dec.tolist(), gmag.tolist(), null):
+                    writer.writerow([1, row[0], repr(row[1]), repr(row[2]), "null", "null" if row[4] else repr(row[3])])
+        else:
+            path = directory / f"GaiaSource_{number:06d}.fits"
+            gmag[null] = np.nan
+            Table({'source_id': source_id, 'ra': ra, 'dec': dec, 'phot_g_mean_mag': gmag}).write(path)
+        sources.append(str(path))
+    return sources, np.concatenate([np.asarray(table) for table in stars])
+
+
+def test_read_chunks_drops_nulls(tmp_path):
+
+    sources, stars = synthetic_dump(tmp_path / "dump", files=2, rows=250)
+
+    for source in sources:
+        chunks = list(read_chunks(source, chunk_rows=100))
+        assert all(len(chunk) <= 100 for chunk in chunks) and len(chunks) == 3
+        rows = np.concatenate(chunks)
+        assert np.all(np.isfinite(rows['phot_g_mean_mag']))
+        assert set(rows['source_id']) <= set(stars['source_id'])
+
+
+def test_build_tiles_feeds_healpix_loader(tmp_path):
+
+    sources, stars = synthetic_dump(tmp_path / "dump")
+    reports = []
+
+    stats = build_tiles(sources, str(tmp_path / "Gaia_Healpix_6"), chunk_rows=150, processes=2,
+                        progress=reports.append)
+
+    assert stats['rows'] == len(stars) and stats['files'] == 3
+    assert reports[-1]['tiles'] == stats['tiles'] == len(list((tmp_path / "Gaia_Healpix_6").iterdir()))
+    assert stats['rows_per_s'] > 0
+    assert not os.path.exists(tmp_path / "Gaia_Healpix_6" / ".parts")
+
+    inst = SimpleNamespace(catalog_path=str(tmp_path), outer_search_radius=0.7)
+    c = SkyCoord(ra=151.5 * u.deg, dec=21.5 * u.deg)
+    cat = get_cat_using_healpix2(c, inst, store=TileStore(str(tmp_path / "Gaia_Healpix_6"), threads=1))
+    inside = SkyCoord(ra=cat['ra'] * u.deg, dec=cat['dec'] * u.deg).separation(c) < 0.7 * u.deg
+    expected = SkyCoord(ra=stars['ra'] * u.deg, dec=stars['dec'] * u.deg).separation(c) < 0.7 * u.deg
+    assert sorted(cat['source_id'][inside]) == sorted(stars['source_id'][expected])
+
+    tile = np.load(next(iter(sorted((tmp_path / "Gaia_Healpix_6").iterdir()))))
+    assert np.all(np.diff(tile['phot_g_mean_mag']) >= 0)
+
+
+def assert_same_tiles(target, reference):
+    assert sorted(path.name for path in target.iterdir()) == sorted(path.name for path in reference.iterdir())
+    for path in reference.iterdir():
+        assert np.array_equal(np.load(path), np.load(target / path.name))
+
+
+def test_build_tiles_resumes(tmp_path):
+
+    # buckets of nside 16 split the 3 degree box of the dump
+    sources, stars = synthetic_dump(tmp_path / "dump")
+    reference = tmp_path / "reference"
+    build_tiles(sources, str(reference), chunk_rows=150, bucket_nside=16, processes=0)
+
+    # interrupted while partitioning: two files done, the third one half way
+    target, work = tmp_path / "Gaia_Healpix_6", tmp_path / "work"
+    for source in sources[:2]:
+        partition_source(source, str(work / _part_name(source)), bucket_nside=16, chunk_rows=150)
+    (work / (_part_name(sources[2]) + ".tmp")).mkdir()
+
+    stats = build_tiles(sources, str(target), work=str(work), chunk_rows=150, bucket_nside=16, processes=0)
+
+    assert stats['skipped_files'] == 2 and stats['files'] == 1 and stats['skipped_buckets'] == 0
+    assert_same_tiles(target, reference)
+    assert not work.exists()
+
+    # interrupted while merging: all files done, one bucket merged
+    shutil.rmtree(target)
+    target.mkdir()
+    for source in sources:
+        partition_source(source, str(work / _part_name(source)), bucket_nside=16, chunk_rows=150)
+    bucket = sorted(os.listdir(work / _part_name(sources[0])))[0].split(".")[0]
+    parts = [str(work / _part_name(source) / f"{bucket}.rows") for source in sources
+             if (work / _part_name(source) / f"{bucket}.rows").exists()]
+    merge_bucket(int(bucket), parts, str(target), bucket_nside=16)
+    (work / ".merged").mkdir()
+    (work / ".merged" / bucket).write_text(_merge_marker(parts))
+
+    stats = build_tiles(sources, str(target), work=str(work), chunk_rows=150, bucket_nside=16, processes=0)
+
+    assert stats['skipped_files'] == 3 and stats['skipped_buckets'] == 1 and stats['buckets'] >= 1
+    assert_same_tiles(target, reference)
+
+
+def test_resumed_build_merges_added_sources(tmp_path):
+
+    sources, stars = synthetic_dump(tmp_path / "dump")
+    reference = tmp_path / "reference"
+    build_tiles(sources, str(reference), chunk_rows=150, bucket_nside=16, processes=0)
+
+    # interrupted while merging a build of the first two files, every bucket merged
+    target, work = tmp_path / "Gaia_Healpix_6", tmp_path / "work"
+    target.mkdir()
+    (work / ".merged").mkdir(parents=True)
+    for source in sources[:2]:
+        partition_source(source, str(work / _part_name(source)), bucket_nside=16, chunk_rows=150)
+    for bucket in {part.split(".")[0] for source in sources[:2] for part in os.listdir(work / _part_name(source))}:
+        parts = [str(work / _part_name(source) / f"{bucket}.rows") for source in sources[:2]
+                 if (work / _part_name(source) / f"{bucket}.rows").exists()]
+        merge_bucket(int(bucket), parts, str(target), bucket_nside=16)
+        (work / ".merged" / bucket).write_text(_merge_marker(parts))
+
+    # resumed with the third file added, the buckets it falls into are merged again
+    stats = build_tiles(sources, str(target), work=str(work), chunk_rows=150, bucket_nside=16, processes=0)
+
+    assert stats['skipped_files'] == 2 and stats['files'] == 1 and stats['buckets'] >= 1
+    assert_same_tiles(target, reference)
+
+
+def test_resumed_build_removes_the_tiles_of_removed_sources(tmp_path):
+
+    sources, stars = synthetic_dump(tmp_path / "dump")
+    reference = tmp_path / "reference"
+    build_tiles(sources, str(reference), chunk_rows=150, bucket_nside=16, processes=0)
+
+    # a source with stars next to the box, in buckets shared with it, and far away
+    rng = np.random.default_rng(8)
+    ra = np.r_[rng.uniform(149.0, 149.8, 50), rng.uniform(200.0, 201.0, 50)]
+    dec = np.r_[rng.uniform(21.0, 22.0, 50), rng.uniform(-41.0, -40.0, 50)]
+    removed = tmp_path / "dump" / "GaiaSource_removed.fits"
+    Table({'source_id': np.arange(100) + 10000, 'ra': ra, 'dec': dec,
+           'phot_g_mean_mag': rng.uniform(6, 20, 100).astype(np.float32)}).write(removed)
+
+    # interrupted while merging a build with the removed source, every bucket merged
+    target, work = tmp_path / "Gaia_Healpix_6", tmp_path / "work"
+    target.mkdir()
+    (work / ".merged").mkdir(parents=True)
+    everything = sources + [str(removed)]
+    for source in everything:
+        partition_source(source, str(work / _part_name(source)), bucket_nside=16, chunk_rows=150)
+    for bucket in {part.split(".")[0] for source in everything for part in os.listdir(work / _part_name(source))}:
+        parts = [str(work / _part_name(source) / f"{bucket}.rows") for source in everything
+                 if (work / _part_name(source) / f"{bucket}.rows").exists()]
+        merge_bucket(int(bucket), parts, str(target), bucket_nside=16)
+        (work / ".merged" / bucket).write_text(_merge_marker(parts))
+    assert len(os.listdir(target)) > len(os.listdir(reference))
+
+    # resumed without it, its tiles are gone
+    stats = build_tiles(sources, str(target), work=str(work), chunk_rows=150, bucket_nside=16, processes=0)
+
+    assert stats['removed_tiles'] > 0
+    assert_same_tiles(target, reference)
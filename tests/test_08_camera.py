@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: test_08_camera.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from astropy.coordinates import SkyCoord
+import astropy.units as u
+from basecam import CameraError
+from lvmtipo.site import Site
+from lvmtipo.siderostat import Siderostat
+
+from skymakercam.camera import SkymakerCamera, SkymakerCameraSystem
+from skymakercam.params import load as params_load
+
+from .test_06_catalog import write_sky
+
+
+POINTING = SkyCoord(ra=83.0 * u.deg, dec=-5.0 * u.deg)
+# a siderostat with a field angle fixed in time, the chip sees the same sky in every run
+FIXED_SID = SimpleNamespace(fieldAngle=lambda site, target, time: 0.4)
+
+
+class ScraperStore(dict):
+    # telescope state scraped by the actor, read by the camera like the one of lvmagp
+    def set(self, key, value):
+        self[key] = value
+
+    def copy(self):
+        return ScraperStore(self)
+
+    @property
+    def data(self):
+        return dict(self)
+
+
+async def make_camera(catalog_path, sid=None, **params):
+    # a camera of a mocked actor pointing at POINTING with an in focus kmirror at 0,
+    # reading the healpix tiles written to catalog_path by write_sky
+    if not (catalog_path / "Gaia_Healpix_6").exists():
+        inst = params_load("skymakercam.params.lvm_agc_cam")
+        write_sky(catalog_path / "Gaia_Healpix_6", POINTING, 2 * inst.outer_search_radius)
+    actor = SimpleNamespace(scraper_store=ScraperStore(ra_h=POINTING.ra.hour, dec_d=POINTING.dec.deg, km_d=0.0, foc_dt=42.0),
+                            site=Site(name="LCO"), sid=sid or Siderostat())
+    camera_params = dict(actor=actor, instpar="lvm_agc_cam", catalog="healpix", catalog_path=str(catalog_path),
+                         pixsize=9.0, flen=1800.0, binning=[4, 4], seed=7)
+    camera_params.update(params)
+    system = SkymakerCameraSystem(SkymakerCamera, camera_config={"cameras": {}})
+    return await system.add_camera(name="agc", uid="agc", **camera_params)
+
+
+def worker_threads():
+    return {thread for thread in threading.enumerate()
+            if thread.name.startswith(("render", "noise", "tiles"))}
+
+
+def test_disconnect_stops_the_camera_threads(tmp_path):
+
+    async def run():
+        before = worker_threads()
+        camera = await make_camera(tmp_path, render_backend="tiled", render_threads=2, noise_pool_depth=2)
+        await camera.expose(1.0)
+        started = worker_threads() - before
+        await camera.disconnect()
+        return started, worker_threads() - before
+
+    started, left = asyncio.run(run())
+
+    assert {thread.name.split("_")[0] for thread in started} >= {"render", "noise", "noise-pool", "tiles"}
+    assert not left
+
+
+def test_consecutive_exposures_hit_the_frame_cache(tmp_path):
+
+    async def run():
+        camera = await make_camera(tmp_path, scene_tolerance=2.0)
+        frames = [(await camera.expose(exptime)).data for exptime in (1.0, 1.0, 2.0)]
+        cache = camera.render_context.frame_cache
+        await camera.disconnect()
+        return frames, cache
+
+    frames, cache = asyncio.run(run())
+
+    assert (cache.misses, cache.hits) == (1, 2)
+    assert frames[2].mean() > frames[0].mean()
+
+
+def test_small_guider_correction_moves_the_stars(tmp_path):
+
+    inst = params_load("skymakercam.params.lvm_agc_cam")
+    pixel_mm = inst.chip_size_mm[0] / inst.chip_size_pix[0]
+    offset_deg = 0.2 * pixel_mm * 1000 / inst.image_scale / 3600
+
+    async def run():
+        camera = await make_camera(tmp_path)
+        await camera.expose(1.0)
+        before = camera.guide_stars
+        # a fifth of a pixel north, well within scene_tolerance
+        await camera.expose(1.0, ra_h=POINTING.ra.hour, dec_d=POINTING.dec.deg + offset_deg)
+        after = camera.guide_stars
+        cache = camera.render_context.frame_cache
+        await camera.disconnect()
+        return before, after, cache
+
+    before, after, cache = asyncio.run(run())
+
+    moved = np.hypot(after.chip_xxs - before.chip_xxs, after.chip_yys - before.chip_yys) / pixel_mm
+    assert moved == pytest.approx(0.2, abs=0.02)
+    assert cache.hits == 0
+
+
+def test_kept_exposures_own_their_data(tmp_path):
+
+    async def run():
+        camera = await make_camera(tmp_path)
+        exposures = [await camera.expose(exptime) for exptime in (0.5, 1.0, 2.0)]
+        frames = [exposure.data.copy() for exposure in exposures]
+        # the exposures of a stack are all kept until they are combined
+        stacked = []
+        await camera.expose(1.0, stack=3, stack_function=lambda cube, axis: stacked.append(cube) or cube.sum(axis))
+        await camera.disconnect()
+        return exposures, frames, stacked[0]
+
+    exposures, frames, stack = asyncio.run(run())
+
+    for exposure, frame in zip(exposures, frames):
+        assert np.array_equal(exposure.data, frame)
+    for first, second in ((0, 1), (0, 2), (1, 2)):
+        assert not np.shares_memory(exposures[first].data, exposures[second].data)
+        assert not np.array_equal(frames[first], frames[second])
+    assert not np.array_equal(stack[0], stack[2])
+
+
+def test_image_area_round_trip(tmp_path):
+
+    async def run():
+        camera = await make_camera(tmp_path)
+        await camera.set_binning(2, 2)
+        await camera.set_image_area((101, 300, 51, 150))
+        area = await camera.get_image_area()
+        window = (await camera.expose(1.0)).data
+        with pytest.raises(CameraError):
+            await camera.set_image_area((0, 300, 51, 150))
+        await camera.set_image_area()
+        full = await camera.get_image_area()
+        frame = (await camera.expose(1.0)).data
+        await camera.disconnect()
+        return area, window, full, frame
+
+    area, window, full, frame = asyncio.run(run())
+
+    assert area == (101, 300, 51, 150) and window.shape == (100, 200)
+    assert full == (1, 1600, 1, 1100) and frame.shape == (1100, 1600)
+    # the same sky in the window as in the full frame
+    assert window.mean() == pytest.approx(frame[50:150, 100:300].mean(), rel=0.02)
+
+
+def test_stamps_of_the_brightest_guide_stars(tmp_path):
+
+    async def run():
+        camera = await make_camera(tmp_path, sid=FIXED_SID)
+        data, metadata = await camera.expose_stamps(1.0, nstamps=3, size=24)
+        with pytest.raises(CameraError):
+            await camera.expose_stamps(1.0, centers=[(100, 100, 16), (300, 200, 24)])
+        await camera.disconnect()
+        return data, metadata
+
+    data, metadata = asyncio.run(run())
+
+    assert data.shape == (3, 24, 24) and data.dtype == np.uint16
+    assert [meta["mag"] for meta in metadata] == sorted(meta["mag"] for meta in metadata)
+    for stamp, meta in zip(data, metadata):
+        assert meta["size"] == 24 and "mag_cutoff" in meta
+        # the guide star sits in the middle of its box
+        y, x = np.unravel_index(np.argmax(stamp), stamp.shape)
+        assert abs(x - 12) <= 2 and abs(y - 12) <= 2
+
+
+def test_burst_cube_and_header(tmp_path):
+
+    async def run():
+        camera = await make_camera(tmp_path)
+        await camera.set_image_area((201, 400, 101, 250))
+        cube, metadata = await camera.expose_burst(0.5, 4, jitter_arcsec=1.0)
+        await camera.disconnect()
+        return cube, metadata
+
+    cube, metadata = asyncio.run(run())
+
+    assert cube.shape == (4, 150, 200) and cube.dtype == np.uint16
+    assert metadata["exptime"] == 0.5 and metadata["binning"] == [4, 4]
+    assert metadata["image_area"] == (201, 400, 101, 250)
+    assert np.shape(metadata["jitter_arcsec"]) == (4, 2)
+    assert "mag_cutoff" in metadata["scraper_store"]
+    assert not np.array_equal(cube[0], cube[1])
+
+
+def test_stream_cadence_and_drop_policy(tmp_path):
+
+    async def consume(stream, n, delay=0.0):
+        exposures = []
+        async with stream:
+            async for exposure in stream:
+                exposures.append(exposure)
+                await asyncio.sleep(delay)
+                if len(exposures) == n:
+                    break
+        return exposures
+
+    async def run():
+        camera = await make_camera(tmp_path)
+        await camera.set_image_area((1, 200, 1, 150))
+        # the catalog is read by the first exposure, not within the stream
+        await camera.expose(0.1)
+        paced = camera.stream(0.1, fps=5)
+        exposures = await consume(paced, 5)
+        fps = paced.achieved_fps
+        dropping = camera.stream(0.1, maxsize=1)
+        await consume(dropping, 3, delay=0.3)
+        await camera.disconnect()
+        return exposures, paced, fps, dropping
+
+    exposures, paced, fps, dropping = asyncio.run(run())
+
+    assert all(exposure.data.shape == (150, 200) for exposure in exposures)
+    assert paced.dropped == 0 and fps == pytest.approx(5, rel=0.3)
+    assert dropping.dropped > 0 and dropping.delivered == 3
+
+
+def test_slow_consumer_keeps_its_frames(tmp_path):
+
+    async def run():
+        camera = await make_camera(tmp_path)
+        await camera.set_image_area((1, 200, 1, 150))
+        held, copies = [], []
+        stream = camera.stream(0.1, maxsize=1)
+        async with stream:
+            async for exposure in stream:
+                held.append(exposure)
+                copies.append(exposure.data.copy())
+                # the producer keeps rendering and dropping frames meanwhile
+                await asyncio.sleep(0.3)
+                if len(held) == 3:
+                    break
+        await camera.disconnect()
+        return stream, held, copies
+
+    stream, held, copies = asyncio.run(run())
+
+    assert stream.dropped > 0
+    for exposure, copy in zip(held, copies):
+        assert np.array_equal(exposure.data, copy)
+
+
+def test_footprint_mode_finds_the_healpix_guide_stars(tmp_path):
+
+    async def run(catalog):
+        camera = await make_camera(tmp_path, sid=FIXED_SID, catalog=catalog)
+        frame = (await camera.expose(1.0)).data
+        stars = camera.guide_stars
+        await camera.disconnect()
+        return frame, stars
+
+    healpix_frame, healpix = asyncio.run(run("healpix"))
+    footprint_frame, footprint = asyncio.run(run("footprint"))
+
+    assert len(healpix.ras) > 10
+    assert sorted(footprint.ras) == sorted(healpix.ras)
+    assert footprint_frame.shape == healpix_frame.shape
+
+
+def test_long_exposure_after_short_keeps_the_faint_stars(tmp_path):
+
+    async def run():
+        camera = await make_camera(tmp_path, faint_stars="skip")
+        short = await camera.expose(0.01)
+        short_mags = camera.guide_stars.mags.copy()
+        long = await camera.expose(1.0)
+        long_mags = camera.guide_stars.mags.copy()
+        # back to short, the catalog stays at the depth read, the renderer cuts
+        again = await camera.expose(0.01)
+        again_mags = camera.guide_stars.mags.copy()
+        await camera.disconnect()
+        return short, short_mags, long, long_mags, again, again_mags
+
+    short, short_mags, long, long_mags, again, again_mags = asyncio.run(run())
+
+    cutoff = short.scraper_store["mag_cutoff"]
+    assert short_mags.max() <= cutoff
+    assert long.scraper_store["mag_cutoff"] > cutoff
+    assert long_mags.max() > cutoff
+    assert again.scraper_store["mag_cutoff"] == cutoff
+    assert again_mags.max() == long_mags.max()
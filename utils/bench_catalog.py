@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: bench_catalog.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+# run:
+# poetry run python utils/bench_catalog.py $HOME/data/catalog/gaia -i lvm_agc_cam
+
+import argparse
+import os
+import time
+
+import numpy as np
+from astropy.coordinates import SkyCoord
+import astropy.units as u
+
+from skymakercam.catalog import get_cat_using_healpix2, healpix_disc
+from skymakercam.params import load as params_load
+from skymakercam.tilestore import ColumnTileStore, PackedTileStore, PyramidStore, TileStore
+
+
+def drop_page_cache(path):
+    # evict the files below path from the page cache, so the next read goes to the disk.
+    # as root all caches are dropped, directory entries and inodes too, which matter most for many small files
+    try:
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", "w") as caches:
+            caches.write("3\n")
+        return
+    except OSError:
+        pass
+    paths = [path] if os.path.isfile(path) else [os.path.join(path, name) for name in os.listdir(path)]
+    for name in paths:
+        fd = os.open(name, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def stores(catalog_path):
+    # the layouts present in catalog_path, each as (name, path, store factory)
+    layouts = [("npy files", os.path.join(catalog_path, "Gaia_Healpix_6"), TileStore),
+               ("npz columns", os.path.join(catalog_path, "Gaia_Healpix_6_columns"), ColumnTileStore),
+               ("packed file", os.path.join(catalog_path, "Gaia_Healpix_6.pack"), PackedTileStore),
+               ("pyramid", os.path.join(catalog_path, "Gaia_Healpix_pyramid"), PyramidStore)]
+    return [layout for layout in layouts if os.path.exists(layout[1])]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="cold and warm cone query latency of the catalog layouts")
+    parser.add_argument('catalog_path', help="catalog directory")
+    parser.add_argument("-i", '--instpar', default="lvm_agc_cam",
+                        help="instrument parameter module in skymakercam.params")
+    parser.add_argument("-n", '--cones', type=int, default=10, help="random cones queried")
+    parser.add_argument("-m", '--mag-limit', type=float, default=None,
+                        help="faintest magnitude queried, mag_lim_lower of the instrument by default")
+    parser.add_argument("-s", '--seed', type=int, default=42,
+                        help="random seed for the cone centers")
+
+    args = parser.parse_args()
+
+    inst = params_load(f"skymakercam.params.{args.instpar}")
+    mag_limit = args.mag_limit or inst.mag_lim_lower
+    rng = np.random.default_rng(args.seed)
+    cones = [SkyCoord(ra=ra * u.deg, dec=dec * u.deg)
+             for ra, dec in zip(rng.uniform(0, 360, args.cones), np.rad2deg(np.arcsin(rng.uniform(-1, 1, args.cones))))]
+
+    for name, path, factory in stores(args.catalog_path):
+        cold, warm = [], []
+        for c in cones:
+            drop_page_cache(path)
+            t0 = time.perf_counter()
+            store = factory(path)
+            get_cat_using_healpix2(c, inst, store=store, mag_limit=mag_limit)
+            cold.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            get_cat_using_healpix2(c, inst, store=store, mag_limit=mag_limit)
+            warm.append(time.perf_counter() - t0)
+            store.close()
+        print(f"{name:12s} {len(healpix_disc(cones[0], inst))} tiles per cone, "
+              f"cold {np.median(cold) * 1e3:8.2f} ms  warm {np.median(warm) * 1e3:8.2f} ms")
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: bench_render.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+# run:
+# poetry run python utils/bench_render.py deposit -i lvm_agc_cam
+
+import argparse
+import os
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from skymakercam.noise import NoiseEngine
+from skymakercam.params import load as params_load
+from skymakercam.readout import readout_frame
+from skymakercam.render import RenderContext, deposit_stars
+from skymakercam.starimage import make_synthetic_image
+
+
+def random_stars(inst, n_stars, rng):
+    chip_x = rng.uniform(0, inst.chip_size_mm[0], n_stars)
+    chip_y = rng.uniform(0, inst.chip_size_mm[1], n_stars)
+    gmag = rng.uniform(8, inst.mag_lim_lower, n_stars)
+    return chip_x, chip_y, gmag
+
+
+def timeit(func, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def deposit_loop(x_position, y_position, flux, shape, exp_time=5):
+    # the per star loop make_synthetic_image used before deposit_stars, as it was, for reference.
+    star_image = np.zeros(shape)
+
+    for index, current_flux in enumerate(flux):
+        current_x = x_position[index]
+        current_y = y_position[index]
+
+        i = int(current_x)
+        j = int(current_y)
+
+        xx = current_x-i
+        yy = current_y-j
+
+        star_image[j,i] = (1 - xx) * (1 - yy) * current_flux * exp_time
+
+        if i < shape[1] - 1:
+            star_image[j,i+1] = (xx) * (1-yy) * current_flux * exp_time
+        if j < shape[0] - 1:
+            star_image[j+1,i] = (1 - xx) * (yy) * current_flux * exp_time
+        if (i < shape[1] - 1) & (j < shape[0] - 1):
+            star_image[j+1,i+1] = (xx) * (yy) * current_flux * exp_time
+    return star_image
+
+
+def expose_baseline(chip_x, chip_y, gmag, inst, binning, exp_time=5, seeing_arcsec=3.5, sky_flux=10, defocus=0.0):
+    # the exposure pipeline before RenderContext, for reference: make_synthetic_image allocating
+    # float64 frames for every step, then the camera binning with rebin and casting to uint16.
+    seeing_pixel = seeing_arcsec * inst.image_scale / (inst.chip_size_mm[0] / inst.chip_size_pix[0] * 1000) / 2.36
+    x_position = chip_x / inst.chip_size_mm[0] * inst.chip_size_pix[0]
+    y_position = chip_y / inst.chip_size_mm[1] * inst.chip_size_pix[1]
+    selection_on_chip = (0 < x_position) & (x_position < inst.chip_size_pix[0]) & (0 < y_position) & (y_position < inst.chip_size_pix[1])
+    gaia_flux = 10 ** (-(gmag[selection_on_chip] + inst.zp) / 2.5)
+    background = (sky_flux + inst.dark_current) * exp_time
+
+    star_image = deposit_loop(x_position[selection_on_chip], y_position[selection_on_chip], gaia_flux,
+                              (inst.chip_size_pix[1], inst.chip_size_pix[0]), exp_time)
+    star_image_c = gaussian_filter(star_image, sigma=seeing_pixel, mode="constant")
+    if defocus != 0.0:
+        star_image_c = gaussian_filter(star_image_c, sigma=defocus, mode='constant')
+    star_image_c_noise = np.random.poisson(lam=star_image_c, size=star_image_c.shape)
+    background_array = np.random.poisson(background, size=star_image.shape)
+    readout_noise_array = np.random.normal(loc=0, scale=inst.readout_noise, size=star_image.shape)
+    combined = star_image_c_noise + background_array + readout_noise_array + inst.bias
+
+    def rebin(arr, bin):
+        new_shape=[int(arr.shape[0]/bin[0]), int(arr.shape[1]/bin[1])]
+        shape = (new_shape[0], arr.shape[0] // new_shape[0],
+                new_shape[1], arr.shape[1] // new_shape[1])
+        return arr.reshape(shape).sum(-1).sum(1)
+
+    return rebin(combined, binning).astype(np.uint16)
+
+
+def expose_context(chip_x, chip_y, gmag, inst, binning, context, backend, defocus=0.0):
+    # the exposure pipeline of the camera: rendering binned into the float32 buffers of context,
+    # then the fused readout into a new uint16 frame.
+    frame = make_synthetic_image(chip_x, chip_y, gmag, inst, defocus=defocus, backend=backend,
+                                 binning=binning, context=context)
+    scratch = context.buffer("readout_scratch", (64, frame.shape[1]))
+    return readout_frame(frame, scratch=scratch)
+
+
+def bench_deposit(inst, args):
+    rng = np.random.default_rng(args.seed)
+    shape = (inst.chip_size_pix[1], inst.chip_size_pix[0])
+    print(f"{'stars':>8} {'loop [ms]':>12} {'deposit [ms]':>14} {'frame [ms]':>12}")
+    for n_stars in args.stars:
+        chip_x, chip_y, gmag = random_stars(inst, n_stars, rng)
+        x_position = chip_x / inst.chip_size_mm[0] * inst.chip_size_pix[0]
+        y_position = chip_y / inst.chip_size_mm[1] * inst.chip_size_pix[1]
+        flux = 10 ** (-(gmag + inst.zp) / 2.5)
+
+        t_loop = timeit(lambda: deposit_loop(x_position, y_position, flux, shape), args.repeat)
+        t_deposit = timeit(lambda: deposit_stars(x_position, y_position, flux, shape), args.repeat)
+        t_frame = timeit(lambda: make_synthetic_image(chip_x, chip_y, gmag, inst), args.repeat)
+        print(f"{n_stars:8d} {t_loop * 1e3:12.2f} {t_deposit * 1e3:14.2f} {t_frame * 1e3:12.2f}")
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_memory(inst, args):
+    rng = np.random.default_rng(args.seed)
+    chip_x, chip_y, gmag = random_stars(inst, args.stars, rng)
+    print(f"{'binning':>8} {'backend':>8} {'peak [MB]':>10} {'buffers [MB]':>13} {'frame [ms]':>11}")
+    for binning in args.binning:
+        def baseline():
+            expose_baseline(chip_x, chip_y, gmag, inst, (binning, binning), defocus=args.defocus)
+        peak = peak_memory(baseline)
+        elapsed = timeit(baseline, args.repeat)
+        print(f"{binning:8d} {'baseline':>8} {peak / 2**20:10.1f} {0.0:13.1f} {elapsed * 1e3:11.1f}")
+        for backend in ("ndimage", "fft", "stamps"):
+            context = RenderContext()
+            def expose():
+                expose_context(chip_x, chip_y, gmag, inst, (binning, binning), context, backend, defocus=args.defocus)
+            # the buffers of context are allocated by the first exposure, the peak is the one of the next
+            expose()
+            peak = peak_memory(expose)
+            elapsed = timeit(expose, args.repeat)
+            print(f"{binning:8d} {backend:>8} {peak / 2**20:10.1f} {context.nbytes / 2**20:13.1f} {elapsed * 1e3:11.1f}")
+
+
+def bench_threads(inst, args):
+    rng = np.random.default_rng(args.seed)
+    chip_x, chip_y, gmag = random_stars(inst, args.stars, rng)
+    print(f"{'threads':>8} {'tiled [ms]':>12} {'speedup':>8}")
+    single = None
+    for threads in range(1, args.max_threads + 1):
+        context = RenderContext(noise=NoiseEngine(seed=args.seed, threads=threads), threads=threads)
+        try:
+            elapsed = timeit(lambda: make_synthetic_image(chip_x, chip_y, gmag, inst, defocus=args.defocus,
+                                                          backend="tiled", context=context), args.repeat)
+        finally:
+            context.close()
+            context.noise.close()
+        single = single or elapsed
+        print(f"{threads:8d} {elapsed * 1e3:12.1f} {single / elapsed:8.2f}")
+
+
+def bench_jitter(inst, args):
+    rng = np.random.default_rng(args.seed)
+    chip_x, chip_y, gmag = random_stars(inst, args.stars, rng)
+    context = RenderContext(noise=NoiseEngine(seed=args.seed))
+    static = timeit(lambda: make_synthetic_image(chip_x, chip_y, gmag, inst, defocus=args.defocus, backend="fft",
+                                                 context=context), args.repeat)
+    print(f"{'substeps':>8} {'frame [ms]':>12} {'per substep [ms]':>17}")
+    print(f"{'static':>8} {static * 1e3:12.1f}")
+    for substeps in args.substeps:
+        elapsed = timeit(lambda: make_synthetic_image(chip_x, chip_y, gmag, inst, defocus=args.defocus, substeps=substeps,
+                                                      tip_tilt_arcsec=0.2, seeing_jitter=0.1, context=context), args.repeat)
+        print(f"{substeps:8d} {elapsed * 1e3:12.1f} {(elapsed - static) / substeps * 1e3:17.2f}")
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", '--instpar', default="lvm_agc_cam",
+                        help="instrument parameter module in skymakercam.params")
+    parser.add_argument("-r", '--repeat', type=int, default=3,
+                        help="repetitions, the best time is reported")
+    parser.add_argument("-s", '--seed', type=int, default=42,
+                        help="random seed for the star fields")
+
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    deposit = subparsers.add_parser("deposit", help="frame time vs star count")
+    deposit.add_argument('stars', type=int, nargs='*', default=[10, 100, 1000, 10000, 100000])
+    deposit.set_defaults(func=bench_deposit)
+
+    memory = subparsers.add_parser("memory", help="peak memory and time per exposure, float64 baseline vs RenderContext")
+    memory.add_argument('-n', '--stars', type=int, default=1000)
+    memory.add_argument('-d', '--defocus', type=float, default=10.0)
+    memory.add_argument('binning', type=int, nargs='*', default=[1, 4])
+    memory.set_defaults(func=bench_memory)
+
+    threads = subparsers.add_parser("threads", help="tiled render scaling from 1 to N threads")
+    threads.add_argument('-n', '--stars', type=int, default=1000)
+    threads.add_argument('-d', '--defocus', type=float, default=10.0)
+    threads.add_argument('max_threads', type=int, nargs='?', default=os.cpu_count())
+    threads.set_defaults(func=bench_threads)
+
+    jitter = subparsers.add_parser("jitter", help="overhead per sub step of tip/tilt and seeing jitter")
+    jitter.add_argument('-n', '--stars', type=int, default=1000)
+    jitter.add_argument('-d', '--defocus', type=float, default=10.0)
+    jitter.add_argument('substeps', type=int, nargs='*', default=[2, 5, 10, 50, 100])
+    jitter.set_defaults(func=bench_jitter)
+
+    args = parser.parse_args()
+
+    inst = params_load(f"skymakercam.params.{args.instpar}")
+    args.func(inst, args)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: build_tiles.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+# run:
+# poetry run python utils/build_tiles.py $HOME/data/catalog/gaia $HOME/data/gaia_source/GaiaSource_*.csv.gz
+
+import argparse
+import os
+
+from skymakercam.tilebuilder import build_tiles
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="build the Gaia_Healpix_6 tiles from a Gaia source dump, "
+                                                 "run again to resume an interrupted build")
+    parser.add_argument('catalog_path', help="catalog directory, the tiles are written to its Gaia_Healpix_6")
+    parser.add_argument('sources', nargs='+', help="CSV (.csv, .csv.gz) or FITS files of the dump")
+    parser.add_argument("-p", '--processes', type=int, default=None, help="worker processes, one per cpu by default")
+    parser.add_argument("-c", '--chunk-rows', type=int, default=500000, help="rows read at once from a file")
+    parser.add_argument("-b", '--bucket-nside', type=int, default=4,
+                        help="HEALPix nside of the buckets merged at once, larger for less memory per process")
+    parser.add_argument("-w", '--work', default=None, help="directory of the intermediate parts")
+
+    args = parser.parse_args()
+
+    def progress(stats):
+        print(f"\r{stats['files'] + stats['skipped_files']}/{len(args.sources)} files "
+              f"{stats['rows']} rows {stats['rows_per_s']:.0f} rows/s {stats['mb_per_s']:.1f} MiB/s "
+              f"{stats['buckets'] + stats['skipped_buckets']} buckets {stats['tiles']} tiles", end="", flush=True)
+
+    stats = build_tiles(args.sources, os.path.join(args.catalog_path, "Gaia_Healpix_6"), work=args.work,
+                        bucket_nside=args.bucket_nside, chunk_rows=args.chunk_rows, processes=args.processes, progress=progress)
+    print(f"\n{stats['rows']} rows of {stats['files']} files ({stats['skipped_files']} done before) into "
+          f"{stats['tiles']} tiles of {stats['buckets']} buckets ({stats['skipped_buckets']} done before) "
+          f"in {stats['seconds']:.1f} s")
+
+
+if __name__ == '__main__':
+
+    main()
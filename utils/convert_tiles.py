@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: convert_tiles.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+# run:
+# poetry run python utils/convert_tiles.py $HOME/data/catalog/gaia
+
+import argparse
+import os
+import time
+
+from skymakercam.tilestore import convert_fits_tiles, convert_npy_tiles
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="convert catalog tiles to the columnar, magnitude sorted format")
+    parser.add_argument('catalog_path', help="catalog directory holding Gaia_Healpix_6 or Gaia_Healpix_64")
+    parser.add_argument("-s", '--source', choices=["npy", "fits"], default=None,
+                        help="convert Gaia_Healpix_6 npy or Gaia_Healpix_64 fits tiles, the npy ones if present by default")
+    parser.add_argument("-o", '--output', default=None,
+                        help="target directory, catalog_path/Gaia_Healpix_6_columns by default")
+
+    args = parser.parse_args()
+
+    npy = os.path.join(args.catalog_path, "Gaia_Healpix_6")
+    source = args.source or ("npy" if os.path.isdir(npy) else "fits")
+    target = args.output or os.path.join(args.catalog_path, "Gaia_Healpix_6_columns")
+
+    t0 = time.time()
+    if source == "npy":
+        converted = convert_npy_tiles(npy, target)
+    else:
+        converted = convert_fits_tiles(os.path.join(args.catalog_path, "Gaia_Healpix_64"), target)
+    print(f"converted {converted} {source} tiles to {target} in {time.time() - t0:.1f} s")
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# @Author: Florian Briegel (briegel@mpia.de)
+# @Date: 2026-10-18
+# @Filename: pack_tiles.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+# run:
+# poetry run python utils/pack_tiles.py $HOME/data/catalog/gaia
+# poetry run python utils/pack_tiles.py $HOME/data/catalog/gaia --pyramid 8:12 32:15 64
+
+import argparse
+import os
+import time
+
+from skymakercam.tilestore import PYRAMID_LEVELS, ColumnTileStore, TileStore, tile_pixels, write_packed_store, write_pyramid
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="pack the catalog tiles into one memory mapped file")
+    parser.add_argument('catalog_path', help="catalog directory holding Gaia_Healpix_6_columns or Gaia_Healpix_6")
+    parser.add_argument("-o", '--output', default=None,
+                        help="packed store file, catalog_path/Gaia_Healpix_6.pack by default, "
+                             "or pyramid directory, catalog_path/Gaia_Healpix_pyramid by default")
+    parser.add_argument("-p", '--pyramid', nargs='*', default=None, metavar="NSIDE[:MAG]",
+                        help="build a magnitude pyramid of levels nside:faintest magnitude, brightest first, "
+                             "the last one without magnitude, "
+                             f"{' '.join(f'{nside}:{mag}' if mag else str(nside) for nside, mag in PYRAMID_LEVELS)} "
+                             "if none are given")
+
+    args = parser.parse_args()
+
+    columns = os.path.join(args.catalog_path, "Gaia_Healpix_6_columns")
+    if os.path.isdir(columns):
+        store, pattern = ColumnTileStore(columns, threads=1), "lvl6_{:06d}.npz"
+    else:
+        store, pattern = TileStore(os.path.join(args.catalog_path, "Gaia_Healpix_6"), threads=1), "lvl6_{:06d}.npy"
+    pixels = tile_pixels(store.directory, pattern)
+
+    t0 = time.time()
+    if args.pyramid is not None:
+        levels = [(int(level.split(":")[0]), float(level.split(":")[1]) if ":" in level else None)
+                  for level in args.pyramid] or PYRAMID_LEVELS
+        output = args.output or os.path.join(args.catalog_path, "Gaia_Healpix_pyramid")
+        rows = write_pyramid(output, store, pixels, levels=levels)
+        for (nside, mag), level_rows in zip(levels, rows):
+            print(f"level nside {nside} to G {mag or 'end'}: {level_rows} stars")
+        print(f"built the pyramid {output} from {len(pixels)} tiles of {store.directory} in {time.time() - t0:.1f} s")
+        return
+
+    output = args.output or os.path.join(args.catalog_path, "Gaia_Healpix_6.pack")
+    rows = write_packed_store(output, store, pixels)
+    print(f"packed {rows} stars of {len(pixels)} tiles from {store.directory} into {output} "
+          f"({os.path.getsize(output) / 2**20:.1f} MiB) in {time.time() - t0:.1f} s")
+
+
+if __name__ == '__main__':
+
+    main()
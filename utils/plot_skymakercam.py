@@ -33,7 +33,7 @@ from cluplus.proxy import Proxy, invoke, unpack
 from skymakercam.camera import SkymakerCameraSystem, SkymakerCamera, asyncio
 
 
-async def plot_skymakercam(exptime, binning, guiderect, camname, verb=False, config="../etc/cameras.yaml"):
+async def plot_skymakercam(exptime, binning, guiderect, camname, verb=False, config="../etc/cameras.yaml", fps=None):
 
     cs = SkymakerCameraSystem(SkymakerCamera, camera_config=config, verbose=verb)
     cam = await cs.add_camera(name=camname, uid=cs._config[camname]["uid"])
@@ -63,21 +63,26 @@ async def plot_skymakercam(exptime, binning, guiderect, camname, verb=False, con
     p = PlotIt(exp.data, guiderect, logger=cs.logger.log)
 
     keyreader = KeyReader(echo=False, block=False)
-    while(True):
-        find_objects = False
-        
-        key = keyreader.getch()
-        if key == 'q':
-            cs.logger.log(logging.DEBUG, f"Goodbye and thanks for all the fish.")
-            break
-        elif key == 'o':
-            cs.logger.log(logging.DEBUG, f"Find objects.")
-            find_objects = True
-        elif key:
-            cs.logger.log(logging.DEBUG, f"-{key}-")
-
-        exp = await cam.expose(exptime, "LAB TEST")
-        p.update(exp.data, find_objects)
+    # the next frame is rendered while this one is plotted, frames we are too slow for are dropped
+    async with cam.stream(exptime, fps=fps, maxsize=2, policy="drop-oldest", image_type="LAB TEST") as video:
+        async for exp in video:
+            find_objects = False
+
+            key = keyreader.getch()
+            if key == 'q':
+                cs.logger.log(logging.DEBUG, f"Goodbye and thanks for all the fish.")
+                break
+            elif key == 'o':
+                cs.logger.log(logging.DEBUG, f"Find objects.")
+                find_objects = True
+            elif key == 's':
+                cs.logger.log(logging.DEBUG, f"video {video.stats()}")
+            elif key:
+                cs.logger.log(logging.DEBUG, f"-{key}-")
+
+            p.update(exp.data, find_objects)
+
+        cs.logger.log(logging.DEBUG, f"video {video.stats()}")
 
 def main():
 
@@ -86,6 +91,9 @@ def main():
     parser.add_argument("-e", '--exptime', type=float, default=5.0,
                         help="Expose for for exptime seconds")
 
+    parser.add_argument("-f", '--fps', type=float, default=None,
+                        help="Frames per second, as fast as possible if not given")
+
     parser.add_argument("-b", '--binning', type=int, default=1,
                         help="Image Binning")
 
@@ -105,7 +113,7 @@ def main():
 
     args = parser.parse_args()
 
-    asyncio.run(plot_skymakercam(args.exptime, args.binning, args.guiderect, args.camname, verb=args.verbose, config=args.cfg))
+    asyncio.run(plot_skymakercam(args.exptime, args.binning, args.guiderect, args.camname, verb=args.verbose, config=args.cfg, fps=args.fps))
     
             
 if __name__ == '__main__':